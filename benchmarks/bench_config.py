@@ -0,0 +1,286 @@
+# No shebang line, this module is meant to be run with `python -m`
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks for :class:`pyfarm.core.config.Configuration`.  Each run builds
+synthetic configuration trees in a temporary directory and times:
+
+    * ``init``: :meth:`Configuration.__init__` for a package name, which
+      looks up the distribution and the package configuration file, and for
+      a plain name with an explicit version.
+    * ``files``: discovery using :meth:`Configuration.files` with a cold
+      and a warm directory index.
+    * ``load``: :meth:`Configuration.load` on a new instance (every file
+      is parsed) and again on the same instance.
+    * ``expand``: looking up the end of a chain of ``$variable``
+      references with and without the expansion cache.
+    * ``load.fragments``: :meth:`Configuration.load` of a directory of
+      fragments using each number of ``parse_threads``.  This is the
+      case threads are meant to help so any default other than ``1``
+      should be faster here.
+
+Results are written as json and may be compared against a previous run::
+
+    python -m benchmarks.bench_config --output baseline.json
+    python -m benchmarks.bench_config --baseline baseline.json
+
+The second command exits with a non-zero status if any benchmark is more
+than ``--threshold`` times slower than the baseline.
+"""
+
+from __future__ import print_function, with_statement
+
+import os
+import sys
+import shutil
+import logging
+import tempfile
+from argparse import ArgumentParser
+from os.path import join, isdir
+
+from pyfarm.core.config import Configuration, DiscoveryIndex
+
+from benchmarks.harness import best, compare, report, save
+
+
+def version_string(depth):
+    """Returns a version with ``depth`` components, such as ``1.2.3``"""
+    return ".".join(str(index) for index in range(1, depth + 1))
+
+
+def build_tree(root, depth, keys, chain=0):
+    """
+    Builds a configuration tree under ``root`` and returns a function which
+    creates a :class:`Configuration` pointed at it.  Every root and version
+    directory contains a file with ``keys`` keys, the unversioned system
+    file also contains a chain of ``chain`` variable references ending in
+    ``chain<chain>``.
+    """
+    version = version_string(depth)
+    local = join(root, "local")
+
+    def create(discovery_index=None):
+        config = Configuration("bench", version, cwd=local)
+        config.system_root = join(root, "system")
+        config.user_root = join(root, "user")
+        config.environment_root = join(root, "environment")
+        if discovery_index is not None:
+            config.discovery_index = discovery_index
+        return config
+
+    config = create()
+    filename = config.name + config.file_extension
+    for index, directory in enumerate(config.directories(validate=False)):
+        if not isdir(directory):
+            os.makedirs(directory)
+        with open(join(directory, filename), "w") as stream:
+            for key in range(keys):
+                stream.write("key%s: value%s-%s\n" % (key, index, key))
+
+    if chain:
+        path = join(config.system_root, config.child_dir, filename)
+        with open(path, "a") as stream:
+            stream.write("chain0: start\n")
+            for link in range(1, chain + 1):
+                stream.write("chain%s: $chain%s/%s\n" % (link, link - 1, link))
+
+    return create
+
+
+def bench_init(repeat, number):
+    results = []
+    results.append({
+        "name": "init",
+        "params": {"package": True},
+        "seconds": best(
+            lambda: Configuration("pyfarm.core"),
+            repeat=repeat, number=number)})
+    results.append({
+        "name": "init",
+        "params": {"package": False},
+        "seconds": best(
+            lambda: Configuration("bench", "1.2.3"),
+            repeat=repeat, number=number)})
+    return results
+
+
+def bench_tree(root, depth, keys, repeat, number):
+    results = []
+    params = {"depth": depth, "keys": keys}
+    create = build_tree(root, depth, keys)
+
+    # A ttl of zero forces every lookup to list the directory again
+    cold_index = DiscoveryIndex(ttl=0)
+    cold = create(discovery_index=cold_index)
+    warm = create(discovery_index=DiscoveryIndex(ttl=3600))
+    results.append({
+        "name": "files.cold",
+        "params": params,
+        "seconds": best(cold.files, repeat=repeat, number=number)})
+    results.append({
+        "name": "files.warm",
+        "params": params,
+        "seconds": best(warm.files, repeat=repeat, number=number)})
+
+    results.append({
+        "name": "load.cold",
+        "params": params,
+        "seconds": best(
+            lambda: create(discovery_index=cold_index).load(),
+            repeat=repeat, number=number)})
+    config = create()
+    config.load()
+    results.append({
+        "name": "load.warm",
+        "params": params,
+        "seconds": best(config.load, repeat=repeat, number=number)})
+    return results
+
+
+def bench_expansion(root, chain, repeat, number):
+    config = build_tree(root, 1, 0, chain=chain)()
+    config.load()
+    key = "chain%s" % chain
+    return [
+        {"name": "expand.uncached",
+         "params": {"chain": chain},
+         "seconds": best(
+             lambda: config[key], setup=config.clear_expansion_cache,
+             repeat=repeat, number=number)},
+        {"name": "expand.cached",
+         "params": {"chain": chain},
+         "seconds": best(
+             lambda: config[key], repeat=repeat, number=number)}]
+
+
+def bench_fragments(root, fragments, keys, threads, repeat, number):
+    create = build_tree(root, 1, keys)
+    config = create()
+    directory = config.fragment_directory(
+        join(config.system_root, config.child_dir))
+    os.makedirs(directory)
+    for fragment in range(fragments):
+        path = join(directory, "%04d%s" % (fragment, config.file_extension))
+        with open(path, "w") as stream:
+            for key in range(keys):
+                stream.write("key%s: fragment%s-%s\n" % (key, fragment, key))
+
+    results = []
+    for thread_count in threads:
+        def load():
+            # A new instance so every file is parsed
+            config = create()
+            config.parse_threads = thread_count
+            config.load()
+
+        results.append({
+            "name": "load.fragments",
+            "params": {
+                "fragments": fragments, "keys": keys,
+                "threads": thread_count},
+            "seconds": best(load, repeat=repeat, number=number)})
+    return results
+
+
+def run(depths, keys, chains, repeat, number, fragments=(60, ),
+        threads=(1, 4)):
+    """Runs every benchmark and returns a list of results"""
+    results = bench_init(repeat, number)
+    root = tempfile.mkdtemp(prefix="pyfarm-bench-")
+    try:
+        for depth in depths:
+            for key_count in keys:
+                results.extend(bench_tree(
+                    join(root, "tree-%s-%s" % (depth, key_count)),
+                    depth, key_count, repeat, number))
+
+        for chain in chains:
+            results.extend(bench_expansion(
+                join(root, "chain-%s" % chain), chain, repeat, number))
+
+        for fragment_count in fragments:
+            results.extend(bench_fragments(
+                join(root, "fragments-%s" % fragment_count), fragment_count,
+                max(keys), threads, repeat, number))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def integers(value):
+    return [int(item) for item in value.split(",")]
+
+
+def main(args=None):
+    parser = ArgumentParser(description="Benchmarks pyfarm.core.config")
+    parser.add_argument(
+        "--depth", type=integers, default=[1, 3, 5],
+        help="Comma separated number of version components, each adds one "
+             "directory per root [default: %(default)s]")
+    parser.add_argument(
+        "--keys", type=integers, default=[10, 250],
+        help="Comma separated number of keys in each file "
+             "[default: %(default)s]")
+    parser.add_argument(
+        "--chain", type=integers, default=[1, 10, 100],
+        help="Comma separated lengths of variable reference chains "
+             "[default: %(default)s]")
+    parser.add_argument(
+        "--fragments", type=integers, default=[60],
+        help="Comma separated number of fragment files to load "
+             "[default: %(default)s]")
+    parser.add_argument(
+        "--threads", type=integers, default=[1, 4],
+        help="Comma separated values of parse_threads to load the "
+             "fragments with [default: %(default)s]")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--number", type=int, default=5)
+    parser.add_argument("--output", help="Write the results to this file")
+    parser.add_argument(
+        "--baseline", help="Compare the results to this file")
+    parser.add_argument(
+        "--threshold", type=float, default=1.25,
+        help="Ratio to the baseline above which a result is considered a "
+             "regression [default: %(default)s]")
+    parser.add_argument(
+        "--verbose", action="store_true",
+        help="Keep logging enabled while running, this is slower")
+    parsed = parser.parse_args(args)
+
+    if not parsed.verbose:
+        logging.getLogger("pf").setLevel(logging.CRITICAL)
+
+    results = run(
+        parsed.depth, parsed.keys, parsed.chain, parsed.repeat, parsed.number,
+        fragments=parsed.fragments, threads=parsed.threads)
+    report(results)
+
+    if parsed.output:
+        save(parsed.output, results)
+
+    if parsed.baseline:
+        regressions = compare(results, parsed.baseline, parsed.threshold)
+        for key, baseline, current, ratio in regressions:
+            print("REGRESSION %s: %.3f us -> %.3f us (%.2fx)" % (
+                key, baseline * 1e6, current * 1e6, ratio))
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
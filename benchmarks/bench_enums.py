@@ -0,0 +1,184 @@
+# No shebang line, this module is meant to be run with `python -m`
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the cost of the common operations on enum values: equality
+against each form of a value, hashing, ordering, membership in a mapped
+enum and converting between the ``int`` and ``str`` forms.  Each
+operation is timed for :class:`pyfarm.core.enums.Values` and for
+``NamedTupleValues``, a copy of the previous implementation which kept a
+``set`` in a per-instance ``__dict__``.  The bulk functions, such as
+:func:`pyfarm.core.enums.count_states`, are timed against a loop over
+each value for a rollup of a million states::
+
+    python -m benchmarks.bench_enums
+"""
+
+from __future__ import print_function
+
+import sys
+from collections import namedtuple
+
+from pyfarm.core.enums import (
+    STRING_TYPES, Values, WorkState, DBWorkState, StateDict, _WorkState,
+    encode_states, count_states, state_mask, _numpy)
+
+from benchmarks.harness import best
+
+
+class NamedTupleValues(namedtuple("Values", ("int", "str"))):
+    """The implementation of Values before it used __slots__"""
+    NUMERIC_TYPES = Values.NUMERIC_TYPES
+
+    def __init__(self, *args, **kwargs):
+        self._values = set([self.int, self.str])
+
+    def __hash__(self):
+        return self.str.__hash__()
+
+    def __contains__(self, item):
+        if isinstance(item, STRING_TYPES):
+            return item == self.str
+        elif isinstance(item, self.NUMERIC_TYPES):
+            return item == self.int
+        elif isinstance(item, NamedTupleValues):
+            return item.str == self.str and item.int == self.int
+        else:
+            return False
+
+    def __eq__(self, other):
+        return self.__contains__(other)
+
+    def __gt__(self, other):
+        if isinstance(other, self.NUMERIC_TYPES):
+            return other < self.int
+        elif isinstance(other, NamedTupleValues):
+            return other.int < self.int
+        else:
+            raise NotImplementedError(
+                "Cannot compare against %s" % type(other))
+
+
+def operations(value, other):
+    """
+    Returns a list of ``(name, function)`` tuples which exercise
+    ``value``, ``other`` is an equal value of the same type.
+    """
+    return [
+        ("eq str", lambda: value == "running"),
+        ("eq int", lambda: value == 105),
+        ("eq values", lambda: value == other),
+        ("hash", lambda: hash(value)),
+        ("gt int", lambda: value > 100),
+        ("dict key by str", lambda: {value: 1}["running"])]
+
+
+def run(number=100000):
+    """
+    Runs each benchmark and returns a list of ``(name, old, new)`` tuples
+    of the time in seconds a single operation took.
+    """
+    Values.check_uniqueness = False
+    old = NamedTupleValues(105, "running")
+    new = Values(105, "running")
+    results = []
+    for (name, old_function), (_, new_function) in zip(
+            operations(old, NamedTupleValues(105, "running")),
+            operations(new, Values(105, "running"))):
+        results.append((
+            name, best(old_function, number=number),
+            best(new_function, number=number)))
+
+    # Mapped enum lookups have no previous implementation to compare to
+    states = StateDict.filled(WorkState, int)
+    for name, function in (
+            ("StateDict[str]", lambda: states["running"]),
+            ("StateDict[int]", lambda: states[105]),
+            ("in WorkState (hit)", lambda: "running" in WorkState),
+            ("in WorkState (miss)", lambda: "missing" in WorkState),
+            ("in WorkState (values)", lambda: _WorkState.DONE in WorkState),
+            ("DBWorkState._normalize str", lambda: DBWorkState._normalize(
+                "running")),
+            ("WorkState._normalize int", lambda: WorkState._normalize(105))):
+        results.append((name, None, best(function, number=number)))
+
+    return results
+
+
+def run_bulk(count=1000000, use_numpy=None):
+    """
+    Times encoding, counting and masking ``count`` work states in bulk and
+    one at a time.  Returns a list of ``(name, loop, bulk)`` tuples of
+    the time in seconds each took.
+    """
+    names = [value.str for value in sorted(_WorkState)]
+    states = [names[index % len(names)] for index in range(count)]
+    codes = encode_states(WorkState, states, use_numpy=use_numpy)
+
+    def count_loop():
+        counts = StateDict.filled(WorkState, int)
+        for state in states:
+            counts[state] += 1
+        return counts
+
+    running = DBWorkState.RUNNING
+    return [
+        ("encode", best(
+            lambda: [DBWorkState._normalize(state) for state in states],
+            repeat=3, number=1),
+         best(lambda: encode_states(WorkState, states, use_numpy=use_numpy),
+              repeat=3, number=1)),
+        ("count", best(count_loop, repeat=3, number=1),
+         best(lambda: count_states(WorkState, codes), repeat=3, number=1)),
+        ("mask", best(
+            lambda: [code == running for code in codes],
+            repeat=3, number=1),
+         best(lambda: state_mask(WorkState, codes, ["running"]),
+              repeat=3, number=1))]
+
+
+def main():
+    number = 100000
+    print("%-30s %14s %14s" % (
+        "operation", "namedtuple (ns)", "slotted (ns)"))
+    for name, old, new in run(number):
+        print("%-30s %14s %14.1f" % (
+            name, "-" if old is None else "%.1f" % (old * 1e9), new * 1e9))
+
+    print("\n%-30s %14s %14s" % ("memory", "namedtuple", "slotted"))
+    print("%-30s %14d %14d" % (
+        "bytes per instance", instance_size(NamedTupleValues(1, "a")),
+        instance_size(Values(1, "a"))))
+
+    print("\n%-30s %14s %14s" % (
+        "1M states (numpy)" if _numpy() is not None else "1M states",
+        "loop (ms)", "bulk (ms)"))
+    for name, loop, bulk in run_bulk():
+        print("%-30s %14.1f %14.1f" % (name, loop * 1e3, bulk * 1e3))
+
+
+def instance_size(value):
+    """Returns the size of ``value`` including its ``__dict__``, if any"""
+    size = sys.getsizeof(value)
+    attributes = getattr(value, "__dict__", None)
+    if attributes is not None:
+        size += sys.getsizeof(attributes)
+        size += sum(sys.getsizeof(item) for item in attributes.values())
+    return size
+
+
+if __name__ == "__main__":
+    main()
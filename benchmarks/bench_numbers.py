@@ -0,0 +1,71 @@
+# No shebang line, this module is meant to be run with `python -m`
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares :func:`ast.literal_eval` with :func:`pyfarm.core.config.parse_number`
+and :func:`pyfarm.core.config.parse_numbers` for the kinds of numbers we
+read from environment variables and job submissions::
+
+    python -m benchmarks.bench_numbers
+"""
+
+from __future__ import print_function
+
+import random
+from ast import literal_eval
+
+from pyfarm.core.config import parse_number, parse_numbers
+
+from benchmarks.harness import best
+
+random.seed(0)
+INTEGERS = [str(random.randint(-10 ** 6, 10 ** 6)) for _ in range(1000)]
+FLOATS = ["%.6f" % random.uniform(-1000, 1000) for _ in range(1000)]
+EXPONENTS = ["%.3e" % random.uniform(-1000, 1000) for _ in range(1000)]
+HEX = [hex(random.randint(0, 10 ** 6)) for _ in range(1000)]
+
+COLUMNS = (
+    ("integers", INTEGERS),
+    ("floats", FLOATS),
+    ("exponents", EXPONENTS),
+    ("hex", HEX))
+
+
+def run():
+    """Runs each benchmark and returns a list of (name, old, new) tuples"""
+    results = []
+    for name, column in COLUMNS:
+        results.append((
+            "%s: literal_eval vs parse_number" % name,
+            best(lambda: [literal_eval(value) for value in column]),
+            best(lambda: [parse_number(value) for value in column])))
+        results.append((
+            "%s: literal_eval vs parse_numbers" % name,
+            best(lambda: [literal_eval(value) for value in column]),
+            best(lambda: parse_numbers(column))))
+    return results
+
+
+def main():
+    print("%-45s %12s %12s %8s" % ("benchmark (1000 values)", "before (ms)",
+                                   "after (ms)", "speedup"))
+    for name, old, new in run():
+        print("%-45s %12.3f %12.3f %7.1fx" % (
+            name, old * 1000, new * 1000, old / new))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# No shebang line, this module is meant to be imported
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Shared helpers for timing benchmarks, saving the results as json and
+comparing them against a saved baseline.
+"""
+
+from __future__ import print_function, with_statement
+
+import json
+import platform
+import sys
+import time
+from timeit import Timer
+
+
+def best(function, repeat=5, number=20, setup=None):
+    """
+    Returns the fastest time, in seconds, of a single call to ``function``.
+    ``setup`` is called before each call to ``function`` and is not timed.
+    """
+    if setup is None:
+        return min(
+            Timer(function).repeat(repeat=repeat, number=number)) / number
+
+    timings = []
+    for _ in range(repeat):
+        total = 0.0
+        for _ in range(number):
+            setup()
+            start = time.time()
+            function()
+            total += time.time() - start
+        timings.append(total / number)
+    return min(timings)
+
+
+def result_key(result):
+    """Returns the key used to match a result against the baseline"""
+    return "%s%s" % (
+        result["name"], json.dumps(result["params"], sort_keys=True))
+
+
+def save(path, results):
+    """Writes ``results`` to ``path`` along with details of the interpreter"""
+    document = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "time": time.time(),
+        "results": results}
+    with open(path, "w") as stream:
+        json.dump(document, stream, indent=4, sort_keys=True)
+
+
+def compare(results, baseline_path, threshold):
+    """
+    Compares ``results`` against the results saved in ``baseline_path`` and
+    returns a list of ``(key, baseline, current, ratio)`` tuples for each
+    result which is more than ``threshold`` times slower than the baseline.
+    """
+    with open(baseline_path, "r") as stream:
+        baseline = dict(
+            (result_key(result), result["seconds"])
+            for result in json.load(stream)["results"])
+
+    regressions = []
+    for result in results:
+        key = result_key(result)
+        if key not in baseline or not baseline[key]:
+            continue
+
+        ratio = result["seconds"] / baseline[key]
+        if ratio > threshold:
+            regressions.append((key, baseline[key], result["seconds"], ratio))
+    return regressions
+
+
+def report(results, stream=sys.stdout):
+    """Prints a table of ``results``"""
+    for result in results:
+        params = ", ".join(
+            "%s=%s" % (key, result["params"][key])
+            for key in sorted(result["params"]))
+        print("%-32s %-36s %12.3f us" % (
+            result["name"], params, result["seconds"] * 1e6), file=stream)
@@ -0,0 +1,456 @@
+# No shebang line, this module is meant to be imported
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Configuration Bundles
+=====================
+
+A bundle is a single binary file containing the fully merged, and
+optionally expanded, data for a :class:`pyfarm.core.config.Configuration`.
+Loading a bundle skips file discovery and parsing entirely, the file is
+mapped into memory with :mod:`mmap` and values are unpickled from it on
+demand.
+
+Each bundle records the files it was built from, along with a hash of
+their contents, so :meth:`Bundle.stale` can tell when a bundle no longer
+matches what is on disk.  Bundles are built using the
+``pyfarm-config-bundle`` command or :func:`main`::
+
+    pyfarm-config-bundle pyfarm.agent --output /var/lib/pyfarm/agent.bundle
+
+A process can also share its loaded configuration with worker processes
+using :meth:`pyfarm.core.config.Configuration.share`.  Workers attach to
+the result with :class:`SharedBundle` which maps the same file, read-only,
+instead of searching for and parsing the configuration files again or
+receiving a pickled copy of the whole configuration:
+
+>>> path = config.share()  # in the parent
+>>> shared = SharedBundle(path)  # in each worker
+>>> shared.refresh()  # True if the parent shared a newer generation
+
+The layout of a bundle is a fixed size header (:const:`HEADER`), a pickled
+dictionary of metadata which includes an index of where each key's
+value is, followed by the pickled value of each key.
+"""
+
+from __future__ import with_statement
+
+import os
+import mmap
+import struct
+from hashlib import sha1
+from tempfile import mkstemp
+from os.path import abspath, basename, dirname, isfile
+
+try:
+    import cPickle as pickle
+except ImportError:  # pragma: no cover
+    import pickle
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover
+    from collections import Mapping
+
+from pyfarm.core.enums import WINDOWS, POSIX
+from pyfarm.core.logger import getLogger
+
+logger = getLogger("core.bundle")
+
+MAGIC = b"PFCB"
+FORMAT_VERSION = 1
+PICKLE_PROTOCOL = 2
+
+# magic, format version, length of the pickled metadata
+HEADER = struct.Struct("<4sHI")
+
+
+class BundleError(ValueError):
+    """Raised when a file is not a bundle or could not be read"""
+
+
+def hash_file(path):
+    """Returns the sha1 hex digest of the contents of ``path``"""
+    digest = sha1()
+    with open(path, "rb") as stream:
+        for chunk in iter(lambda: stream.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def describe_sources(sources):
+    """
+    Returns a list of ``(path, size, mtime, sha1)`` tuples, one for
+    each path in ``sources``.
+    """
+    described = []
+    for path in sources:
+        stat = os.stat(path)
+        described.append(
+            (abspath(path), stat.st_size, stat.st_mtime, hash_file(path)))
+    return described
+
+
+def list_fragments(directory, extensions):
+    """
+    Returns a sorted list of the names of the files in ``directory``
+    which end in one of ``extensions``, ignoring hidden files.  This
+    matches the fragments :meth:`pyfarm.core.config.Configuration.fragments`
+    would load from ``directory``.  An empty list is returned if
+    ``directory`` does not exist.
+    """
+    try:
+        filenames = os.listdir(directory)
+    except OSError:
+        return []
+
+    extensions = tuple(extensions)
+    return sorted(
+        filename for filename in filenames
+        if filename.endswith(extensions) and not filename.startswith("."))
+
+
+def write_bundle(path, data, sources=(), missing=(), fragments=(),
+                 environment=None, **metadata):
+    """
+    Writes a bundle to ``path``.  The bundle is written to a temporary
+    file first and then renamed so readers never see a partial bundle.
+    The temporary file is created with a random name and is readable
+    only by the current user so a file or symlink planted in the same
+    directory, which may be shared, is never written through.
+
+    :param dict data:
+        The data to store in the bundle
+
+    :param sources:
+        The paths of the files ``data`` was built from
+
+    :param missing:
+        Paths which did not exist when ``data`` was built but would have
+        been used if they had.  If any of these paths exist later on
+        the bundle is considered stale.
+
+    :param fragments:
+        A list of ``(directory, extensions, filenames)`` tuples, one
+        for each fragment directory which was searched when ``data``
+        was built, with ``filenames`` being the result of
+        :func:`list_fragments`.  If a fragment is added to or removed
+        from one of these directories later on the bundle is considered
+        stale.
+
+    :param dict environment:
+        The merged ``env`` data from the configuration files
+
+    :param metadata:
+        Any additional metadata to store in the bundle such as the
+        name and version of the configuration.
+    """
+    described = describe_sources(sources)
+    digest = sha1()
+    for source_path, _, _, source_digest in described:
+        digest.update(source_path.encode("utf-8"))
+        digest.update(source_digest.encode("utf-8"))
+
+    index = {}
+    payload = []
+    offset = 0
+    for key, value in data.items():
+        pickled = pickle.dumps(value, PICKLE_PROTOCOL)
+        index[key] = (offset, len(pickled))
+        payload.append(pickled)
+        offset += len(pickled)
+
+    metadata.update(
+        sources=described,
+        missing=[abspath(missing_path) for missing_path in missing],
+        fragments=[
+            (abspath(directory), tuple(extensions), list(filenames))
+            for directory, extensions, filenames in fragments],
+        hash=digest.hexdigest(),
+        environment=environment or {},
+        index=index)
+    pickled_metadata = pickle.dumps(metadata, PICKLE_PROTOCOL)
+
+    directory = dirname(abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+
+    descriptor, temp_path = mkstemp(
+        prefix=basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(descriptor, "wb") as stream:
+            stream.write(
+                HEADER.pack(MAGIC, FORMAT_VERSION, len(pickled_metadata)))
+            stream.write(pickled_metadata)
+            for pickled in payload:
+                stream.write(pickled)
+
+        if WINDOWS and isfile(path):  # pragma: no cover
+            os.remove(path)
+
+        os.rename(temp_path, path)
+
+    except Exception:
+        if isfile(temp_path):
+            os.remove(temp_path)
+        raise
+
+    logger.info("Wrote %s key(s) to %r", len(index), path)
+
+
+class Bundle(Mapping):
+    """
+    Read-only mapping backed by a bundle written by :func:`write_bundle`.
+    The bundle is mapped into memory and each value is unpickled the
+    first time it is requested.
+
+    :param string path:
+        The path to the bundle
+
+    :raises BundleError:
+        Raised if ``path`` is not a bundle, is damaged, was written using
+        a different version of the bundle format or, on posix platforms,
+        is not owned by the current user.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._mmap = None
+        self._values = {}
+
+        with open(path, "rb") as stream:
+            # Never unpickle data which someone else could have written,
+            # the same as pyfarm.core.config.read_pickle_cache()
+            if POSIX and os.fstat(stream.fileno()).st_uid != os.getuid():
+                raise BundleError(
+                    "%r is not owned by the current user" % path)
+
+            try:
+                self._mmap = mmap.mmap(
+                    stream.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, mmap.error) as e:
+                raise BundleError("Failed to map %r: %s" % (path, e))
+
+        try:
+            magic, version, length = HEADER.unpack_from(self._mmap, 0)
+        except struct.error:
+            self.close()
+            raise BundleError("%r is too small to be a bundle" % path)
+
+        if magic != MAGIC:
+            self.close()
+            raise BundleError("%r is not a bundle" % path)
+
+        if version != FORMAT_VERSION:
+            self.close()
+            raise BundleError(
+                "%r uses bundle format %s, expected %s" % (
+                    path, version, FORMAT_VERSION))
+
+        start = HEADER.size
+        try:
+            self.metadata = pickle.loads(self._mmap[start:start + length])
+            self._index = self.metadata["index"]
+        except Exception as e:
+            self.close()
+            raise BundleError(
+                "Failed to read the metadata in %r: %s" % (path, e))
+        self._payload = start + length
+
+    @property
+    def environment(self):
+        """The merged ``env`` data stored in the bundle"""
+        return self.metadata["environment"]
+
+    @property
+    def sources(self):
+        """The paths of the files the bundle was built from"""
+        return tuple(source[0] for source in self.metadata["sources"])
+
+    def stale(self):
+        """
+        Returns True if any of the files the bundle was built from have
+        changed, if a file which did not exist at the time the bundle
+        was built now exists or if a fragment was added to or removed
+        from one of the fragment directories.  Files whose size and modification time are
+        unchanged are assumed to be unchanged, otherwise their contents
+        are hashed and compared.
+        """
+        for path, size, mtime, digest in self.metadata["sources"]:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return True
+
+            if stat.st_size == size and stat.st_mtime == mtime:
+                continue
+
+            if stat.st_size != size or hash_file(path) != digest:
+                return True
+
+        for path in self.metadata["missing"]:
+            if os.path.exists(path):
+                return True
+
+        # Bundles written before fragment directories were recorded
+        # won't have this key.
+        for directory, extensions, filenames in self.metadata.get(
+                "fragments", ()):
+            if list_fragments(directory, extensions) != filenames:
+                return True
+
+        return False
+
+    def close(self):
+        """Unmaps the bundle"""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            offset, length = self._index[key]
+            start = self._payload + offset
+            try:
+                value = pickle.loads(self._mmap[start:start + length])
+            except Exception as e:
+                raise BundleError(
+                    "Failed to read %r from %r: %s" % (key, self.path, e))
+            self._values[key] = value
+            return value
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+
+class SharedBundle(Mapping):
+    """
+    Read-only mapping attached to a bundle written by
+    :meth:`pyfarm.core.config.Configuration.share`.  Like :class:`Bundle`
+    values are unpickled from the mapped file the first time they are
+    requested.  When the parent process shares the configuration again
+    the file is replaced, rather than modified, so :meth:`refresh` only
+    needs to :func:`os.stat` the path to tell when to map the new file.
+
+    The shared file is usually in a temporary directory other users can
+    write to.  Like :class:`Bundle`, a file which is not owned by the
+    current user is refused, so a worker never unpickles data planted
+    by someone else.
+
+    :param string path:
+        The path the configuration was shared to
+
+    :raises BundleError:
+        Raised if ``path`` is not a bundle or is not owned by the
+        current user
+    """
+    def __init__(self, path):
+        self.path = path
+        self.bundle = None
+        self._signature = None
+        self.refresh()
+
+    @property
+    def stamp(self):
+        """
+        The ``(pid, generation)`` of the configuration when it was shared,
+        this changes each time the parent shares a new generation.
+        """
+        return self.bundle.metadata.get("stamp")
+
+    def refresh(self):
+        """
+        Maps the shared file again if it was replaced since it was last
+        mapped.  Returns True if a new file was mapped.  If the new file
+        can't be mapped :class:`BundleError` is raised and the previous
+        file remains mapped.
+        """
+        stat = os.stat(self.path)
+        signature = (stat.st_ino, stat.st_mtime, stat.st_size)
+        if signature == self._signature:
+            return False
+
+        bundle = Bundle(self.path)
+        previous, self.bundle = self.bundle, bundle
+        self._signature = signature
+        if previous is not None:
+            previous.close()
+
+        logger.debug("Attached to %r, stamp %s", self.path, self.stamp)
+        return True
+
+    def close(self):
+        """Unmaps the shared bundle"""
+        if self.bundle is not None:
+            self.bundle.close()
+
+    def __getitem__(self, key):
+        return self.bundle[key]
+
+    def __contains__(self, key):
+        return key in self.bundle
+
+    def __iter__(self):
+        return iter(self.bundle)
+
+    def __len__(self):
+        return len(self.bundle)
+
+
+def main(args=None):
+    """
+    Entry point for the ``pyfarm-config-bundle`` command which loads a
+    :class:`pyfarm.core.config.Configuration` and writes it to a bundle.
+    """
+    from argparse import ArgumentParser
+    from pyfarm.core.config import Configuration
+
+    parser = ArgumentParser(
+        description="Merges the configuration files for a program into "
+                    "a single bundle which Configuration.load_bundle() "
+                    "can load without searching for or parsing any files.")
+    parser.add_argument(
+        "name",
+        help="The name of the configuration or package, such as "
+             "'pyfarm.agent'")
+    parser.add_argument(
+        "--version",
+        help="The version of the program.  Required if 'name' is not the "
+             "name of an installed package.")
+    parser.add_argument(
+        "--output",
+        help="Where to write the bundle.  Defaults to the path returned "
+             "by Configuration.bundle_path()")
+    parser.add_argument(
+        "--cwd", help="The working directory to search for configuration "
+                      "files relative to")
+    parser.add_argument(
+        "--no-expand", dest="expand", action="store_false",
+        help="Store values as they are in the configuration files instead "
+             "of expanding variables in them first")
+    parsed = parser.parse_args(args)
+
+    config = Configuration(parsed.name, parsed.version, cwd=parsed.cwd)
+    output = config.build_bundle(path=parsed.output, expand=parsed.expand)
+    print(output)
+    return 0
@@ -31,40 +31,226 @@ in various forms.
 """
 
 import os
+import re
+import sys
+import time
+import atexit
+import threading
 from ast import literal_eval
-from errno import EEXIST
+from collections import namedtuple
+from copy import deepcopy
+from errno import EEXIST, ENOENT, ENOTDIR
 from functools import partial
-from pprint import pformat
+from hashlib import sha1
 from string import Template
 from itertools import product
-from tempfile import gettempdir
-from os.path import isfile, join, isdir, expanduser, expandvars, abspath
+from tempfile import gettempdir, mkstemp
+from os.path import (
+    isfile, join, isdir, expanduser, expandvars, abspath, normpath, split)
 
 try:
-    from StringIO import StringIO
+    from os import scandir
 except ImportError:  # pragma: no cover
-    from io import StringIO
+    scandir = None
 
-from pkg_resources import (
-    DistributionNotFound, get_distribution, resource_filename)
+try:
+    import cPickle as pickle
+except ImportError:  # pragma: no cover
+    import pickle
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover
+    from collections import Mapping
 
-import yaml
 try:
-    from yaml.loader import CLoader as Loader
+    from importlib.util import find_spec
 except ImportError:  # pragma: no cover
-    from yaml.loader import Loader
+    find_spec = None
 
+from pyfarm.core.lazy import LazyModule
 from pyfarm.core.logger import getLogger
 from pyfarm.core.enums import (
-    STRING_TYPES, NUMERIC_TYPES, NOTSET, LINUX, MAC, WINDOWS, range_)
+    STRING_TYPES, NUMERIC_TYPES, NOTSET, LINUX, MAC, WINDOWS, POSIX)
 
 logger = getLogger("core.config")
 
+# Only imported once a configuration file actually has to be parsed
+yaml = LazyModule("yaml")
+json = LazyModule("json")
+pprint = LazyModule("pprint")
+
 # Boolean values as strings that can match a value we
 # pulled from the environment after calling .lower().
 BOOLEAN_TRUE = set(["1", "t", "y", "true", "yes"])
 BOOLEAN_FALSE = set(["0", "f", "n", "false", "no"])
 
+ExpansionCacheInfo = namedtuple(
+    "ExpansionCacheInfo", ("hits", "misses", "size"))
+ExpansionReport = namedtuple("ExpansionReport", ("cycles", "unresolved"))
+ParsedFileCacheInfo = namedtuple("ParsedFileCacheInfo", ("hits", "misses"))
+DiscoveryIndexInfo = namedtuple(
+    "DiscoveryIndexInfo", ("lookups", "listings", "saved"))
+EnvironmentRead = namedtuple(
+    "EnvironmentRead", ("envvar", "source", "suppressed", "count", "value"))
+FileLoader = namedtuple("FileLoader", ("name", "function"))
+EnvironmentChanges = namedtuple(
+    "EnvironmentChanges", ("added", "changed", "unchanged"))
+
+# Use a clock which can't go backwards if one is available.
+monotonic = getattr(time, "monotonic", time.time)
+
+# Numbers which int() and float() parse exactly the same way as
+# literal_eval() does.  Anything else, including whitespace, underscores
+# and leading zeros, is left to literal_eval().
+DECIMAL_NUMBER = re.compile(r"[+-]?(?:0|[1-9][0-9]*)\Z")
+DECIMAL_COLUMN = re.compile(r"(?:[+-]?(?:0|[1-9][0-9]*)(?:\n|\Z))+\Z")
+HEX_NUMBER = re.compile(r"[+-]?0[xX][0-9a-fA-F]+\Z")
+FLOAT_NUMBER = re.compile(
+    r"[+-]?(?:[0-9]+\.[0-9]*|\.[0-9]+|[0-9]+(?=[eE]))(?:[eE][+-]?[0-9]+)?\Z")
+
+
+def parse_number(value):
+    """
+    Equivalent to :func:`.literal_eval` but much faster for the plain
+    decimal integers, floats and hex numbers we usually find in environment
+    variables.  These are converted directly with :func:`int` or
+    :func:`float` and everything else is passed to :func:`.literal_eval`
+    so the results, and the exceptions raised, are the same.
+
+    >>> parse_number("42"), parse_number("-1.5e3"), parse_number("0x10")
+    (42, -1500.0, 16)
+    """
+    if DECIMAL_NUMBER.match(value):
+        return int(value)
+    elif FLOAT_NUMBER.match(value):
+        return float(value)
+    elif HEX_NUMBER.match(value):
+        return int(value, 16)
+    return literal_eval(value)
+
+
+def parse_numbers(values):
+    """
+    Bulk form of :func:`parse_number` which returns a list with one
+    parsed value for each string in ``values``.  A column made up entirely
+    of decimal integers is validated with a single regular expression.
+    """
+    values = list(values)
+    if values and DECIMAL_NUMBER.match(values[0]):
+        joined = "\n".join(values)
+        if joined.count("\n") == len(values) - 1 \
+                and DECIMAL_COLUMN.match(joined):
+            return list(map(int, values))
+
+    return list(map(parse_number, values))
+
+
+class ReadEnvAudit(object):
+    """
+    Bounded table of the environment variables read by :func:`read_env`.
+    While enabled :func:`read_env` records each read here instead of
+    logging it, so code which reads the same variables repeatedly
+    produces a single summary rather than a log line per call.  Reads are
+    counted per ``(envvar, source, suppressed)`` where ``source`` is
+    either ``environment`` or ``default``.  Values read with
+    ``log_result=False`` are never stored.
+
+    Setting :envvar:`PYFARM_READ_ENV_AUDIT` to a true value enables the
+    audit, with a summary at exit, when this module is imported.
+
+    :param int maxsize:
+        The maximum number of distinct reads to record.  Once the table is
+        full reads which are not already in the table are only counted in
+        :attr:`dropped`.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.enabled = False
+        self.dropped = 0
+        self._reads = {}
+        self._lock = threading.Lock()
+        self._atexit = False
+
+    def enable(self, summary_at_exit=True):
+        """
+        Starts recording reads.  If ``summary_at_exit`` is True
+        :meth:`log_summary` will be called when the interpreter exits.
+        """
+        self.enabled = True
+        if summary_at_exit and not self._atexit:
+            atexit.register(self._log_summary_at_exit)
+            self._atexit = True
+
+    def disable(self):
+        """Stops recording reads, the recorded reads are kept"""
+        self.enabled = False
+
+    def record(self, envvar, source, value, suppressed):
+        """Records a single read of ``envvar``"""
+        key = (envvar, source, suppressed)
+        with self._lock:
+            entry = self._reads.get(key)
+            if entry is not None:
+                entry[0] += 1
+                if not suppressed:
+                    entry[1] = value
+            elif len(self._reads) < self.maxsize:
+                self._reads[key] = [1, None if suppressed else value]
+            else:
+                self.dropped += 1
+
+    def clear(self):
+        """Forgets all recorded reads"""
+        with self._lock:
+            self._reads.clear()
+            self.dropped = 0
+
+    def summary(self):
+        """
+        Returns a list of :class:`EnvironmentRead` tuples, sorted by
+        variable name, for every recorded read.  ``value`` is the most
+        recent value read or None if the value was suppressed.
+        """
+        with self._lock:
+            reads = [
+                EnvironmentRead(envvar, source, suppressed, count, value)
+                for (envvar, source, suppressed), (count, value)
+                in self._reads.items()]
+        reads.sort(key=lambda read: (read.envvar, read.source))
+        return reads
+
+    def log_summary(self):
+        """Logs :meth:`summary` as a single INFO message"""
+        reads = self.summary()
+        if not reads and not self.dropped:
+            return
+
+        lines = []
+        for read in reads:
+            if read.suppressed:
+                lines.append("  $%s from %s x%s (value suppressed)" % (
+                    read.envvar, read.source, read.count))
+            else:
+                lines.append("  $%s from %s x%s: %r" % (
+                    read.envvar, read.source, read.count, read.value))
+
+        logger.info(
+            "read_env() summary, %s distinct read(s), %s dropped:\n%s",
+            len(reads), self.dropped, "\n".join(lines))
+
+    def _log_summary_at_exit(self):
+        if self.enabled:
+            self.log_summary()
+
+
+read_env_audit = ReadEnvAudit()
+
+# Allows the audit to be turned on for a process without code changes,
+# the summary is logged when the process exits.
+if os.environ.get("PYFARM_READ_ENV_AUDIT", "").lower() in BOOLEAN_TRUE:
+    read_env_audit.enable()
+
 
 def read_env(envvar, default=NOTSET, warn_if_unset=False, eval_literal=False,
              raise_eval_exception=True, log_result=True, desc=None,
@@ -86,7 +272,8 @@ def read_env(envvar, default=NOTSET, warn_if_unset=False, eval_literal=False,
 
     :keyword eval_literal:
         if True, run :func:`.literal_eval` on the value retrieved
-        from the environment
+        from the environment.  Plain numbers are converted using
+        :func:`parse_number` instead.
 
     :keyword bool raise_eval_exception:
         If True and we failed to parse ``envvar`` with :func:`.literal_eval`
@@ -105,6 +292,9 @@ def read_env(envvar, default=NOTSET, warn_if_unset=False, eval_literal=False,
     :keyword bool log_defaults:
         If False, queries for envvars that have not actually been set and will
         just return ``default`` will not be logged
+
+    While :data:`read_env_audit` is enabled nothing is logged per call,
+    each read is recorded by :class:`ReadEnvAudit` instead.
     """
     if envvar not in os.environ:
         # default not provided, raise an exception
@@ -114,9 +304,12 @@ def read_env(envvar, default=NOTSET, warn_if_unset=False, eval_literal=False,
         if warn_if_unset:  # pragma: no cover
             logger.warning("$%s is using a default value" % envvar)
 
-        if log_defaults:
+        if read_env_audit.enabled:
+            read_env_audit.record(envvar, "default", default, not log_result)
+
+        elif log_defaults:
             if log_result:  # pragma: no cover
-                logger.debug("read_env(%s): %s", (repr(envvar), repr(default)))
+                logger.debug("read_env(%r): %r", envvar, default)
             else:
                 logger.debug("read_env(%r) (value suppressed)", envvar)
 
@@ -124,17 +317,19 @@ def read_env(envvar, default=NOTSET, warn_if_unset=False, eval_literal=False,
     else:
         value = os.environ[envvar]
 
-        if log_result:  # pragma: no cover
-           logger.info("read_env(%r): %r", envvar, value)
+        if read_env_audit.enabled:
+            read_env_audit.record(
+                envvar, "environment", value, not log_result)
+        elif log_result:  # pragma: no cover
+            logger.info("read_env(%r): %r", envvar, value)
         else:
-           logger.debug("read_env(%r) (value suppressed)", envvar)
-
+            logger.debug("read_env(%r) (value suppressed)", envvar)
 
         if not eval_literal:
             return value
 
         try:
-            return literal_eval(value)
+            return parse_number(value)
 
         except (ValueError, SyntaxError) as e:
             if raise_eval_exception:
@@ -219,35 +414,840 @@ def read_env_number(*args, **kwargs):
     return value
 
 
-def read_env_strict_number(*args, **kwargs):
+def read_env_strict_number(*args, **kwargs):
+    """
+    Strict version of :func:`.read_env_number` which will only return an integer
+
+    :keyword number_type:
+        the type of number(s) this function must return
+
+    :exception AssertionError:
+        raised if the number_type keyword is not provided (required to check
+        the type on output)
+
+    :exception TypeError:
+        raised if the type of the result is not an instance of `number_type`
+    """
+    number_type = kwargs.pop("number_type", None)
+    assert number_type is not None, "`number_type` keyword is required for"
+    value = read_env_number(*args, **kwargs)
+
+    if not isinstance(value, number_type):
+        raise TypeError("%s is not an %s object" % (repr(value), number_type))
+
+    return value
+
+
+read_env_int = partial(read_env_strict_number, number_type=int)
+read_env_float = partial(read_env_strict_number, number_type=float)
+
+
+def apply_environment(environment, values):
+    """
+    Sets each key in ``values`` in ``environment``, skipping keys whose
+    value is already the same.  Assigning to :class:`os.environ` calls
+    :func:`os.putenv` so this avoids work, and noise for anything
+    watching the environment, when a configuration is loaded again.
+    Returns an :class:`EnvironmentChanges` instance where ``added`` maps
+    new keys to their values, ``changed`` maps keys to a tuple of their
+    old and new values and ``unchanged`` is a tuple of keys which were
+    not modified.
+
+    :param dict environment:
+        The environment to update, typically :class:`os.environ`
+
+    :param dict values:
+        The values to set
+    """
+    added = {}
+    changed = {}
+    unchanged = []
+
+    for key, value in values.items():
+        current = environment.get(key, NOTSET)
+        if current is NOTSET:
+            added[key] = value
+        elif current != value:
+            changed[key] = (current, value)
+        else:
+            unchanged.append(key)
+            continue
+
+        environment[key] = value
+
+    return EnvironmentChanges(added, changed, tuple(unchanged))
+
+
+def yaml_loader():
+    """
+    Returns the loader class :meth:`Configuration.load` parses files
+    with, libyaml's :class:`yaml.CLoader` if :mod:`yaml` was built with
+    it and the pure Python :class:`yaml.Loader` otherwise.
+    """
+    return getattr(yaml, "CLoader", None) or yaml.Loader
+
+
+class FileLoadError(ValueError):
+    """Raised when a configuration file could not be parsed"""
+
+
+def load_yaml(stream):
+    """Parses yaml from ``stream`` using :func:`yaml_loader`"""
+    try:
+        return yaml.load(stream, Loader=yaml_loader())
+    except yaml.YAMLError as e:
+        raise FileLoadError(str(e))
+
+
+def load_json(stream):
+    """Parses json from ``stream``"""
+    return json.loads(stream.read().decode("utf-8"))
+
+
+def load_toml(stream):
+    """
+    Parses toml from ``stream`` using :mod:`tomllib`, which is part of
+    Python 3.11 and later, or the :mod:`tomli` or :mod:`toml` packages.
+
+    :raises ImportError:
+        Raised if none of the modules above are available
+    """
+    try:
+        import tomllib as toml_parser
+    except ImportError:
+        try:
+            import tomli as toml_parser
+        except ImportError:
+            toml_parser = None
+
+    if toml_parser is not None:
+        return toml_parser.load(stream)
+
+    import toml
+    return toml.loads(stream.read().decode("utf-8"))
+
+
+# Functions which parse configuration files, keyed by file extension.
+# See register_loader().
+LOADERS = {}
+
+
+def register_loader(extension, name, function):
+    """
+    Registers ``function`` as the parser for configuration files ending
+    in ``extension``, replacing any existing parser for the extension.
+
+    :param string extension:
+        The file extension including the leading ``.``, such as ``.json``
+
+    :param string name:
+        The name of the loader which is included in log messages
+
+    :param function:
+        Called with a file opened in binary mode and returns the parsed
+        data.  Errors should be raised as :class:`ValueError` or
+        :class:`FileLoadError`.
+    """
+    LOADERS[extension.lower()] = FileLoader(name, function)
+
+
+def get_loader(filepath):
+    """
+    Returns the :class:`FileLoader` for ``filepath``
+
+    :raises FileLoadError:
+        Raised if no loader is registered for the file's extension
+    """
+    extension = os.path.splitext(filepath)[1].lower()
+    try:
+        return LOADERS[extension]
+    except KeyError:
+        raise FileLoadError(
+            "No loader is registered for %r files" % extension)
+
+
+register_loader(".yml", "yaml", load_yaml)
+register_loader(".yaml", "yaml", load_yaml)
+register_loader(".json", "json", load_json)
+register_loader(".toml", "toml", load_toml)
+
+
+def read_pickle_cache(path):
+    """
+    Returns the unpickled contents of ``path`` or ``NOTSET`` if the file
+    does not exist, can't be read or, on posix platforms, is not owned by
+    the current user.
+    """
+    try:
+        with open(path, "rb") as stream:
+            # Never unpickle data which someone else could have written.
+            if POSIX and os.fstat(stream.fileno()).st_uid != os.getuid():
+                logger.warning(
+                    "Ignoring %r, it is not owned by the current user", path)
+                return NOTSET
+
+            return pickle.load(stream)
+
+    except (OSError, IOError) as e:
+        if e.errno != ENOENT:  # pragma: no cover
+            logger.warning("Failed to read %r: %s", path, e)
+        return NOTSET
+
+    except Exception as e:  # pragma: no cover
+        logger.warning("Failed to unpickle %r: %s", path, e)
+        return NOTSET
+
+
+def write_pickle_cache(path, data, protocol=2):
+    """
+    Pickles ``data`` to ``path``.  The data is written to a temporary file
+    first and then renamed so concurrent readers never see a partially
+    written file.  The temporary file is created with a random name and
+    is readable only by the current user, so a file or symlink someone
+    else planted in the directory is never written through.  The parent
+    directory is created, readable only by the current user, if it does
+    not exist.  Failures are logged rather than
+    raised because the caller can always fall back to the uncached data.
+    """
+    directory = os.path.dirname(path)
+
+    try:
+        os.makedirs(directory, 0o700)
+    except OSError as e:
+        if e.errno != EEXIST:  # pragma: no cover
+            logger.warning("Failed to create %r: %s", directory, e)
+            return
+
+    try:
+        descriptor, temp_path = mkstemp(
+            prefix=os.path.basename(path) + ".", dir=directory)
+    except OSError as e:  # pragma: no cover
+        logger.warning("Failed to write %r: %s", path, e)
+        return
+
+    try:
+        with os.fdopen(descriptor, "wb") as stream:
+            pickle.dump(data, stream, protocol)
+
+        if WINDOWS and isfile(path):  # pragma: no cover
+            os.remove(path)
+
+        os.rename(temp_path, path)
+
+    except Exception as e:  # pragma: no cover
+        logger.warning("Failed to write %r: %s", path, e)
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+
+# Results of package_directory() and package_version(), shared by
+# every Configuration instance in this process.
+_package_directories = {}
+_package_versions = {}
+
+
+def package_directory(name):
+    """
+    Returns the directory containing the package or module ``name`` or
+    None if it can't be imported.  Only parent packages are imported,
+    ``name`` itself is located without being imported.  Results are kept
+    for the life of the process.
+    """
+    try:
+        return _package_directories[name]
+    except KeyError:
+        pass
+
+    directory = None
+    if find_spec is None:  # pragma: no cover
+        from pkg_resources import resource_filename
+        try:
+            directory = resource_filename(name, "")
+        except ImportError:
+            pass
+    else:
+        try:
+            spec = find_spec(name)
+        except (ImportError, ValueError):
+            spec = None
+
+        if spec is None:
+            pass
+        elif spec.submodule_search_locations:
+            directory = list(spec.submodule_search_locations)[0]
+        elif spec.origin and isfile(spec.origin):
+            directory = os.path.dirname(spec.origin)
+
+    _package_directories[name] = directory
+    return directory
+
+
+def _find_package_version(name):
+    """Returns the installed version of the distribution ``name`` or None"""
+    # Imported here because importlib.metadata is only needed when
+    # Configuration has to determine the version itself.
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:  # pragma: no cover
+        from pkg_resources import DistributionNotFound, get_distribution
+        try:
+            return get_distribution(name).version
+        except DistributionNotFound:
+            return None
+
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return None
+
+
+def package_version(name, cache_path=None):
+    """
+    Returns the installed version of the distribution ``name`` or None if
+    it is not installed.  This uses :mod:`importlib.metadata` instead of
+    :mod:`pkg_resources`, which scans the metadata of every installed
+    distribution when it is imported.  Results are kept for the life of
+    the process.
+
+    :param string cache_path:
+        If provided, results are also stored in this file and reused by
+        other processes so long as the directory returned by
+        :func:`package_directory` has not been modified or replaced.
+    """
+    try:
+        return _package_versions[name]
+    except KeyError:
+        pass
+
+    signature = None
+    directory = package_directory(name)
+    if cache_path is not None and directory is not None:
+        try:
+            stat = os.stat(directory)
+        except OSError:  # pragma: no cover
+            pass
+        else:
+            signature = (
+                sys.prefix, directory,
+                getattr(stat, "st_mtime_ns", stat.st_mtime), stat.st_ino)
+
+    cached = NOTSET
+    if signature is not None:
+        cached = read_pickle_cache(cache_path)
+        if cached is not NOTSET and name in cached and \
+                tuple(cached[name][0]) == signature:
+            _package_versions[name] = cached[name][1]
+            return cached[name][1]
+
+    version = _find_package_version(name)
+
+    if signature is not None:
+        if not isinstance(cached, dict):
+            cached = {}
+        cached[name] = (signature, version)
+        write_pickle_cache(cache_path, cached)
+
+    _package_versions[name] = version
+    return version
+
+
+class DiscoveryIndex(object):
+    """
+    Answers :func:`os.path.isdir` and :func:`os.path.isfile` questions
+    using cached directory listings.  :class:`Configuration` checks the
+    same few directories for every root and version so listing each
+    directory once replaces many individual stat calls.  Listings expire
+    after ``ttl`` seconds so changes on disk are eventually noticed.
+
+    :param float ttl:
+        The number of seconds a directory listing should be reused for.
+
+    :var int lookups:
+        The number of questions answered, each of which would otherwise
+        have required a call to :func:`os.stat`.
+
+    :var int listings:
+        The number of directories which have been listed.
+    """
+    # Case insensitive file systems are the default on these platforms
+    FOLD_CASE = WINDOWS or MAC
+
+    def __init__(self, ttl=2.0):
+        self.ttl = ttl
+        self.lookups = 0
+        self.listings = 0
+        self._listings = {}
+
+    def info(self):
+        """
+        Returns a :class:`DiscoveryIndexInfo` instance describing how many
+        lookups have been performed, how many directories were listed to
+        answer them and how many file system calls were saved as a result.
+        """
+        return DiscoveryIndexInfo(
+            self.lookups, self.listings, self.lookups - self.listings)
+
+    def invalidate(self, directory=None):
+        """
+        Discards the cached listing for ``directory`` or every cached
+        listing if ``directory`` is not provided.
+        """
+        if directory is None:
+            self._listings.clear()
+        else:
+            self._listings.pop(normpath(directory), None)
+
+    def listing(self, directory):
+        """
+        Returns a tuple containing the names of the directories and the
+        names of the files in ``directory``.  If ``directory`` does not
+        exist or can't be read then ``None`` will be returned.
+        """
+        try:
+            return self._listing(directory)
+        except (OSError, IOError):
+            return None
+
+    def _listing(self, directory):
+        directory = normpath(directory)
+        now = monotonic()
+        cached = self._listings.get(directory)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        self.listings += 1
+        listing = self._scan(directory)
+        self._listings[directory] = (now + self.ttl, listing)
+        return listing
+
+    def _scan(self, directory):
+        directories = set()
+        files = set()
+
+        try:
+            if scandir is not None:
+                for entry in scandir(directory):
+                    if entry.is_dir():
+                        directories.add(entry.name)
+                    elif entry.is_file():
+                        files.add(entry.name)
+            else:  # pragma: no cover
+                for name in os.listdir(directory):
+                    path = join(directory, name)
+                    if isdir(path):
+                        directories.add(name)
+                    elif isfile(path):
+                        files.add(name)
+
+        except (OSError, IOError) as e:
+            # Any other error, such as permission being denied, does not
+            # mean the directory is empty so it's raised and not cached.
+            if e.errno in (ENOENT, ENOTDIR):
+                return None
+            raise
+
+        if self.FOLD_CASE:  # pragma: no cover
+            directories = set(name.lower() for name in directories)
+            files = set(name.lower() for name in files)
+
+        return frozenset(directories), frozenset(files)
+
+    def _lookup(self, path, position):
+        self.lookups += 1
+        parent, name = split(normpath(path))
+
+        if not name:  # the root of the file system
+            return position == 0 and isdir(parent)
+
+        try:
+            listing = self._listing(parent or os.curdir)
+        except (OSError, IOError):
+            # The directory can't be listed, it may only have execute
+            # permission for example, but the paths in it could still
+            # be accessible so ask the file system directly.
+            return (isdir, isfile)[position](path)
+
+        if listing is None:
+            return False
+
+        if self.FOLD_CASE:  # pragma: no cover
+            name = name.lower()
+
+        return name in listing[position]
+
+    def isdir(self, path):
+        """Returns True if ``path`` is an existing directory"""
+        return self._lookup(path, 0)
+
+    def isfile(self, path):
+        """Returns True if ``path`` is an existing regular file"""
+        return self._lookup(path, 1)
+
+
+class Layers(Mapping):
+    """
+    Read-only, layered view of the data loaded from each configuration
+    file.  The data from each file is kept as is, without being copied,
+    and lookups check each layer from the highest priority (last loaded)
+    layer to the lowest.  :meth:`provenance` can be used to determine
+    which layer supplied a given value.
+
+    :param list layers:
+        A list of ``(source, data)`` tuples ordered from the lowest
+        priority to the highest, which is the order the files are loaded
+        by :meth:`Configuration.load`.  Layers without data are ignored.
+
+    :param exclude:
+        Keys which should be ignored in every layer
+    """
+    def __init__(self, layers=(), exclude=()):
+        self._layers = [(source, data) for source, data in layers if data]
+        self.exclude = frozenset(exclude)
+        self._flattened = None
+
+    @property
+    def sources(self):
+        """The source of each layer, lowest priority first"""
+        return tuple(source for source, _ in self._layers)
+
+    def layer(self, source):
+        """Returns the data for the layer loaded from ``source``"""
+        for layer_source, data in self._layers:
+            if layer_source == source:
+                return data
+        raise KeyError(source)
+
+    def _find(self, key):
+        if key in self.exclude:
+            return None
+
+        for source, data in reversed(self._layers):
+            if key in data:
+                return source, data
+
+        return None
+
+    def provenance(self, key):
+        """
+        Returns the source of the layer which supplies the value for
+        ``key`` or None if no layer contains ``key``.
+        """
+        found = self._find(key)
+        return None if found is None else found[0]
+
+    def flatten(self):
+        """
+        Returns a dictionary containing the winning value for every key.
+        The result is cached until a layer is replaced and should not
+        be modified.
+        """
+        if self._flattened is None:
+            flattened = {}
+            for _, data in self._layers:
+                flattened.update(data)
+
+            for key in self.exclude:
+                flattened.pop(key, None)
+
+            self._flattened = flattened
+
+        return self._flattened
+
+    def replace(self, source, data):
+        """
+        Replaces the data for the layer loaded from ``source`` and returns
+        the keys whose value may have changed as a result.  Only the
+        flattened cache is discarded, the other layers are untouched.
+        """
+        for index, (layer_source, old_data) in enumerate(self._layers):
+            if layer_source == source:
+                self._layers[index] = (source, data)
+                self._flattened = None
+                return (set(old_data or ()) | set(data or ())) - self.exclude
+
+        raise KeyError(source)
+
+    def __getitem__(self, key):
+        if self._flattened is not None:
+            return self._flattened[key]
+
+        found = self._find(key)
+        if found is None:
+            raise KeyError(key)
+
+        return found[1][key]
+
+    def __contains__(self, key):
+        if self._flattened is not None:
+            return key in self._flattened
+        return self._find(key) is not None
+
+    def __iter__(self):
+        return iter(self.flatten())
+
+    def __len__(self):
+        return len(self.flatten())
+
+    def __repr__(self):  # pragma: no cover
+        return "%s(%r)" % (self.__class__.__name__, list(self.sources))
+
+
+def remove_shared_file(path):
+    """Removes a file written by :meth:`Configuration.share`"""
+    try:
+        os.remove(path)
+    except OSError:  # pragma: no cover
+        pass
+
+
+def _unpickle_mapping(cls, data):
+    """
+    Creates an instance of ``cls``, a subclass of :class:`ExpansionMixin`,
+    containing ``data`` without calling ``__init__`` or ``__setitem__``.
+    See :meth:`ExpansionMixin.__reduce__`.
+    """
+    instance = cls.__new__(cls)
+    dict.update(instance, data)
+    return instance
+
+
+class ExpansionMixin(object):
+    """
+    Mixin for :class:`dict` subclasses which expands ``$name`` references
+    in string values, using :meth:`_expandvars`, as they are retrieved.
+    This provides the read side of both :class:`Configuration` and
+    :class:`ConfigurationSnapshot`.
+
+    :var int MAX_EXPANSION_CACHE_SIZE:
+        The maximum number of expanded values :meth:`_expandvars` will
+        keep in memory before the cache is emptied and rebuilt.
+    """
+    MAX_EXPANSION_CACHE_SIZE = 1024
+    tempdir = None
+
+    def __init__(self, *args, **kwargs):
+        super(ExpansionMixin, self).__init__(*args, **kwargs)
+        self._expansion_cache = {}
+        self._expansion_cache_hits = 0
+        self._expansion_cache_misses = 0
+
+    def __reduce__(self):
+        # By default the items of a dict subclass are restored with
+        # __setitem__ before __setstate__ runs, which fails for a
+        # subclass whose __setitem__ uses attributes or is read-only.
+        return _unpickle_mapping, (self.__class__, dict.copy(self)), \
+            self.__getstate__()
+
+    def __getstate__(self):
+        """
+        Returns the attributes to pickle.  Cached expansions depend on
+        the environment of this process so they are never included.
+        """
+        state = self.__dict__.copy()
+        state.pop("_expansion_cache", None)
+        state.pop("_expansion_cache_hits", None)
+        state.pop("_expansion_cache_misses", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._expansion_cache = {}
+        self._expansion_cache_hits = 0
+        self._expansion_cache_misses = 0
+
+    def clear_expansion_cache(self):
+        """
+        Discards any values cached by :meth:`_expandvars`.  This is
+        called automatically when the configuration is modified through
+        methods such as :meth:`__setitem__`, :meth:`update` or
+        :meth:`load`.  It only needs to be called manually if a nested
+        value, such as the ``env`` dictionary, was modified in place or
+        if ``tempdir`` was changed.
+        """
+        self._expansion_cache.clear()
+
+    def expansion_cache_info(self):
+        """
+        Returns an :class:`ExpansionCacheInfo` instance containing
+        the number of cache hits and misses :meth:`_expandvars` has
+        produced along with the current size of the cache.
+        """
+        return ExpansionCacheInfo(
+            self._expansion_cache_hits, self._expansion_cache_misses,
+            len(self._expansion_cache))
+
+    def _expandvars(self, value):
+        """
+        Performs variable expansion for ``value``. This method is run when
+        a string value is returned from :meth:`get` or :meth:`__getitem__`.
+        The default behavior of this method is to recursively expand
+        variables using sources in the following order:
+
+            * The environment, ``os.environ``
+            * The environment (from the configuration), ``env``
+            * Other values in the configuration
+            * ``~`` to the user's home directory
+
+        For example, the following configuration:
+
+        .. code-block:: yaml
+
+            foo: foo
+            bar: bar
+            foobar: $foo/$bar
+            path: ~/$foobar/$TEST
+
+        Would result in the following assuming ``$TEST`` is an
+        environment variable set to ``somevalue`` and the current
+        user's name is ``user``:
+
+        .. code-block:: python
+
+            {
+                "foo": "foo",
+                "bar": "bar",
+                "foobar": "foo/bar",
+                "path": "/home/user/foo/bar/somevalue"
+            }
+
+        Expanded values are cached.  Each entry in the cache remembers the
+        environment variables which were consulted while it was being
+        expanded and is only reused while those variables are unchanged
+        in :class:`os.environ`.  Modifying the configuration itself
+        empties the cache, see :meth:`clear_expansion_cache`.
+        """
+        cached = self._expansion_cache.get(value)
+
+        if cached is not None:
+            expanded, dependencies = cached
+            for envvar, envvalue in dependencies:
+                if os.environ.get(envvar) != envvalue:
+                    break
+            else:
+                self._expansion_cache_hits += 1
+                return expanded
+
+        self._expansion_cache_misses += 1
+        expanded, dependencies = self._expand(value)
+
+        if len(self._expansion_cache) >= self.MAX_EXPANSION_CACHE_SIZE:
+            self._expansion_cache.clear()
+
+        self._expansion_cache[value] = (expanded, dependencies)
+        return expanded
+
+    def _expand(self, value):
+        """
+        Performs the work for :meth:`_expandvars` without any caching.  This
+        returns a tuple of the expanded value and the environment variables,
+        along with their values, that the expansion depended on.
+        """
+        resolver = self._resolver()
+        expanded = resolver.expand(value)
+
+        if resolver.cycles:
+            logger.warning(
+                "Circular reference(s) found while expanding %r: %s",
+                value, ", ".join(
+                    " -> ".join(cycle) for cycle in sorted(resolver.cycles)))
+
+        # Only names which were not supplied by the configuration
+        # itself depend on the state of os.environ.
+        environment = dict.get(self, "env", None) or {}
+        requested = resolver.requested
+        if "~" in expanded:
+            requested.add("HOME")
+
+        dependencies = tuple(
+            (envvar, os.environ.get(envvar)) for envvar in requested
+            if not dict.__contains__(self, envvar)
+            and envvar not in environment)
+
+        return expanduser(expanded), dependencies
+
+    def _resolver(self):
+        """
+        Returns a :class:`VariableResolver` which resolves names using
+        the same sources, and priorities, :meth:`_expandvars` documents.
+        """
+        return VariableResolver([
+            self,
+            dict.get(self, "env", None) or {},
+            os.environ,
+            {"temp": self.tempdir}])
+
+    def check_references(self):
+        """
+        Resolves every string value in the configuration and returns an
+        :class:`ExpansionReport` containing any circular references and any
+        names which could not be resolved from any source.
+        """
+        resolver = self._resolver()
+
+        for value in dict.values(self):
+            if isinstance(value, STRING_TYPES):
+                resolver.expand(value)
+
+        return ExpansionReport(
+            frozenset(resolver.cycles), frozenset(resolver.unresolved))
+
+    def get(self, key, default=None):
+        """
+        Overrides :meth:`dict.get` to provide internal variable
+        expansion through :meth:`_expandvars`.
+        """
+        value = dict.get(self, key, default)
+        if isinstance(value, STRING_TYPES):
+            value = self._expandvars(value)
+        return value
+
+    def __getitem__(self, item):
+        """
+        Overrides :meth:`dict.__getitem__` to provide internal variable
+        expansion through :meth:`_expandvars`.
+        """
+        value = dict.__getitem__(self, item)
+        if isinstance(value, STRING_TYPES):
+            value = self._expandvars(value)
+        return value
+
+
+class ConfigurationSnapshot(ExpansionMixin, dict):
     """
-    Strict version of :func:`.read_env_number` which will only return an integer
+    Immutable copy of the data in a :class:`Configuration` at a single
+    generation, see :meth:`Configuration.snapshot`.  Values are expanded
+    the same way :class:`Configuration` expands them.  Each snapshot
+    keeps its own expansion cache so nothing a newer generation does can
+    affect a reader still holding an older snapshot.
 
-    :keyword number_type:
-        the type of number(s) this function must return
+    :param dict data:
+        The data in the configuration, this is copied
 
-    :exception AssertionError:
-        raised if the number_type keyword is not provided (required to check
-        the type on output)
+    :param int generation:
+        The generation of the configuration ``data`` came from
 
-    :exception TypeError:
-        raised if the type of the result is not an instance of `number_type`
+    :param string tempdir:
+        The value ``$temp`` expands to
     """
-    number_type = kwargs.pop("number_type", None)
-    assert number_type is not None, "`number_type` keyword is required for"
-    value = read_env_number(*args, **kwargs)
-
-    if not isinstance(value, number_type):
-        raise TypeError("%s is not an %s object" % (repr(value), number_type))
+    def __init__(self, data, generation, tempdir=None):
+        super(ConfigurationSnapshot, self).__init__(data)
+        self.generation = generation
+        self.tempdir = tempdir
 
-    return value
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("%s is read-only" % self.__class__.__name__)
 
+    __setitem__ = __delitem__ = update = setdefault = pop = popitem = \
+        clear = _readonly
 
-read_env_int = partial(read_env_strict_number, number_type=int)
-read_env_float = partial(read_env_strict_number, number_type=float)
+    def __repr__(self):  # pragma: no cover
+        return "%s(generation=%s, %s)" % (
+            self.__class__.__name__, self.generation, dict.__repr__(self))
 
 
-class Configuration(dict):
+class Configuration(ExpansionMixin, dict):
     """
     Main object responsible for finding, loading, and
     merging configuration data.  By default this class does nothing
@@ -356,8 +1356,16 @@ class Configuration(dict):
 
     :var string DEFAULT_FILE_EXTENSION:
         The default file extension of the configuration files.  This will
-        default to ``.yml`` and will be copied to ``file_extension`` when
-        the class is instanced.
+        default to ``.yml``.
+
+    :var tuple DEFAULT_FILE_EXTENSIONS:
+        The file extensions to search for, in order, which defaults to
+        ``(DEFAULT_FILE_EXTENSION, )`` and will be copied to
+        ``file_extensions`` when the class is instanced.  When several
+        files in the same directory match, such as ``agent.yml`` and
+        ``agent.json``, they are all loaded and files later in this
+        list take precedence.  Each file is parsed by the loader
+        registered for its extension, see :func:`register_loader`.
 
     :var string DEFAULT_LOCAL_DIRECTORY_NAME:
         A directory local to the current process which we should search
@@ -378,6 +1386,41 @@ class Configuration(dict):
     :var DEFAULT_TEMP_DIRECTORY_ROOT:
         The directory which will store any temporary files.
 
+    :var DISCOVERY_INDEX:
+        The :class:`DiscoveryIndex` shared by every instance of this
+        class.  :meth:`directories` and :meth:`files` use the index, which
+        is copied to ``discovery_index`` when the class is instanced, to
+        determine which paths exist.
+
+    :var bool DEFAULT_PARSED_FILE_CACHE:
+        If True, :meth:`load` will store the parsed contents of each
+        configuration file in memory and under ``tempdir`` and reuse them
+        on the next :meth:`load`, in this or any other process, so long as
+        the path, modification time, size and inode of the file are
+        unchanged.  Files modified within ``PARSED_FILE_MTIME_RESOLUTION``
+        seconds of being parsed are not cached because a second change
+        within the same modification time would not change their
+        signature.  This defaults to ``False`` and will be copied to
+        ``parsed_file_cache`` when the class is instanced.
+
+    :var int DEFAULT_PARSE_THREADS:
+        The maximum number of threads :meth:`load` will use to parse
+        configuration files which are not already cached.  Parsing holds
+        the GIL so threads only help when reading the files is slow, for
+        example on a network file system, and otherwise make
+        :meth:`load` slower.  Compare with ``python -m
+        benchmarks.bench_config --threads 1,4`` before raising it.  This
+        defaults to ``1``, which parses files one at a time without a
+        thread pool, and will be copied to ``parse_threads`` when the
+        class is instanced.
+
+    :var bool PACKAGE_METADATA_CACHE:
+        If True, the version of the package ``name`` is stored under
+        ``DEFAULT_TEMP_DIRECTORY_ROOT`` and reused by other processes until
+        the package directory is modified or replaced.  Versions are always
+        cached for the life of the current process.  See
+        :func:`package_version`.
+
     :param string name:
         The name of the configuration itself, typically 'master' or
         'agent'.  This may also be the name of a package such
@@ -393,10 +1436,26 @@ class Configuration(dict):
         path from.  If not provided then we'll use :func:`os.getcwd`
         to determine the current working directory.
 
+    :var int MAX_EXPANSION_CACHE_SIZE:
+        The maximum number of expanded values :meth:`_expandvars` will
+        keep in memory before the cache is emptied and rebuilt.
+
+    :var bool DEFAULT_COPY_ON_WRITE:
+        If True every change to the configuration, including :meth:`load`,
+        builds a new :class:`ConfigurationSnapshot` and publishes it with
+        a single reference assignment.  :meth:`get`, :meth:`__getitem__`,
+        ``in``, ``len()``, :meth:`keys`, :meth:`values` and :meth:`items`
+        then read from the published snapshot so readers in other threads
+        never see a partially applied change and never wait on a lock.
+        Iterating over the configuration itself reads the underlying
+        dictionary, iterate over :meth:`keys` instead.  Use
+        :meth:`snapshot` to read several values from the same
+        generation.  This defaults to ``False``
+        and will be copied to ``copy_on_write`` when the class is
+        instanced.
+
     .. automethod:: _expandvars
     """
-    MAX_EXPANSION_RECURSION = 10
-
     if LINUX:  # pragma: no cover
         DEFAULT_SYSTEM_ROOT = join(os.sep, "etc")
         DEFAULT_USER_ROOT = expanduser("~")
@@ -412,19 +1471,41 @@ class Configuration(dict):
         DEFAULT_USER_ROOT = None
 
     DEFAULT_FILE_EXTENSION = ".yml"
+    DEFAULT_FILE_EXTENSIONS = (DEFAULT_FILE_EXTENSION, )
     DEFAULT_LOCAL_DIRECTORY_NAME = "etc"
     DEFAULT_PARENT_APPLICATION_NAME = "pyfarm"
     DEFAULT_ENVIRONMENT_PATH_VARIABLE = "PYFARM_CONFIG_ROOT"
     DEFAULT_TEMP_DIRECTORY_ROOT = join(
         gettempdir(), DEFAULT_PARENT_APPLICATION_NAME)
+    DEFAULT_PARSED_FILE_CACHE = False
+    PARSED_FILE_CACHE_PROTOCOL = 2
+    PARSED_FILE_MTIME_RESOLUTION = 2.0
+    DEFAULT_PARSE_THREADS = 1
+    PACKAGE_METADATA_CACHE = False
+    DEFAULT_COPY_ON_WRITE = False
+    DISCOVERY_INDEX = DiscoveryIndex()
 
     def __init__(self, name, version=None, cwd=None):
         super(Configuration, self).__init__()
 
+        self.generation = 0
+        self._published = None
+        self._write_lock = threading.RLock()
+        self._shared_paths = set()
+        self.schema = None
+        self.typed = None
+        self.sources = []
+        self.applied_environment = {}
         self._name = name
         self.loaded = ()
+        self.parsed_file_cache = self.DEFAULT_PARSED_FILE_CACHE
+        self.parse_threads = self.DEFAULT_PARSE_THREADS
+        self.parsed_file_cache_info = ParsedFileCacheInfo(0, 0)
+        self._parsed_files = {}
+        self.layers = Layers()
+        self.discovery_index = self.DISCOVERY_INDEX
         self.cwd = os.getcwd() if cwd is None else cwd
-        self.file_extension = self.DEFAULT_FILE_EXTENSION
+        self.file_extensions = self.DEFAULT_FILE_EXTENSIONS
         self.system_root = self.DEFAULT_SYSTEM_ROOT
         self.user_root = self.DEFAULT_USER_ROOT
         self.local_dir = join(self.cwd, self.DEFAULT_LOCAL_DIRECTORY_NAME)
@@ -435,24 +1516,29 @@ class Configuration(dict):
         # explict version was not provided then try
         # to find one automatically.
         if version is None:
-            try:
-                self.distribution = get_distribution(name)
+            cache_path = None
+            if self.PACKAGE_METADATA_CACHE:
+                cache_path = join(
+                    self.DEFAULT_TEMP_DIRECTORY_ROOT, "package-versions.pickle")
 
-            except DistributionNotFound:
+            version = package_version(name, cache_path=cache_path)
+            if version is None:
                 raise ValueError(
                     "%r is not a Python package so you must provide "
                     "a version." % self._name)
-            else:
-                self.version = self.distribution.version
+
+            self._distribution = NOTSET
+            self.version = version
 
         else:
-            self.distribution = None
+            self._distribution = None
             self.version = version
 
         self.name = self._name.split(".")[-1]
 
         self.child_dir = join(self.DEFAULT_PARENT_APPLICATION_NAME, self.name)
         self.tempdir = join(self.DEFAULT_TEMP_DIRECTORY_ROOT, self.name)
+        self.copy_on_write = self.DEFAULT_COPY_ON_WRITE
 
         # Create the base tempdir if it does not already
         # exist.  We're handling the exception instead of
@@ -470,16 +1556,30 @@ class Configuration(dict):
         # Try to locate the package's built-in configuration
         # file.  This will be loaded before anything else
         # to provide the default values.
-        try:
-            self.package_configuration = resource_filename(
-                name,
-                join("etc", self._name.split(".")[-1] + self.file_extension))
-        except ImportError:
+        directory = package_directory(name)
+        if directory is not None:
+            self.package_configuration = join(
+                directory, "etc",
+                self._name.split(".")[-1] + self.file_extension)
+        else:
             logger.warning(
                 "Could not determine the default configuration file "
                 "path for %s", self.name)
             self.package_configuration = None
 
+    @property
+    def distribution(self):
+        """
+        The :mod:`pkg_resources` distribution for ``name`` or None if a
+        version was provided when the class was instanced.  This is looked
+        up, and :mod:`pkg_resources` imported, the first time it is
+        accessed.
+        """
+        if self._distribution is NOTSET:
+            from pkg_resources import get_distribution
+            self._distribution = get_distribution(self._name)
+        return self._distribution
+
     def split_version(self, sep="."):
         """
         Splits ``self.version`` into a tuple of individual versions.  For
@@ -539,14 +1639,57 @@ class Configuration(dict):
             directory = join(root, tail)
             all_directories.append(directory)
 
-            if not validate or isdir(directory):
+            if not validate or self.discovery_index.isdir(directory):
                 existing_directories.append(directory)
 
         return existing_directories
 
+    @property
+    def file_extension(self):
+        """
+        The first extension in ``file_extensions``.  Setting this replaces
+        ``file_extensions`` with only the new extension.
+        """
+        return self.file_extensions[0]
+
+    @file_extension.setter
+    def file_extension(self, value):
+        self.file_extensions = (value, )
+
+    def fragment_directory(self, directory):
+        """
+        Returns the path to the fragment directory, ``<name>.d``, in
+        ``directory``.  See :meth:`fragments`.
+        """
+        return join(directory, self.name + ".d")
+
+    def fragments(self, directory):
+        """
+        Returns a sorted list of the fragment files in ``directory``.
+        Fragments are files in the ``<name>.d`` directory, such as
+        ``/etc/pyfarm/agent/agent.d/10-network.yml``, which end in
+        one of ``file_extensions``.  They are loaded after ``<name>.yml``
+        in the same directory, in the order returned here, so site specific
+        settings can be added or changed one file at a time.  Hidden
+        files are ignored.
+        """
+        fragment_directory = self.fragment_directory(directory)
+        listing = self.discovery_index.listing(fragment_directory)
+        if listing is None:
+            return []
+
+        extensions = tuple(self.file_extensions)
+        return [
+            join(fragment_directory, filename)
+            for filename in sorted(listing[1])
+            if filename.endswith(extensions)
+            and not filename.startswith(".")]
+
     def files(self, validate=True, unversioned_only=False):
         """
-        Returns a list of configuration files.
+        Returns a list of configuration files.  The files in each
+        directory are ``<name>`` with each of ``file_extensions``
+        followed by any fragments, see :meth:`fragments`.
 
         :param bool validate:
             When ``True`` this method will only return files
@@ -564,11 +1707,13 @@ class Configuration(dict):
         """
         directories = self.directories(
             validate=validate, unversioned_only=unversioned_only)
-        filename = self.name + self.file_extension
+        filenames = [
+            self.name + extension for extension in self.file_extensions]
         existing_files = []
 
         if self.package_configuration is not None:
-            if not validate or isfile(self.package_configuration):
+            if not validate or self.discovery_index.isfile(
+                    self.package_configuration):
                 existing_files.append(self.package_configuration)
 
             else:
@@ -578,21 +1723,25 @@ class Configuration(dict):
                     self._name, self.package_configuration)
 
         for directory in directories:
-            filepath = join(directory, filename)
+            for filename in filenames:
+                filepath = join(directory, filename)
+
+                if not validate or self.discovery_index.isfile(filepath):
+                    existing_files.append(filepath)
 
-            if not validate or isfile(filepath):
-                existing_files.append(filepath)
+            existing_files.extend(self.fragments(directory))
 
         if not existing_files:  # pragma: no cover
             logger.error(
                 "No configuration file(s) %s were found in %s",
-                filename, pformat(directories))
+                ", ".join(filenames), pprint.pformat(directories))
 
         return existing_files
 
     def load(self, environment=None):
         """
-        Loads data from the configuration files.  Any data present
+        Loads data from the configuration files followed by each of
+        ``sources``, see :mod:`pyfarm.core.sources`.  Any data present
         in the ``env`` key in the configuration files will update
         ``environment``
 
@@ -600,119 +1749,853 @@ class Configuration(dict):
             A dictionary to load data in the ``env`` key from
             the configuration files into.  This would typically be
             set to ``os.environ`` so the environment itself could
-            be updated.
+            be updated.  The ``env`` data from every file is merged
+            first and then applied using :func:`apply_environment`.
+            The merged data is kept as ``applied_environment``.
+
+        :returns:
+            An :class:`EnvironmentChanges` instance describing how
+            ``environment`` was modified
         """
         loaded = []
-
-        for filepath in self.files():
-            with open(filepath, "rb") as stream:
-                try:
-                    data = yaml.load(stream, Loader=Loader)
-
-                except yaml.YAMLError as e:  # pragma: no cover
-                    logger.error("Failed to load %r: %s", filepath, e)
-                    continue
-
-                else:
-                    loaded.append(filepath)
-
-            # Empty file
-            if not data:
+        parsed = []
+        hits = misses = 0
+        filepaths = self.files()
+        results = self._read_files(filepaths)
+
+        for filepath in filepaths:
+            result = results[filepath]
+            if isinstance(result, FileLoadError):  # pragma: no cover
+                logger.error("Failed to load %r: %s", filepath, result)
                 continue
 
-            if environment is not None and "env" in data:
-                config_environment = data.pop("env")
-                assert isinstance(config_environment, dict)
-                environment.update(config_environment)
+            data, cached = result
+            if cached:
+                hits += 1
+            else:
+                misses += 1
+
+            loaded.append(filepath)
+            parsed.append((filepath, data))
 
-            elif environment is None:
+            if data and environment is None:
                 logger.warning(
                     "No environment was provided to be populated by the "
                     "configuration file(s)")
 
-            # Update this instance with the loaded data
-            self.update(data)
+        for source in self.sources:
+            data = source.fetch(self.tempdir)
+            if data is None:
+                continue
+
+            loaded.append(source.name)
+            parsed.append((source.name, data))
+
+        self.layers, config_environment = self._merge(
+            parsed, environment is not None)
+
+        # The merged env data is applied once, and only keys which differ
+        # from the environment are set.
+        changes = EnvironmentChanges({}, {}, ())
+        if config_environment:
+            changes = apply_environment(environment, config_environment)
+            if changes.added or changes.changed:
+                logger.debug(
+                    "Environment: %s added, %s changed, %s unchanged",
+                    len(changes.added), len(changes.changed),
+                    len(changes.unchanged))
+        self.applied_environment = config_environment
+
+        # Update this instance with the loaded data
+        self.update(self.layers.flatten())
+
+        # The environment may have been updated above so anything
+        # we've expanded so far can no longer be trusted.
+        if changes.added or changes.changed:
+            self.clear_expansion_cache()
+
+        self.parsed_file_cache_info = ParsedFileCacheInfo(hits, misses)
+        if self.parsed_file_cache:
+            logger.debug(
+                "Parsed file cache: %s hit(s), %s miss(es)", hits, misses)
 
         if loaded:
             self.loaded = tuple(loaded)
             logger.info(
-                "Loaded configuration file(s): %s", pformat(loaded))
+                "Loaded configuration file(s): %s", pprint.pformat(loaded))
         else:
             self.loaded = ()
             logger.warning(
                 "No configuration files were loaded after searching %s",
-                pformat(self.files(validate=False)))
+                pprint.pformat(self.files(validate=False)))
 
-    def _expandvars(self, value):
+        if self.schema is not None:
+            self.validate()
+
+        return changes
+
+    def validate(self):
         """
-        Performs variable expansion for ``value``. This method is run when
-        a string value is returned from :meth:`get` or :meth:`__getitem__`.
-        The default behavior of this method is to recursively expand
-        variables using sources in the following order:
+        Converts and checks the current data using ``schema``, a
+        :class:`pyfarm.core.schema.Schema`, and stores the result in
+        ``typed``.  This is called by :meth:`load` and :meth:`load_bundle`
+        when ``schema`` is set.  Values are expanded before they are
+        validated.  Returns the new
+        :class:`pyfarm.core.schema.ValidatedData`.
+
+        :raises pyfarm.core.schema.SchemaError:
+            Raised if the data does not match the schema, ``typed`` is
+            not modified.
+        """
+        if self.schema is None:
+            raise ValueError("`schema` has not been set")
 
-            * The environment, ``os.environ``
-            * The environment (from the configuration), ``env``
-            * Other values in the configuration
-            * ``~`` to the user's home directory
+        self.typed = self.schema.validate(self.snapshot())
+        return self.typed
 
-        For example, the following configuration:
+    def bundle_path(self):
+        """
+        Returns the default path used by :meth:`build_bundle` and
+        :meth:`load_bundle`
+        """
+        return join(self.tempdir, "%s-%s.bundle" % (self.name, self.version))
 
-        .. code-block:: yaml
+    def build_bundle(self, path=None, expand=True):
+        """
+        Loads the configuration files and writes the result to a single
+        bundle which :meth:`load_bundle` can load without searching for
+        or parsing any files.  Returns the path the bundle was written to.
+        See :mod:`pyfarm.core.bundle` for more information.
+
+        :param string path:
+            Where to write the bundle, defaults to :meth:`bundle_path`
+
+        :param bool expand:
+            If True, string values will be stored after variable
+            expansion has been performed on them.  The ``env`` data
+            from the configuration files is used during expansion just
+            as it would be if :meth:`load` were given :class:`os.environ`.
+        """
+        from pyfarm.core.bundle import write_bundle, list_fragments
+
+        if path is None:
+            path = self.bundle_path()
+
+        # List the fragment directories before loading so a fragment
+        # added while loading makes the bundle stale rather than being
+        # missed entirely.
+        extensions = tuple(self.file_extensions)
+        fragments = []
+        for directory in self.directories(validate=False):
+            fragment_directory = self.fragment_directory(directory)
+            fragments.append(
+                (fragment_directory, extensions,
+                 list_fragments(fragment_directory, extensions)))
+
+        environment = {}
+        self.load(environment=environment)
+        data = dict(super(Configuration, self).items())
+
+        if expand:
+            resolver = VariableResolver(
+                [self, environment, os.environ, {"temp": self.tempdir}])
+            for key, value in data.items():
+                if isinstance(value, STRING_TYPES):
+                    data[key] = expanduser(resolver.expand(value))
+
+        missing = [
+            filepath for filepath in self.files(validate=False)
+            if filepath not in self.loaded]
+
+        # Only files can be checked for changes by Bundle.stale()
+        write_bundle(
+            path, data, sources=[
+                filepath for filepath in self.loaded if isfile(filepath)],
+            missing=missing, fragments=fragments,
+            environment=environment, name=self._name, version=self.version)
+        return path
+
+    def load_bundle(self, path=None, environment=None, verify=True):
+        """
+        Loads data from a bundle written by :meth:`build_bundle`.  Returns
+        True if the bundle was loaded or False if it could not be read, is
+        damaged or is stale, in which case :meth:`load` should be used
+        instead:
 
-            foo: foo
-            bar: bar
-            foobar: $foo/$bar
-            path: ~/$foobar/$TEST
+        >>> config = Configuration("pyfarm.agent")
+        >>> config.load_bundle(environment=os.environ) or \\
+        ...     config.load(environment=os.environ)
 
-        Would result in the following assuming ``$TEST`` is an
-        environment variable set to ``somevalue`` and the current
-        user's name is ``user``:
+        :param string path:
+            The bundle to load, defaults to :meth:`bundle_path`
 
-        .. code-block:: python
+        :param dict environment:
+            Same as the ``environment`` argument to :meth:`load`
 
-            {
-                "foo": "foo",
-                "bar": "bar",
-                "foobar": "foo/bar",
-                "path": "/home/user/foo/bar/somevalue"
-            }
+        :param bool verify:
+            If True, check that the files the bundle was built from
+            have not changed using :meth:`.Bundle.stale`.
+        """
+        from pyfarm.core.bundle import Bundle, BundleError
+
+        if path is None:
+            path = self.bundle_path()
+
+        try:
+            bundle = Bundle(path)
+        except (OSError, IOError, BundleError) as e:
+            logger.debug("Not loading bundle %r: %s", path, e)
+            return False
+
+        try:
+            if verify and bundle.stale():
+                logger.warning(
+                    "Bundle %r is out of date and will not be loaded", path)
+                return False
+
+            data = dict(bundle)
+            environment_data = bundle.environment
+        except BundleError as e:
+            logger.warning("Failed to load bundle %r: %s", path, e)
+            return False
+        finally:
+            bundle.close()
+
+        if environment is not None and environment_data:
+            apply_environment(environment, environment_data)
+
+        self.layers = Layers([(path, data)])
+        self.update(data)
+        self.clear_expansion_cache()
+        self.loaded = (path, )
+        logger.info("Loaded configuration bundle %r", path)
+
+        if self.schema is not None:
+            self.validate()
+
+        return True
+
+    def shared_path(self):
+        """
+        Returns the default path used by :meth:`share`.  The path includes
+        the id of the current process so several processes may share
+        configurations with the same name and version.
+        """
+        return join(self.tempdir, "%s-%s-%s.shared" % (
+            self.name, self.version, os.getpid()))
+
+    def share(self, path=None):
+        """
+        Writes the current data, with variables expanded, to a bundle which
+        other processes can attach to using
+        :class:`pyfarm.core.bundle.SharedBundle`.  This is intended to be
+        called after :meth:`load` by a process which starts workers, the
+        returned path should be passed on to each worker.  Calling this
+        again, for example from a :meth:`watch` subscriber, replaces the
+        file so attached workers can pick up the change with
+        :meth:`.SharedBundle.refresh`.  The file is removed when this
+        process exits.
+
+        :param string path:
+            Where to write the data, defaults to :meth:`shared_path`
+        """
+        from pyfarm.core.bundle import write_bundle
+
+        if path is None:
+            path = self.shared_path()
+
+        snapshot = self.snapshot()
+        data = dict((key, snapshot[key]) for key in snapshot)
+        write_bundle(
+            path, data, name=self._name, version=self.version,
+            stamp=(os.getpid(), snapshot.generation))
+
+        if path not in self._shared_paths:
+            self._shared_paths.add(path)
+            atexit.register(remove_shared_file, path)
+
+        return path
+
+    def watch(self, environment=None, interval=1.0, start=True):
+        """
+        Returns a :class:`pyfarm.core.watch.ConfigurationWatcher` which
+        will reload this instance when the configuration files change.  This
+        should be called after :meth:`load`.
+
+        :param dict environment:
+            Same as the ``environment`` argument to :meth:`load`
+
+        :param float interval:
+            See :class:`pyfarm.core.watch.ConfigurationWatcher`
+
+        :param bool start:
+            If True, start the watcher's thread before returning
+        """
+        from pyfarm.core.watch import ConfigurationWatcher
+        watcher = ConfigurationWatcher(
+            self, environment=environment, interval=interval)
+
+        if start:
+            watcher.start()
+
+        return watcher
+
+    def _merge(self, parsed, split_environment):
+        """
+        Builds :class:`Layers` from a list of ``(filepath, data)`` tuples
+        and returns it along with the merged ``env`` data.  The data
+        provided in ``parsed`` is never modified or copied.
+
+        :param bool split_environment:
+            If True, the ``env`` key from each file will be merged into
+            the second return value instead of being part of the layers.
+        """
+        merged_environment = {}
+
+        if split_environment:
+            for _, data in parsed:
+                if data and "env" in data:
+                    config_environment = data["env"]
+                    assert isinstance(config_environment, dict)
+                    merged_environment.update(config_environment)
+
+        layers = Layers(parsed, exclude=("env", ) if split_environment else ())
+        return layers, merged_environment
+
+    def provenance(self, key):
+        """
+        Returns the path of the configuration file which supplied the
+        current value of ``key``.  None is returned if ``key`` was not
+        loaded from a file or if its value was replaced after it
+        was loaded.
+        """
+        value = super(Configuration, self).get(key, NOTSET)
+        if value is NOTSET or key not in self.layers:
+            return None
+
+        if self.layers[key] is not value:
+            return None
+
+        return self.layers.provenance(key)
+
+    def _read_file(self, filepath, signature=None):
+        """
+        Returns a tuple containing the parsed data for ``filepath``
+        and a boolean which is True if the data came from a cache instead of
+        being parsed.  The data most recently read for each file is kept,
+        along with its signature, in ``_parsed_files`` and with
+        ``parsed_file_cache`` enabled it is reused until the signature of
+        the file changes.  A copy is returned each time so modifying a
+        loaded value never changes what a later :meth:`load` returns.
+
+        :param tuple signature:
+            The signature of ``filepath`` as returned by
+            :meth:`_file_signature`.  This will be retrieved if not provided.
+        """
+        if signature is None:
+            signature = self._file_signature(filepath)
+
+        data = NOTSET
+        if self.parsed_file_cache:
+            data = self._cached_file(filepath, signature)
+            if data is not NOTSET:
+                return data, True
+
+            data = self._read_parsed_file_cache(filepath, signature)
+
+        from_cache = data is not NOTSET
+        settled = True
+        if not from_cache:
+            settled = self._settled(signature)
+            data = self._parse_file(filepath)
+
+            if self.parsed_file_cache and settled:
+                self._write_parsed_file_cache(filepath, signature, data)
+
+        self._parsed_files[filepath] = (signature, data, settled)
+        return deepcopy(data), from_cache
+
+    def _cached_file(self, filepath, signature):
+        """
+        Returns a copy of the data in ``_parsed_files`` for ``filepath``
+        or ``NOTSET`` if the data can't be reused for ``signature``.
+        """
+        cached = self._parsed_files.get(filepath)
+        if cached is None or cached[0] != signature or not cached[2]:
+            return NOTSET
+
+        return deepcopy(cached[1])
+
+    def _settled(self, signature):
         """
-        template_values = {"temp": self.tempdir}
-        template_values.update(os.environ)
-        template_values.update(self.get("env", {}))
-        template_values.update(**self)
-
-        # Do recursive variable expansion until we've either
-        # reached MAX_EXPANSION_RECURSION or the resulting
-        # value is unchanged
-        for _ in range_(self.MAX_EXPANSION_RECURSION):
-            template = Template(value)
-            expanded = expanduser(template.safe_substitute(**template_values))
-
-            # Nothing left to expand
-            if value == expanded:
-                break
+        Returns True if the modification time in ``signature`` is old
+        enough that any further change to the file will also change its
+        modification time, see ``PARSED_FILE_MTIME_RESOLUTION``.
+        """
+        mtime = signature[1]
+        if not isinstance(mtime, float):
+            mtime /= 1e9  # st_mtime_ns
+        return time.time() - mtime > self.PARSED_FILE_MTIME_RESOLUTION
+
+    def _read_files(self, filepaths):
+        """
+        Calls :meth:`_read_file` for each path in ``filepaths`` and returns
+        a dictionary of the results.  Files which are not already in memory
+        are parsed concurrently using up to ``parse_threads`` threads.  If
+        a file could not be parsed its result is the
+        :class:`FileLoadError` which was raised instead of a tuple.
+        """
+        results = {}
+        pending = []
+        for filepath in filepaths:
+            signature = self._file_signature(filepath)
+            data = NOTSET
+            if self.parsed_file_cache:
+                data = self._cached_file(filepath, signature)
+            if data is not NOTSET:
+                results[filepath] = (data, True)
             else:
-                value = expanded
+                pending.append((filepath, signature))
 
-        return value
+        def read(filepath, signature):
+            try:
+                return self._read_file(filepath, signature)
+            except FileLoadError as e:
+                return e
 
-    def get(self, key, default=None):
+        executor = None
+        if len(pending) > 1 and self.parse_threads > 1:
+            try:
+                from concurrent.futures import ThreadPoolExecutor
+            except ImportError:  # pragma: no cover
+                pass
+            else:
+                executor = ThreadPoolExecutor(
+                    min(self.parse_threads, len(pending)))
+
+        if executor is None:
+            for filepath, signature in pending:
+                results[filepath] = read(filepath, signature)
+        else:
+            try:
+                futures = [
+                    (filepath, executor.submit(read, filepath, signature))
+                    for filepath, signature in pending]
+                for filepath, future in futures:
+                    results[filepath] = future.result()
+            finally:
+                executor.shutdown()
+
+        return results
+
+    def _parse_file(self, filepath):
         """
-        Overrides :meth:`dict.get` to provide internal variable
-        expansion through :meth:`_expandvars`.
+        Parses and returns the contents of ``filepath`` using the loader
+        registered for its extension, see :func:`register_loader`.
+
+        :raises FileLoadError:
+            Raised if there's no loader for ``filepath`` or the file
+            could not be parsed
         """
-        value = super(Configuration, self).get(key, default)
-        if isinstance(value, STRING_TYPES):
-            value = self._expandvars(value)
-        return value
+        loader = get_loader(filepath)
+        start = monotonic()
+        with open(filepath, "rb") as stream:
+            try:
+                data = loader.function(stream)
+            except ValueError as e:
+                if isinstance(e, FileLoadError):
+                    raise
+                raise FileLoadError(str(e))
+
+        logger.debug(
+            "Parsed %r using the %s loader in %.2fms",
+            filepath, loader.name, (monotonic() - start) * 1000)
+        return data
+
+    def _file_signature(self, filepath):
+        """
+        Returns a tuple which will change if ``filepath`` is modified or
+        replaced.  This is used to validate the entries produced by
+        :meth:`_write_parsed_file_cache`.
+        """
+        stat = os.stat(filepath)
+        mtime = getattr(stat, "st_mtime_ns", stat.st_mtime)
+        return abspath(filepath), mtime, stat.st_size, stat.st_ino
 
-    def __getitem__(self, item):
+    def _parsed_file_cache_path(self, filepath):
+        """Returns the path to the parsed file cache entry for ``filepath``"""
+        digest = sha1(abspath(filepath).encode("utf-8")).hexdigest()
+        return join(self.tempdir, "parsed", digest + ".pickle")
+
+    def _read_parsed_file_cache(self, filepath, signature):
         """
-        Overrides :meth:`dict.__getitem__` to provide internal variable
-        expansion through :meth:`_expandvars`.
+        Returns the cached data for ``filepath`` or ``NOTSET`` if there
+        is no cached data or ``signature`` does not match the signature
+        that was stored along side the data.
         """
-        value = super(Configuration, self).__getitem__(item)
-        if isinstance(value, STRING_TYPES):
-            value = self._expandvars(value)
+        cached = read_pickle_cache(self._parsed_file_cache_path(filepath))
+        if cached is NOTSET:
+            return NOTSET
+
+        cached_signature, data = cached
+        if tuple(cached_signature) != signature:
+            return NOTSET
+
+        return data
+
+    def _write_parsed_file_cache(self, filepath, signature, data):
+        """
+        Stores ``data`` and ``signature`` in the parsed file cache
+        entry for ``filepath``.  The entry is written to a temporary
+        file first and then renamed so concurrent readers will never see
+        a partially written entry.
+        """
+        write_pickle_cache(
+            self._parsed_file_cache_path(filepath), (signature, data),
+            self.PARSED_FILE_CACHE_PROTOCOL)
+
+    @property
+    def copy_on_write(self):
+        """
+        See ``DEFAULT_COPY_ON_WRITE``.  Enabling this publishes a snapshot
+        of the current data immediately.
+        """
+        return self._published is not None
+
+    @copy_on_write.setter
+    def copy_on_write(self, value):
+        with self._write_lock:
+            if value:
+                self._published = ConfigurationSnapshot(
+                    dict.copy(self), self.generation, self.tempdir)
+            else:
+                self._published = None
+
+    def snapshot(self):
+        """
+        Returns a :class:`ConfigurationSnapshot` of the current generation.
+        With ``copy_on_write`` enabled this is the published snapshot and
+        costs nothing, otherwise the data is copied.
+        """
+        published = self._published
+        if published is not None:
+            return published
+
+        with self._write_lock:
+            return ConfigurationSnapshot(
+                dict.copy(self), self.generation, self.tempdir)
+
+    def _changed(self):
+        """
+        Called after the underlying dictionary is modified.  This discards
+        anything cached by :meth:`_expandvars`, advances ``generation``
+        and, with ``copy_on_write`` enabled, publishes a new snapshot.
+        Callers must hold ``_write_lock``.
+        """
+        self._expansion_cache.clear()
+        self.generation += 1
+        if self._published is not None:
+            self._published = ConfigurationSnapshot(
+                dict.copy(self), self.generation, self.tempdir)
+
+    def apply_changes(self, updates, removed=()):
+        """
+        Updates the configuration with ``updates`` and removes the keys in
+        ``removed`` as a single change, so only one new generation is
+        published.
+
+        :param dict updates:
+            Keys and values to set
+
+        :param removed:
+            Keys to remove, keys which are not present are ignored
+        """
+        with self._write_lock:
+            dict.update(self, updates)
+            for key in removed:
+                dict.pop(self, key, None)
+            self._changed()
+
+    def __getstate__(self):
+        """
+        Returns the attributes to pickle.  The lock and the published
+        snapshot are recreated by :meth:`__setstate__` instead, only
+        whether ``copy_on_write`` was enabled is kept.
+        """
+        state = super(Configuration, self).__getstate__()
+        del state["_write_lock"]
+        state["_published"] = self._published is not None
+
+        # Files shared by this instance are removed when this process
+        # exits, a copy in another process does not own them.
+        state["_shared_paths"] = set()
+        return state
+
+    def __setstate__(self, state):
+        state = state.copy()
+        copy_on_write = state.pop("_published")
+        super(Configuration, self).__setstate__(state)
+        self._write_lock = threading.RLock()
+        self._published = None
+        self.copy_on_write = copy_on_write
+
+    def clear_expansion_cache(self):
+        super(Configuration, self).clear_expansion_cache()
+        published = self._published
+        if published is not None:
+            published.clear_expansion_cache()
+
+    clear_expansion_cache.__doc__ = ExpansionMixin.clear_expansion_cache.__doc__
+
+    def get(self, key, default=None):
+        published = self._published
+        if published is not None:
+            return published.get(key, default)
+        return super(Configuration, self).get(key, default)
+
+    get.__doc__ = ExpansionMixin.get.__doc__
+
+    def __getitem__(self, item):
+        published = self._published
+        if published is not None:
+            return published[item]
+        return super(Configuration, self).__getitem__(item)
+
+    __getitem__.__doc__ = ExpansionMixin.__getitem__.__doc__
+
+    # With copy_on_write enabled the methods below also read the published
+    # snapshot, which is never modified, so they are safe while another
+    # thread reloads.  __iter__ is not overridden because dict(config)
+    # would then copy expanded values, iterate over keys() or snapshot()
+    # instead of the configuration itself.
+    def __contains__(self, key):
+        published = self._published
+        if published is not None:
+            return key in published
+        return dict.__contains__(self, key)
+
+    def __len__(self):
+        published = self._published
+        if published is not None:
+            return len(published)
+        return dict.__len__(self)
+
+    def keys(self):
+        published = self._published
+        if published is not None:
+            return published.keys()
+        return dict.keys(self)
+
+    def values(self):
+        published = self._published
+        if published is not None:
+            return published.values()
+        return dict.values(self)
+
+    def items(self):
+        published = self._published
+        if published is not None:
+            return published.items()
+        return dict.items(self)
+
+    # Methods which modify the underlying dictionary must also
+    # discard anything cached by _expandvars() and publish the change.
+    def __setitem__(self, key, value):
+        with self._write_lock:
+            super(Configuration, self).__setitem__(key, value)
+            self._changed()
+
+    def __delitem__(self, key):
+        with self._write_lock:
+            super(Configuration, self).__delitem__(key)
+            self._changed()
+
+    def update(self, *args, **kwargs):
+        with self._write_lock:
+            super(Configuration, self).update(*args, **kwargs)
+            self._changed()
+
+    def setdefault(self, key, default=None):
+        with self._write_lock:
+            value = super(Configuration, self).setdefault(key, default)
+            self._changed()
+        return value
+
+    def pop(self, *args):
+        with self._write_lock:
+            value = super(Configuration, self).pop(*args)
+            self._changed()
         return value
+
+    def popitem(self):
+        with self._write_lock:
+            item = super(Configuration, self).popitem()
+            self._changed()
+        return item
+
+    def clear(self):
+        with self._write_lock:
+            super(Configuration, self).clear()
+            self._changed()
+
+
+class VariableResolver(object):
+    """
+    Resolves ``$name`` and ``${name}`` references in strings.  Each string
+    is parsed once and each name it references is resolved once, in
+    dependency order, so the cost of an expansion is linear in the number
+    of references involved regardless of how deeply they are chained.
+    Results are kept for the lifetime of the instance.
+
+    :param list sources:
+        The mappings to look names up in, highest priority first.  Values
+        are read using ``dict.get`` so the raw values of a
+        :class:`Configuration` are used rather than the expanded ones.
+
+    :var set cycles:
+        Tuples of names, in the order they were followed, which form a
+        circular reference.  References which close a cycle are left
+        unexpanded.
+
+    :var set unresolved:
+        Names which could not be found in any of the sources.  Like
+        :meth:`string.Template.safe_substitute` these are left unexpanded.
+
+    :var set requested:
+        Every name which was looked up in the sources.
+    """
+    pattern = Template.pattern
+
+    def __init__(self, sources):
+        self.getters = []
+        for source in sources:
+            if isinstance(source, dict):
+                self.getters.append(partial(dict.get, source))
+            else:
+                self.getters.append(source.get)
+
+        self.cycles = set()
+        self.unresolved = set()
+        self.requested = set()
+        self._parsed = {}
+        self._resolved = {}
+
+    def parse(self, value):
+        """
+        Splits ``value`` into a list of tokens.  Literal text is
+        represented as a string and each reference is represented as a
+        tuple of the referenced name and the original text of the reference.
+        """
+        tokens = self._parsed.get(value)
+        if tokens is not None:
+            return tokens
+
+        tokens = []
+        position = 0
+        for match in self.pattern.finditer(value):
+            start, end = match.span()
+            if start > position:
+                tokens.append(value[position:start])
+
+            name = match.group("named") or match.group("braced")
+            if name is not None:
+                tokens.append((name, match.group()))
+            elif match.group("escaped") is not None:
+                tokens.append(match.group("escaped"))
+            else:
+                tokens.append(match.group())
+
+            position = end
+
+        if position < len(value):
+            tokens.append(value[position:])
+
+        self._parsed[value] = tokens
+        return tokens
+
+    def lookup(self, name):
+        """
+        Returns the raw value of ``name`` from the highest priority source
+        which contains it or ``NOTSET`` if no source does.
+        """
+        self.requested.add(name)
+        for getter in self.getters:
+            value = getter(name, NOTSET)
+            if value is not NOTSET:
+                return value
+        return NOTSET
+
+    def resolve(self, name):
+        """
+        Returns the fully expanded value of ``name`` or ``NOTSET`` if
+        it could not be resolved.  The dependencies of ``name`` are walked
+        depth first without recursion so long chains of references won't
+        exhaust the stack.
+        """
+        resolved = self._resolved
+        if name in resolved:
+            return resolved[name]
+
+        raw_values = {}
+        stack = [(name, False)]
+
+        while stack:
+            current, dependencies_resolved = stack.pop()
+
+            if dependencies_resolved:
+                resolved[current] = self._join(self.parse(raw_values[current]))
+                continue
+
+            if current in resolved:
+                continue
+
+            raw = self.lookup(current)
+            if raw is NOTSET:
+                self.unresolved.add(current)
+                resolved[current] = NOTSET
+                continue
+
+            if not isinstance(raw, STRING_TYPES):
+                resolved[current] = "%s" % (raw, )
+                continue
+
+            raw_values[current] = raw
+            stack.append((current, True))
+
+            for token in self.parse(raw):
+                if token.__class__ is not tuple or token[0] in resolved:
+                    continue
+
+                # A name which has been visited but not resolved yet is
+                # one we're still in the middle of resolving.
+                if token[0] in raw_values:
+                    active = [entry for entry, pending in stack if pending]
+                    self.cycles.add(
+                        tuple(active[active.index(token[0]):]) + (token[0], ))
+                else:
+                    stack.append((token[0], False))
+
+        return resolved[name]
+
+    def expand(self, value):
+        """Returns ``value`` with all resolvable references expanded."""
+        tokens = self.parse(value)
+
+        for token in tokens:
+            if token.__class__ is tuple:
+                self.resolve(token[0])
+
+        return self._join(tokens)
+
+    def _join(self, tokens):
+        resolved = self._resolved
+        output = []
+
+        for token in tokens:
+            if token.__class__ is tuple:
+                value = resolved.get(token[0], NOTSET)
+                output.append(token[1] if value is NOTSET else value)
+            else:
+                output.append(token)
+
+        return "".join(output)
@@ -164,7 +164,14 @@ PY_VERSION = (PY_MAJOR, PY_MINOR)
 if PY_VERSION <= (2, 5):  # pragma: no cover
     raise RuntimeError("Python 2.5 and below is not supported")
 
-from collections import namedtuple
+from array import array
+from collections import namedtuple, Counter
+from threading import Lock
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # pragma: no cover
+    from collections import MutableMapping
 
 NOTSET = object()
 
@@ -233,7 +240,14 @@ class Values(namedtuple("Values", ("int", "str"))):
     Stores values to be used in an enum.  Each time this
     class is instanced it will ensure that the input values
     are of the correct type and unique.
+
+    Instances have no ``__dict__`` and hash the same as their ``str``
+    value so a :class:`Values` instance and its string may be used
+    interchangeably as a dictionary key.  Use the ``_index`` of an enum
+    produced by :func:`cast_enum` to look up a value by its ``int``.
     """
+    __slots__ = ()
+
     # Numerical types which are specific to the enums
     # only.
     try:
@@ -245,76 +259,94 @@ class Values(namedtuple("Values", ("int", "str"))):
     _integers = set()
 
     def __init__(self, *args, **kwargs):
-        if not isinstance(self.int, self.NUMERIC_TYPES):
+        if not isinstance(self[0], self.NUMERIC_TYPES):
             raise TypeError("`int` must be an number")
 
-        if not isinstance(self.str, STRING_TYPES):
+        if not isinstance(self[1], STRING_TYPES):
             raise TypeError("`str` must be a string")
 
-        if self.check_uniqueness and self.int in self._integers:
-            raise ValueError("value %s is being reused" % self.int)
+        if self.check_uniqueness and self[0] in self._integers:
+            raise ValueError("value %s is being reused" % self[0])
         else:
-            self._integers.add(self.int)
-
-        self._values = set([self.int, self.str])
+            self._integers.add(self[0])
 
     def __hash__(self):
-        return self.str.__hash__()
+        return hash(self[1])
 
     def __int__(self):
-        return self.int
+        return self[0]
 
     def __str__(self):
-        return self.str
+        return self[1]
 
     def __repr__(self):  # pragma: no cover
         return "%s(%s, %s)" % (
-            self.__class__.__name__, self.int, repr(self.str))
+            self.__class__.__name__, self[0], repr(self[1]))
 
     def __contains__(self, item):
         if isinstance(item, STRING_TYPES):
-            return item == self.str
-        elif isinstance(item, self.NUMERIC_TYPES):
-            return item == self.int
+            return item == self[1]
         elif isinstance(item, Values):
-            return item.str == self.str and item.int == self.int
+            return item[1] == self[1] and item[0] == self[0]
+        elif isinstance(item, self.NUMERIC_TYPES):
+            return item == self[0]
         else:  # pragma: no cover
             return False
 
+    # The methods below check for exact str and int types first, the
+    # common case, before falling back on isinstance checks.
     def __eq__(self, other):
+        cls = other.__class__
+        if cls is str:
+            return other == self[1]
+        elif cls is int:
+            return other == self[0]
         return self.__contains__(other)
 
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def _int_for(self, other):
+        """Returns the integer ``other`` should be compared using"""
+        if isinstance(other, Values):
+            return other[0]
+        elif isinstance(other, self.NUMERIC_TYPES):
+            return other
+        raise NotImplementedError("Cannot compare against %s" % type(other))
+
     def __gt__(self, other):
-        if isinstance(other, self.NUMERIC_TYPES):
-            return other < self.int
-        elif isinstance(other, Values):
-            return other.int < self.int
-        else:
-            raise NotImplementedError("Cannot compare against %s" % type(other))
+        if other.__class__ is int:
+            return self[0] > other
+        return self[0] > self._int_for(other)
 
     def __ge__(self, other):
-        if isinstance(other, self.NUMERIC_TYPES):
-            return other <= self.int
-        elif isinstance(other, Values):
-            return other.int <= self.int
-        else:
-            raise NotImplementedError("Cannot compare against %s" % type(other))
+        if other.__class__ is int:
+            return self[0] >= other
+        return self[0] >= self._int_for(other)
 
     def __lt__(self, other):
-        if isinstance(other, self.NUMERIC_TYPES):
-            return other > self.int
-        elif isinstance(other, Values):
-            return other.int > self.int
-        else:
-            raise NotImplementedError("Cannot compare against %s" % type(other))
+        if other.__class__ is int:
+            return self[0] < other
+        return self[0] < self._int_for(other)
 
     def __le__(self, other):
-        if isinstance(other, self.NUMERIC_TYPES):
-            return other >= self.int
-        elif isinstance(other, Values):
-            return other.int >= self.int
-        else:
-            raise NotImplementedError("Cannot compare against %s" % type(other))
+        if other.__class__ is int:
+            return self[0] <= other
+        return self[0] <= self._int_for(other)
+
+
+# Every enum produced by cast_enum(), see _enum_key() for the keys
+_MAPPED_ENUMS = {}
+_MAPPED_ENUMS_LOCK = Lock()
+
+RegisteredEnum = namedtuple("RegisteredEnum", ("name", "enum_type", "enum"))
+
+
+def _enum_key(name, fields, values, enum_type):
+    # Enums are identified by their contents rather than their identity
+    # so the same enum rebuilt elsewhere, for example by pickle, maps to
+    # the same object.
+    return name, tuple(fields), tuple(values), enum_type
 
 
 def cast_enum(enum, enum_type):
@@ -330,45 +362,396 @@ def cast_enum(enum, enum_type):
     >>> assert Foo.A == 1
     >>> assert Foo._map == {"A": 1, 1: "A"}
 
-    .. warning::
-        This function does not perform any kind of caching.  For the most
-        efficient usage it should only be called once per process or
-        module for a given enum and enum_type combination.
+    Membership tests, such as ``105 in Foo``, and ``Foo._normalize(105)``
+    which converts any form of a value to ``enum_type``, are a single
+    dictionary lookup.
+
+    Results are interned so calling this again with an equivalent
+    ``enum`` and the same ``enum_type`` returns the same object, see
+    :func:`registered_enums`.  The results can be pickled.
     """
+    if enum_type is not int and enum_type is not str:
+        raise TypeError("Valid values for `enum_type` are int or str")
+
+    values = tuple((value.int, value.str) for value in enum)
+    key = _enum_key(enum.__class__.__name__, enum._fields, values, enum_type)
+
+    mapped = _MAPPED_ENUMS.get(key)
+    if mapped is not None:
+        return mapped
+
+    with _MAPPED_ENUMS_LOCK:
+        mapped = _MAPPED_ENUMS.get(key)
+        if mapped is None:
+            mapped = _MAPPED_ENUMS[key] = _build_mapped_enum(
+                enum, enum_type, key)
+
+    return mapped
+
+
+def _build_mapped_enum(enum, enum_type, key):
     enum_data = {}
     reverse_map = {}
+    index = {}
 
-    # construct the reverse mapping and push
-    # the request type into enum_data
-    for key, value in enum._asdict().items():
+    # construct the reverse mapping, the index of every accepted
+    # form of each value and push the request type into enum_data
+    for key_name, value in enum._asdict().items():
         reverse_map[value.int] = value.str
         reverse_map[value.str] = value.int
 
         if enum_type is int:
-            enum_data[key] = value.int
-        elif enum_type is str:
-            enum_data[key] = value.str
+            enum_data[key_name] = value.int
         else:
-            raise TypeError("Valid values for `enum_type` are int or str")
+            enum_data[key_name] = value.str
+
+        # The str is inserted before the Values instance, which hashes
+        # the same, so the str remains the key and looking up a str
+        # never has to call Values.__eq__.
+        for form in (value.str, value.int, value):
+            index[form] = enum_data[key_name]
 
     class MappedEnum(
         namedtuple(
             enum.__class__.__name__, enum_data.keys())):  # pragma: no cover
         _map = reverse_map
         _enum = enum
+        _key = key
+        _index = index
 
         def __contains__(self, item):
-            if item in self._map:
-                return True
-            else:
-                for key, value in self._enum._asdict().items():
-                    if item in value:
-                        return True
-            return False
+            return item in self._index
+
+        def _normalize(self, item, default=NOTSET):
+            """
+            Returns the value of this enum matching ``item``, which may
+            be the int, str or :class:`Values` form of the value.
+
+            :raises ValueError:
+                Raised if ``item`` is not part of this enum and no
+                ``default`` was provided
+            """
+            try:
+                return self._index[item]
+            except KeyError:
+                if default is NOTSET:
+                    raise ValueError(
+                        "%r is not a member of %s" % (
+                            item, self.__class__.__name__))
+                return default
+
+        def __reduce__(self):
+            return _rebuild_mapped_enum, self._key
 
     return MappedEnum(**enum_data)
 
 
+def _rebuild_mapped_enum(name, fields, values, enum_type):
+    """
+    Returns the enum produced by :func:`cast_enum` for the given key,
+    rebuilding the original enum if this process has not produced it.
+    """
+    mapped = _MAPPED_ENUMS.get(_enum_key(name, fields, values, enum_type))
+    if mapped is not None:
+        return mapped
+
+    # The values were checked when they were first created,
+    # don't check them for uniqueness again.
+    template = namedtuple(name, fields)
+    enum = template(*[
+        tuple.__new__(Values, value) for value in values])
+    return cast_enum(enum, enum_type)
+
+
+def registered_enums():
+    """
+    Returns a list of :class:`RegisteredEnum` tuples, sorted by name, for
+    every enum :func:`cast_enum` has produced.  The mapping of each enum
+    is available using ``enum._asdict()`` and ``enum._map``.
+    """
+    with _MAPPED_ENUMS_LOCK:
+        items = list(_MAPPED_ENUMS.items())
+
+    return sorted(
+        (RegisteredEnum(key[0], key[3], mapped) for key, mapped in items),
+        key=lambda item: (item.name, item.enum_type.__name__))
+
+
+class StateDict(MutableMapping):
+    """
+    Mapping whose keys are the members of an enum.  Keys may be given in
+    any form the enum accepts, the :class:`Values` instance, the
+    ``int`` or the ``str``, and are converted to the enum's type with a
+    single lookup in the enum's ``_index``:
+
+    >>> counts = StateDict.filled(WorkState, int)
+    >>> counts[WorkState.RUNNING] += 1
+    >>> counts[105] += 1
+    >>> counts["running"]
+    2
+
+    :param enum:
+        An enum produced by :func:`cast_enum`, keys are stored using the
+        type of its values.  An enum produced by :func:`Enum` may also be
+        used, in which case keys are stored as strings.
+
+    :raises KeyError:
+        Raised when getting, setting or deleting a key which is not a
+        member of the enum
+    """
+    __slots__ = ("enum", "_index", "_data")
+
+    def __init__(self, enum, *args, **kwargs):
+        if not hasattr(enum, "_index"):
+            enum = cast_enum(enum, str)
+
+        self.enum = enum
+        self._index = enum._index
+        self._data = {}
+        if args or kwargs:
+            self.update(*args, **kwargs)
+
+    @classmethod
+    def filled(cls, enum, factory):
+        """
+        Returns a :class:`StateDict` containing every member of ``enum``
+        with a value produced by calling ``factory``
+        """
+        state_dict = cls(enum)
+        for value in state_dict.enum:
+            state_dict._data[value] = factory()
+        return state_dict
+
+    def __getitem__(self, key):
+        return self._data[self._index[key]]
+
+    def __setitem__(self, key, value):
+        self._data[self._index[key]] = value
+
+    def __delitem__(self, key):
+        del self._data[self._index[key]]
+
+    def __contains__(self, key):
+        try:
+            return self._index[key] in self._data
+        except (KeyError, TypeError):
+            return False
+
+    def get(self, key, default=None):
+        try:
+            return self._data[self._index[key]]
+        except (KeyError, TypeError):
+            return default
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return "%s(%s, %r)" % (
+            self.__class__.__name__, self.enum._key[0], self._data)
+
+
+# Set by _numpy() the first time one of the bulk functions below runs,
+# importing numpy is too slow to do when this module is imported.
+_NUMPY = NOTSET
+
+
+def _numpy():
+    """Returns :mod:`numpy` or None if it is not installed"""
+    global _NUMPY
+    if _NUMPY is NOTSET:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _NUMPY = numpy
+    return _NUMPY
+
+
+def _int_enum(enum):
+    """Returns the integer version of ``enum``, see :func:`cast_enum`"""
+    return cast_enum(getattr(enum, "_enum", enum), int)
+
+
+def _typecode(int_enum):
+    """
+    Returns the :mod:`array` type code and numpy dtype which can hold
+    every value in ``int_enum``
+    """
+    if all(0 <= value < 256 for value in int_enum):
+        return "B", "uint8"
+    elif all(0 <= value < 65536 for value in int_enum):
+        return "H", "uint16"
+    return "q", "int64"
+
+
+def _byte_codes(codes):
+    """
+    Returns the contents of ``codes`` as a string of bytes if it's an
+    ``array("B")``, otherwise None.  Work and agent states fit in a byte
+    so :meth:`bytes.count` and :meth:`bytes.translate` can process them
+    in C when numpy is not installed.
+    """
+    if isinstance(codes, array) and codes.typecode == "B":
+        try:
+            return codes.tobytes()
+        except AttributeError:  # pragma: no cover
+            return codes.tostring()
+    return None
+
+
+def encode_states(enum, values, use_numpy=None):
+    """
+    Converts a sequence of enum values, in any form :class:`StateDict`
+    accepts, to a compact array of their integer values.  A numpy array
+    is returned if numpy is installed, otherwise an :class:`array.array`.
+    The smallest unsigned type which fits every value is used, work and
+    agent states are stored in a byte each, ``array("B")``.
+
+    >>> codes = encode_states(WorkState, ["running", "done", 105])
+    >>> list(decode_states(WorkState, codes))
+    ['running', 'done', 'running']
+
+    :param enum:
+        An enum produced by :func:`Enum` or :func:`cast_enum`
+
+    :param values:
+        The values to encode
+
+    :param bool use_numpy:
+        If False always return an :class:`array.array`.  By default numpy
+        is used if it can be imported.
+
+    :raises ValueError:
+        Raised if a value is not a member of ``enum``
+    """
+    int_enum = _int_enum(enum)
+    typecode, dtype = _typecode(int_enum)
+    lookup = int_enum._index.__getitem__
+
+    try:
+        if use_numpy is not False and _numpy() is not None:
+            return _numpy().fromiter(map(lookup, values), dtype=dtype)
+        return array(typecode, map(lookup, values))
+    except KeyError as e:
+        raise ValueError(
+            "%r is not a member of %s" % (e.args[0], int_enum._key[0]))
+
+
+def decode_states(enum, codes):
+    """
+    Converts an array produced by :func:`encode_states` back to the values
+    of ``enum``, strings unless ``enum`` was cast to ``int``.  A list is
+    returned for an :class:`array.array` and a numpy array of objects
+    for a numpy array.
+
+    :raises ValueError:
+        Raised if a code is not a value in ``enum``
+    """
+    if not hasattr(enum, "_index"):
+        enum = cast_enum(enum, str)
+    int_enum = _int_enum(enum)
+
+    numpy = _numpy()
+    if numpy is not None and isinstance(codes, numpy.ndarray):
+        if int_enum and min(int_enum) >= 0:
+            table = numpy.empty(max(int_enum) + 1, dtype=object)
+            for value in int_enum:
+                table[value] = enum._index[value]
+            try:
+                decoded = table[codes]
+            except IndexError:
+                decoded = None
+
+            if decoded is not None and not (decoded == None).any():
+                return decoded
+
+        codes = codes.tolist()
+
+    try:
+        return list(map(enum._index.__getitem__, codes))
+    except KeyError as e:
+        raise ValueError(
+            "%r is not a member of %s" % (e.args[0], int_enum._key[0]))
+
+
+def count_states(enum, codes):
+    """
+    Counts the number of times each value of ``enum`` appears in an array
+    produced by :func:`encode_states` and returns a :class:`StateDict`
+    of the counts.  Values which do not appear have a count of zero.
+    This is the basis of a rollup such as the state of a job based on
+    the states of its tasks:
+
+    >>> counts = count_states(DBWorkState, codes)
+    >>> if counts[WorkState.FAILED]:
+    ...     pass
+    """
+    if not hasattr(enum, "_index"):
+        enum = cast_enum(enum, str)
+    int_enum = _int_enum(enum)
+    counts = StateDict.filled(enum, int)
+
+    numpy = _numpy()
+    if numpy is not None and isinstance(codes, numpy.ndarray) \
+            and codes.dtype.kind == "u":
+        bins = numpy.bincount(codes, minlength=max(int_enum) + 1)
+        for value in int_enum:
+            counts[value] = int(bins[value])
+        return counts
+
+    data = _byte_codes(codes)
+    if data is not None:
+        for value in int_enum:
+            counts[value] = data.count(bytearray((value, )))
+        return counts
+
+    # Counter counts in C so this is still fast without numpy
+    for value, count in Counter(codes).items():
+        if value in int_enum._index:
+            counts[value] = count
+    return counts
+
+
+def state_mask(enum, codes, states):
+    """
+    Returns a mask which is True for each entry in ``codes``, an array
+    produced by :func:`encode_states`, that is one of ``states``.  The
+    mask is a numpy array of booleans for a numpy array, otherwise an
+    ``array("B")`` of ones and zeros.
+
+    >>> running = state_mask(WorkState, codes, [WorkState.RUNNING])
+
+    :param states:
+        The values to match, in any form :class:`StateDict` accepts
+
+    :raises ValueError:
+        Raised if a value in ``states`` is not a member of ``enum``
+    """
+    int_enum = _int_enum(enum)
+    try:
+        wanted = set(int_enum._index[state] for state in states)
+    except KeyError as e:
+        raise ValueError(
+            "%r is not a member of %s" % (e.args[0], int_enum._key[0]))
+
+    numpy = _numpy()
+    if numpy is not None and isinstance(codes, numpy.ndarray):
+        return numpy.isin(codes, list(wanted))
+
+    data = _byte_codes(codes)
+    if data is not None:
+        table = bytearray(256)
+        for code in wanted:
+            table[code] = 1
+        return array("B", data.translate(bytes(table)))
+
+    return array("B", map(wanted.__contains__, codes))
+
+
 # 1xx - work states
 # NOTE: these values are directly tested test_enums.test_direct_work_values
 _WorkState = Enum(
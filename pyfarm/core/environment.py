@@ -0,0 +1,411 @@
+# No shebang line, this module is meant to be imported
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Environment Variables
+=====================
+
+Registry of the environment variables PyFarm understands.  Each variable
+is declared once, along with its type, default value and description,
+and all declared variables are parsed together into an immutable
+:class:`EnvironmentSnapshot`:
+
+>>> from pyfarm.core.environment import declare, snapshot
+>>> RETRIES = declare("PYFARM_EXAMPLE_RETRIES", int, 3, "Number of retries")
+>>> snapshot().PYFARM_EXAMPLE_RETRIES
+3
+
+The snapshot is only rebuilt when :func:`refresh` is called or when a
+new variable is declared so code which runs often can read an attribute
+instead of looking up and parsing :class:`os.environ` each time.  Use
+:func:`pyfarm.core.config.read_env` instead if a value must always
+reflect the current environment.
+"""
+
+import os
+from ast import literal_eval
+from threading import Lock
+
+from pyfarm.core.logger import getLogger
+from pyfarm.core.enums import STRING_TYPES, NUMERIC_TYPES, NOTSET
+from pyfarm.core.config import BOOLEAN_TRUE, BOOLEAN_FALSE, parse_number
+
+logger = getLogger("core.env")
+
+
+def parse_bool(value):
+    """
+    Converts ``value`` to a boolean using :const:`.BOOLEAN_TRUE` and
+    :const:`.BOOLEAN_FALSE`, the same as :func:`.read_env_bool`.
+    """
+    lowered = value.lower()
+    if lowered in BOOLEAN_TRUE:
+        return True
+    elif lowered in BOOLEAN_FALSE:
+        return False
+    raise ValueError("could not convert %r to a boolean" % value)
+
+
+def parse_literal(value):
+    """Evaluates ``value`` using :func:`.parse_number`"""
+    try:
+        return parse_number(value)
+    except SyntaxError as e:
+        raise ValueError(str(e))
+
+
+def parse_int(value):
+    """
+    Converts ``value`` to an integer, the same as :func:`.read_env_int`.
+    Strings are parsed with :func:`.parse_number` so literals such as
+    ``0x10`` are accepted.  Booleans and floats are rejected.
+    """
+    result = value
+    if isinstance(value, STRING_TYPES):
+        result = parse_literal(value)
+
+    if isinstance(result, bool) or not isinstance(result, NUMERIC_TYPES) \
+            or isinstance(result, float):
+        raise ValueError("%r is not an integer" % (value, ))
+    return result
+
+
+def parse_float(value):
+    """
+    Converts ``value`` to a float.  Strings are parsed with
+    :func:`.parse_number` and integers are accepted and converted.
+    """
+    result = value
+    if isinstance(value, STRING_TYPES):
+        result = parse_literal(value)
+
+    if isinstance(result, bool) or not isinstance(result, NUMERIC_TYPES):
+        raise ValueError("%r is not a number" % (value, ))
+    return float(result)
+
+
+def parse_str(value):
+    """Returns ``value`` unchanged"""
+    return value
+
+
+# Parsers used for the built-in types which may be passed to
+# Variable.  Any other callable is called with the raw string.
+PARSERS = {
+    bool: parse_bool,
+    int: parse_int,
+    float: parse_float,
+    str: parse_str,
+    literal_eval: parse_literal}
+
+
+class Declaration(object):
+    """
+    Base class for the declaration of a single named value, such as
+    :class:`Variable` or :class:`pyfarm.core.schema.Field`.
+
+    :param string name:
+        The name of the value
+
+    :param type:
+        A callable which converts the value or, unless ``TYPE_REQUIRED``
+        is set, None to leave the value unconverted
+
+    :param default:
+        The value to use if the value is not provided.  If this is
+        ``NOTSET`` the value is required.
+
+    :param string description:
+        Describes the purpose of the value
+    """
+    TYPE_REQUIRED = False
+
+    def __init__(self, name, type=None, default=None, description=None):
+        if not isinstance(name, STRING_TYPES) or not name:
+            raise TypeError("expected a non-empty string for `name`")
+
+        if not callable(type) and (type is not None or self.TYPE_REQUIRED):
+            raise TypeError("expected a callable for `type`")
+
+        self.name = name
+        self.type = type
+        self.default = default
+        self.description = description
+
+    @property
+    def required(self):
+        """True if there is no default value"""
+        return self.default is NOTSET
+
+
+class Variable(Declaration):
+    """
+    Declaration of a single environment variable.
+
+    :param string name:
+        The name of the environment variable
+
+    :param type:
+        The type of the value.  ``bool``, ``int``, ``float`` and ``str``
+        are parsed the same way :func:`.read_env_bool`,
+        :func:`.read_env_int`, :func:`.read_env_float` and
+        :func:`.read_env` would.  :func:`.literal_eval` may be used for
+        arbitrary Python literals.  Any other callable will be called with
+        the string from the environment and should raise
+        :class:`ValueError` if the string can't be converted.
+
+    :param default:
+        The value to use if the variable is not set.  If this is
+        ``NOTSET`` the variable is required and building a snapshot
+        without it will fail.  The default is not passed through ``type``.
+
+    :param string description:
+        Describes the purpose of the variable
+
+    :param bool secret:
+        If True the value will never be logged or included in the
+        ``repr()`` of a snapshot.
+    """
+    TYPE_REQUIRED = True
+
+    def __init__(self, name, type=str, default=None, description=None,
+                 secret=False):
+        super(Variable, self).__init__(
+            name, type=type, default=default, description=description)
+        self.secret = secret
+        self.parser = PARSERS.get(type, type)
+
+    def parse(self, environ):
+        """
+        Returns the value of this variable from ``environ``
+
+        :raises EnvironmentError:
+            Raised if the variable is required but not in ``environ``
+
+        :raises ValueError:
+            Raised if the value in ``environ`` could not be parsed
+        """
+        try:
+            value = environ[self.name]
+        except KeyError:
+            if self.default is NOTSET:
+                raise EnvironmentError(
+                    "$%s is not in the environment" % self.name)
+            return self.default
+
+        try:
+            return self.parser(value)
+        except (ValueError, TypeError) as e:
+            if self.secret:
+                raise ValueError("$%s could not be parsed" % self.name)
+            raise ValueError("$%s could not be parsed: %s" % (self.name, e))
+
+    def __eq__(self, other):
+        if not isinstance(other, Variable):
+            return NotImplemented
+        return (self.name, self.type, self.default, self.secret) == \
+               (other.name, other.type, other.default, other.secret)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __repr__(self):
+        return "Variable(%r, type=%r, default=%r, secret=%r)" % (
+            self.name, self.type, "..." if self.secret else self.default,
+            self.secret)
+
+
+class ReadOnlyValues(object):
+    """
+    Immutable set of named values which are available both as attributes
+    and by name.  This is the base class of :class:`EnvironmentSnapshot`
+    and :class:`pyfarm.core.schema.ValidatedData`.
+
+    :param dict values:
+        The value of each name
+    """
+    __slots__ = ("_values", )
+    MISSING = "%r is not a known value"
+    READ_ONLY = "values are read-only"
+
+    def __init__(self, values):
+        object.__setattr__(self, "_values", dict(values))
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(self.MISSING % name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(self.READ_ONLY)
+
+    def __delattr__(self, name):
+        raise AttributeError(self.READ_ONLY)
+
+    def __getitem__(self, name):
+        return self._values[name]
+
+    def __contains__(self, name):
+        return name in self._values
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, name, default=None):
+        return self._values.get(name, default)
+
+    def items(self):
+        return list(self._values.items())
+
+
+class EnvironmentSnapshot(ReadOnlyValues):
+    """
+    Immutable set of parsed environment variables.  Values are available
+    both as attributes and by name:
+
+    >>> snapshot = EnvironmentSnapshot({"A": 1})
+    >>> snapshot.A == snapshot["A"] == 1
+    True
+
+    :param dict values:
+        The parsed value of each variable
+
+    :param secrets:
+        The names of variables whose values should not be shown by
+        ``repr()``
+    """
+    __slots__ = ("_secrets", "__weakref__")
+    MISSING = "%r is not a declared environment variable"
+    READ_ONLY = "environment snapshots are read-only"
+
+    def __init__(self, values, secrets=()):
+        super(EnvironmentSnapshot, self).__init__(values)
+        object.__setattr__(self, "_secrets", frozenset(secrets))
+
+    def __repr__(self):
+        shown = []
+        for name in sorted(self._values):
+            if name in self._secrets:
+                shown.append("%s=<secret>" % name)
+            else:
+                shown.append("%s=%r" % (name, self._values[name]))
+        return "EnvironmentSnapshot(%s)" % ", ".join(shown)
+
+
+class EnvironmentRegistry(object):
+    """
+    Stores :class:`Variable` declarations and the most recent
+    :class:`EnvironmentSnapshot` built from them.
+    """
+    def __init__(self):
+        self.variables = {}
+        self._snapshot = None
+        self._lock = Lock()
+
+    def declare(self, name, type=str, default=None, description=None,
+                secret=False):
+        """
+        Declares an environment variable and returns its :class:`Variable`.
+        See :class:`Variable` for a description of the arguments.
+        Declaring the same variable again with the same type, default and
+        secrecy returns the existing declaration.
+
+        :raises ValueError:
+            Raised if ``name`` was already declared differently
+        """
+        variable = Variable(
+            name, type=type, default=default, description=description,
+            secret=secret)
+
+        with self._lock:
+            existing = self.variables.get(name)
+            if existing is not None:
+                if existing != variable:
+                    raise ValueError(
+                        "$%s was already declared as %r" % (name, existing))
+                return existing
+
+            self.variables[name] = variable
+            self._snapshot = None
+
+        return variable
+
+    def parse(self, environ=None):
+        """
+        Parses every declared variable from ``environ``, which defaults to
+        :class:`os.environ`, and returns a new :class:`EnvironmentSnapshot`
+        without storing it.
+
+        :raises EnvironmentError:
+            Raised if a required variable is missing
+
+        :raises ValueError:
+            Raised if one or more variables could not be parsed.  The
+            message includes every variable which failed.
+        """
+        if environ is None:
+            environ = os.environ
+
+        values = {}
+        secrets = []
+        errors = []
+        for name, variable in list(self.variables.items()):
+            if variable.secret:
+                secrets.append(name)
+
+            try:
+                values[name] = variable.parse(environ)
+            except ValueError as e:
+                errors.append(str(e))
+
+        if errors:
+            raise ValueError("; ".join(sorted(errors)))
+
+        snapshot = EnvironmentSnapshot(values, secrets)
+        logger.debug("Parsed %s environment variable(s)", len(values))
+        return snapshot
+
+    def snapshot(self):
+        """
+        Returns the current :class:`EnvironmentSnapshot`, parsing the
+        environment only if there is no snapshot yet.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.refresh()
+        return snapshot
+
+    def refresh(self, environ=None):
+        """
+        Parses the environment again, replaces the current snapshot and
+        returns it.
+        """
+        snapshot = self.parse(environ)
+        self._snapshot = snapshot
+        return snapshot
+
+
+registry = EnvironmentRegistry()
+declare = registry.declare
+snapshot = registry.snapshot
+refresh = registry.refresh
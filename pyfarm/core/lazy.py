@@ -0,0 +1,82 @@
+# No shebang line, this module is meant to be imported
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Lazy Imports
+============
+
+Defers importing a module until one of its attributes is used.  Modules
+in :mod:`pyfarm.core` use this for dependencies which are expensive to
+import but only needed by some code paths, such as :mod:`yaml`:
+
+>>> from pyfarm.core.lazy import LazyModule
+>>> yaml = LazyModule("yaml")
+>>> yaml.safe_load("a: 1")
+{'a': 1}
+
+This module must not import anything from :mod:`pyfarm.core` so any other
+module can use it.
+"""
+
+import sys
+
+
+class LazyModule(object):
+    """
+    Stands in for the module ``name`` which is imported the first time an
+    attribute is requested.  Errors, such as :class:`ImportError`, are
+    raised at that point instead of when :class:`LazyModule` is created.
+    This class has no public attributes of its own so it can't hide any
+    of the module's, use :func:`is_loaded` to check if the module was
+    imported.
+
+    :param string name:
+        The absolute name of the module to import
+    """
+    __slots__ = ("__name", "__module")
+
+    def __init__(self, name):
+        object.__setattr__(self, "_LazyModule__name", name)
+        object.__setattr__(self, "_LazyModule__module", None)
+
+    def __load(self):
+        module = self.__module
+        if module is None:
+            __import__(self.__name)
+            module = sys.modules[self.__name]
+            object.__setattr__(self, "_LazyModule__module", module)
+        return module
+
+    def __getattr__(self, attribute):
+        return getattr(self.__load(), attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(self.__load(), attribute, value)
+
+    def __repr__(self):
+        if self.__module is None:
+            return "<LazyModule %r (not loaded)>" % self.__name
+        return "<LazyModule %r>" % self.__name
+
+
+def is_loaded(module):
+    """
+    Returns True if ``module``, a :class:`LazyModule` or module name, has
+    been imported.
+    """
+    if isinstance(module, LazyModule):
+        module = object.__getattribute__(module, "_LazyModule__name")
+    return module in sys.modules
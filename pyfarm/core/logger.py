@@ -27,6 +27,7 @@ import sys
 import json
 import logging
 import warnings
+import threading
 from logging import Formatter
 
 from pyfarm.core.enums import INTERACTIVE_INTERPRETER
@@ -37,10 +38,8 @@ PY_MAJOR, PY_MINOR = sys.version_info[0:2]
 PY26 = PY_MAJOR, PY_MINOR == (2, 6)
 if (PY_MAJOR, PY_MINOR) >= (2, 7):
     from logging import NullHandler, captureWarnings
-    from logging.config import dictConfig
 else:  # pragma: no cover
     from logutils import NullHandler
-    from logutils.dictconfig import dictConfig
     _warnings_showwarning = None
 
     def _showwarning(message, category, filename, lineno, file=None, line=None):
@@ -86,15 +85,25 @@ else:  # pragma: no cover
                 warnings.showwarning = _warnings_showwarning
                 _warnings_showwarning = None
 
-if not INTERACTIVE_INTERPRETER:
-    try:
-        colorama
-    except NameError:
-        from colorama import init, Fore, Back, Style
-        init()
+NO_STYLE = ("", "")
 
 
-NO_STYLE = ("", "")
+def colorized_formats():
+    """
+    Imports and initializes :mod:`colorama` then returns the styles
+    :class:`ColorFormatter` applies to each log level.  This is deferred
+    until the first formatter is created so processes which never log
+    don't pay for importing :mod:`colorama` or wrapping the standard
+    streams.
+    """
+    from colorama import init, Fore, Style
+    init()
+    return {
+        logging.DEBUG: (Style.DIM, Style.RESET_ALL),
+        logging.WARNING: (Fore.YELLOW, Fore.RESET),
+        logging.ERROR: (Fore.RED, Fore.RESET),
+        logging.CRITICAL: (
+            Fore.RED + Style.BRIGHT, Fore.RESET + Style.RESET_ALL)}
 
 
 class ColorFormatter(Formatter):
@@ -103,12 +112,12 @@ class ColorFormatter(Formatter):
     as we're not running an interactive interpreter or a debugger.
     """
     if not INTERACTIVE_INTERPRETER:
-        FORMATS = {
-            logging.DEBUG: (Style.DIM, Style.RESET_ALL),
-            logging.WARNING: (Fore.YELLOW, Fore.RESET),
-            logging.ERROR: (Fore.RED, Fore.RESET),
-            logging.CRITICAL: (
-                Fore.RED + Style.BRIGHT, Fore.RESET + Style.RESET_ALL)}
+        FORMATS = None
+
+        def __init__(self, *args, **kwargs):
+            Formatter.__init__(self, *args, **kwargs)
+            if ColorFormatter.FORMATS is None:
+                ColorFormatter.FORMATS = colorized_formats()
 
         # Python 2.6 uses old style classes which means we can't use
         # super().  So we construct the proper method at the class level
@@ -150,6 +159,17 @@ class StandardOutputStreamHandler(logging.StreamHandler):
             super(StandardOutputStreamHandler, self).__init__(stream=stream)
 
 
+class DeferredSetupHandler(logging.Handler):
+    """
+    Installed on the ``pf`` logger by :meth:`config.defer`, the first
+    record which reaches this handler runs :meth:`config.setup`.  The
+    record then continues on to the handlers that :meth:`config.setup`
+    installed.
+    """
+    def emit(self, record):
+        config.setup()
+
+
 class config(object):
     """
     Namespace class to store and setup the logging configuration.  You
@@ -157,6 +177,8 @@ class config(object):
     do so under other circumstances if you wish.
     """
     CONFIGURED = False
+    DEFERRED = None
+    LOCK = threading.RLock()
     DEFAULT_CONFIGURATION = {
         "version": 1,
         "root": {
@@ -226,22 +248,72 @@ class config(object):
             If True then rerun :func:`.dictConfig` even if we've already done
             so.
         """
-        if not reconfigure and cls.CONFIGURED:
-            return
+        with cls.LOCK:
+            if not reconfigure and cls.CONFIGURED:
+                return
+
+            configuration = None
+            if cls.DEFERRED is not None:
+                handler, configuration, level, propagate = cls.DEFERRED
+                cls.DEFERRED = None
+                logger = logging.getLogger("pf")
+                logger.removeHandler(handler)
+                logger.setLevel(level)
+                logger.propagate = propagate
+
+            if configuration is None or reconfigure:
+                configuration = cls.get()
+
+            if (PY_MAJOR, PY_MINOR) >= (2, 7):
+                from logging.config import dictConfig
+            else:  # pragma: no cover
+                from logutils.dictconfig import dictConfig
+
+            # Loggers are created before the configuration is applied
+            # so they must not be disabled by it.
+            configuration = dict(configuration)
+            configuration.setdefault("disable_existing_loggers", False)
+            dictConfig(configuration)
+            if capture_warnings:
+                captureWarnings(True)
+
+            cls.CONFIGURED = True
+
+    @classmethod
+    def defer(cls):
+        """
+        Delays :meth:`setup` until the first message is logged to a
+        logger under ``pf``.  Until then a :class:`DeferredSetupHandler` is
+        installed on the ``pf`` logger and the logger's level is set to the
+        level the configuration from :meth:`get` will use.  This avoids
+        importing :mod:`logging.config`, :mod:`colorama` and building
+        handlers in processes which never log anything.
+        """
+        with cls.LOCK:
+            if cls.CONFIGURED or cls.DEFERRED is not None:
+                return
 
-        dictConfig(cls.get())
-        if capture_warnings:
-            captureWarnings(True)
+            configuration = cls.get()
+            loggers = configuration.get("loggers", {})
+            level = loggers.get("pf", {}).get(
+                "level", configuration.get("root", {}).get("level", "WARNING"))
 
-        cls.CONFIGURED = True
+            logger = logging.getLogger("pf")
+            handler = DeferredSetupHandler()
+            cls.DEFERRED = (
+                handler, configuration, logger.level, logger.propagate)
+            logger.addHandler(handler)
+            logger.setLevel(level)
+            logger.propagate = False
 
 
 def getLogger(name):
     """
     Wrapper around the :func:`logging.getLogger` function which
-    ensures the name is setup properly.
+    ensures the name is setup properly.  Logging is configured using
+    :meth:`config.setup` when the first message is logged.
     """
-    config.setup()
+    config.defer()
     if not name.startswith("pf."):
         name = "pf.%s" % name
 
@@ -0,0 +1,241 @@
+# No shebang line, this module is meant to be imported
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Configuration Schemas
+=====================
+
+Declares the keys a :class:`pyfarm.core.config.Configuration` is expected
+to contain along with their types, defaults and allowed values.  Each
+:class:`Field` is compiled into a single conversion function when the
+:class:`Schema` is created.  :meth:`.Configuration.load` runs every
+function once and stores the results in an immutable
+:class:`ValidatedData` so code which reads the configuration often gets
+values which are already converted:
+
+>>> from pyfarm.core.enums import AgentState
+>>> from pyfarm.core.schema import Schema, Field
+>>> config.schema = Schema(
+...     Field("agent_port", int, 50000),
+...     Field("agent_state", choices=AgentState, default="online"))
+>>> config.load()
+>>> config.typed.agent_port
+50000
+
+Errors are collected for every field, and raised together as a
+:class:`SchemaError`, when the configuration is loaded rather than the
+first time a bad value is used.
+"""
+
+from pyfarm.core.enums import STRING_TYPES, NOTSET
+from pyfarm.core.environment import (
+    Declaration, ReadOnlyValues, parse_int, parse_float)
+from pyfarm.core.utility import convert
+
+
+class SchemaError(ValueError):
+    """
+    Raised when a configuration does not match a :class:`Schema`.  The
+    message includes every field which failed, the individual messages
+    are also available as ``errors``.
+    """
+    def __init__(self, errors):
+        super(SchemaError, self).__init__("; ".join(errors))
+        self.errors = errors
+
+
+def to_bool(value):
+    """Converts ``value`` using :meth:`.convert.bool`"""
+    return convert.bool(value)
+
+
+def to_str(value):
+    """Returns ``value`` if it's a string"""
+    if not isinstance(value, STRING_TYPES):
+        raise ValueError("%r is not a string" % (value, ))
+    return value
+
+
+def instance_of(type_):
+    """
+    Returns a function which returns its argument unchanged if it's an
+    instance of ``type_``
+    """
+    def check(value):
+        if not isinstance(value, type_):
+            raise ValueError(
+                "expected %s, got %s" % (type_.__name__, type(value).__name__))
+        return value
+    return check
+
+
+# Converters used for the built-in types which may be passed to
+# Field.  Any other callable is called with the value.  Numbers are
+# converted the same way environment variables are.
+CONVERTERS = {
+    bool: to_bool,
+    int: parse_int,
+    float: parse_float,
+    str: to_str,
+    list: instance_of(list),
+    dict: instance_of(dict)}
+
+
+class Field(Declaration):
+    """
+    Declaration of a single key in a configuration.
+
+    :param string name:
+        The key in the configuration
+
+    :param type:
+        The type of the value.  ``bool``, ``int``, ``float`` and ``str``
+        accept the same strings :meth:`.convert.bool` and
+        :func:`.parse_number` do, ``list`` and ``dict`` must already be
+        the correct type.  Any other callable is called with the value
+        and should raise :class:`ValueError` if it can't be converted.
+        If this is None the value is not converted.
+
+    :param default:
+        The value to use if the key is not in the configuration.  If this
+        is ``NOTSET`` the key is required.  The default is not converted.
+
+    :param choices:
+        The values which are allowed, after conversion.  This may be an
+        enum produced by :func:`.cast_enum`, in which case values from
+        the other side of the enum are also accepted and translated.
+        For example ``"running"`` is stored as ``105`` when ``choices``
+        is :const:`.DBWorkState`.
+
+    :param string description:
+        Describes the purpose of the key
+    """
+    def __init__(self, name, type=None, default=None, choices=None,
+                 description=None):
+        super(Field, self).__init__(
+            name, type=type, default=default, description=description)
+        self.choices = choices
+
+    def compile(self):
+        """
+        Returns a function which converts and checks a single value for
+        this field, raising :class:`ValueError` if the value is invalid.
+        """
+        convert_type = None
+        if self.type is not None:
+            convert_type = CONVERTERS.get(self.type, self.type)
+
+        if self.choices is None:
+            if convert_type is None:
+                return lambda value: value
+            return convert_type
+
+        allowed = frozenset(self.choices)
+        mapping = getattr(self.choices, "_map", {})
+
+        def converter(value):
+            if convert_type is not None:
+                value = convert_type(value)
+
+            if value in allowed:
+                return value
+
+            translated = mapping.get(value, NOTSET)
+            if translated in allowed:
+                return translated
+
+            raise ValueError("%r is not one of %s" % (
+                value, ", ".join(sorted(repr(item) for item in allowed))))
+
+        return converter
+
+    def __repr__(self):
+        return "Field(%r, type=%r, default=%r)" % (
+            self.name, self.type, self.default)
+
+
+class Schema(object):
+    """
+    A set of :class:`Field` declarations which are compiled once, when the
+    schema is created, and used by :meth:`validate`.
+
+    :param fields:
+        The :class:`Field` instances in the schema
+
+    :raises ValueError:
+        Raised if two fields have the same name
+    """
+    def __init__(self, *fields):
+        self.fields = {}
+        self._validators = []
+
+        for field in fields:
+            if field.name in self.fields:
+                raise ValueError("%r was declared twice" % field.name)
+
+            self.fields[field.name] = field
+            self._validators.append(
+                (field.name, field.default, field.compile()))
+
+    def validate(self, mapping):
+        """
+        Converts and checks the value of each field in ``mapping`` and
+        returns a :class:`ValidatedData` of the results.  Keys which are
+        not part of the schema are ignored.
+
+        :raises SchemaError:
+            Raised if a required key is missing or any values are invalid
+        """
+        values = {}
+        errors = []
+        get = mapping.get
+
+        for name, default, converter in self._validators:
+            value = get(name, NOTSET)
+            if value is NOTSET:
+                if default is NOTSET:
+                    errors.append("%r is required" % name)
+                else:
+                    values[name] = default
+                continue
+
+            try:
+                values[name] = converter(value)
+            except (ValueError, TypeError) as e:
+                errors.append("%r is invalid: %s" % (name, e))
+
+        if errors:
+            raise SchemaError(sorted(errors))
+
+        return ValidatedData(values)
+
+
+class ValidatedData(ReadOnlyValues):
+    """
+    Immutable set of values produced by :meth:`Schema.validate`.  Values
+    are available both as attributes and by name.
+
+    :param dict values:
+        The converted value of each field
+    """
+    __slots__ = ()
+    MISSING = "%r is not part of the schema"
+    READ_ONLY = "validated data is read-only"
+
+    def __repr__(self):
+        return "ValidatedData(%s)" % ", ".join(
+            "%s=%r" % (name, self._values[name])
+            for name in sorted(self._values))
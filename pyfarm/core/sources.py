@@ -0,0 +1,240 @@
+# No shebang line, this module is meant to be imported
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Configuration Sources
+=====================
+
+Sources supply configuration data from somewhere other than the files
+:meth:`pyfarm.core.config.Configuration.files` finds.  Sources added to a
+configuration are loaded after its files, in the order they were added,
+so their values take precedence:
+
+>>> from pyfarm.core.sources import HTTPSource
+>>> config.sources.append(HTTPSource("http://config/agent.json"))
+>>> config.load()
+
+:class:`HTTPSource` keeps the last response it received under
+``Configuration.tempdir`` and revalidates it using ``ETag`` and
+``Last-Modified`` so an unchanged configuration costs one small request.
+If the server can't be reached the last response is used instead.
+
+Responses are parsed with :const:`SOURCE_LOADERS` rather than the loaders
+used for local files.  Anyone who can answer the request controls the
+data so yaml is parsed with :func:`yaml.safe_load` and tags such as
+``!!python/object`` are refused.
+"""
+
+import socket
+from copy import deepcopy
+from io import BytesIO
+from hashlib import sha1
+from os.path import join, splitext
+
+try:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError, URLError
+    from urllib.parse import urlparse
+    from http.client import HTTPException
+except ImportError:  # pragma: no cover
+    from urllib2 import Request, urlopen, HTTPError, URLError
+    from urlparse import urlparse
+    from httplib import HTTPException
+
+from pyfarm.core.enums import NOTSET
+from pyfarm.core.lazy import LazyModule
+from pyfarm.core.logger import getLogger
+from pyfarm.core.config import (
+    FileLoader, FileLoadError, load_json, load_toml, read_pickle_cache,
+    write_pickle_cache)
+
+yaml = LazyModule("yaml")
+
+logger = getLogger("core.sources")
+
+
+def safe_load_yaml(stream):
+    """
+    Parses yaml from ``stream`` using libyaml's :class:`yaml.CSafeLoader`
+    if :mod:`yaml` was built with it and :class:`yaml.SafeLoader`
+    otherwise.  Neither constructs arbitrary Python objects.
+    """
+    loader = getattr(yaml, "CSafeLoader", None) or yaml.SafeLoader
+    try:
+        return yaml.load(stream, Loader=loader)
+    except yaml.YAMLError as e:
+        raise FileLoadError(str(e))
+
+
+# Functions which parse responses, keyed by extension.  This is separate
+# from pyfarm.core.config.LOADERS so a loader registered for local files
+# is never used for data from the network.
+SOURCE_LOADERS = {
+    ".yml": FileLoader("yaml", safe_load_yaml),
+    ".yaml": FileLoader("yaml", safe_load_yaml),
+    ".json": FileLoader("json", load_json),
+    ".toml": FileLoader("toml", load_toml)}
+
+# Extensions of the loaders in SOURCE_LOADERS used for common content
+# types
+CONTENT_TYPES = {
+    "application/json": ".json",
+    "application/yaml": ".yml",
+    "application/x-yaml": ".yml",
+    "text/yaml": ".yml",
+    "text/x-yaml": ".yml",
+    "application/toml": ".toml"}
+
+
+class Source(object):
+    """
+    Base class for configuration sources.  Subclasses must implement
+    :meth:`fetch` and set ``name``, which is used in log messages and
+    by :meth:`.Configuration.provenance`.
+
+    :var version:
+        A value which changes whenever the data returned by :meth:`fetch`
+        changes, or None if nothing has been fetched.
+
+    :var data:
+        The data most recently returned by :meth:`fetch`
+    """
+    name = None
+    version = None
+    data = None
+
+    def fetch(self, tempdir):
+        """
+        Returns the data from this source as a dictionary or None if no
+        data is available.
+
+        :param string tempdir:
+            A directory the source may store a cache in, this is
+            ``Configuration.tempdir``
+        """
+        raise NotImplementedError
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.name)
+
+
+class HTTPSource(Source):
+    """
+    Fetches configuration data from ``url``.  The response is parsed
+    using the loader for its ``Content-Type`` or, failing that, the
+    extension of the path in ``url``.  Responses which are neither are
+    parsed as json.  A response which is not a mapping is treated the
+    same as one which could not be parsed.
+
+    :param string url:
+        The url to request
+
+    :param float timeout:
+        The number of seconds to wait for the server
+
+    :param dict headers:
+        Additional headers to send with each request
+    """
+    def __init__(self, url, timeout=5.0, headers=None):
+        self.url = url
+        self.name = url
+        self.timeout = timeout
+        self.headers = headers or {}
+        self._cached = NOTSET
+
+    def cache_path(self, tempdir):
+        """Returns the path the last response is stored at"""
+        digest = sha1(self.url.encode("utf-8")).hexdigest()
+        return join(tempdir, "sources", digest + ".pickle")
+
+    def loader(self, content_type):
+        """Returns the :class:`.FileLoader` for a response"""
+        content_type = (content_type or "").split(";")[0].strip().lower()
+        extension = CONTENT_TYPES.get(content_type)
+        if extension is None:
+            extension = splitext(urlparse(self.url).path)[1].lower()
+        return SOURCE_LOADERS.get(extension) or SOURCE_LOADERS[".json"]
+
+    def fetch(self, tempdir):
+        """
+        Requests the data from ``url``.  If a previous response was
+        cached under ``tempdir`` it is revalidated rather than downloaded
+        again and is returned if the server can't be reached.
+        """
+        if self._cached is NOTSET:
+            self._cached = read_pickle_cache(self.cache_path(tempdir))
+
+        cached = self._cached
+        request = Request(self.url, headers=self.headers)
+        if cached is not NOTSET:
+            if cached["etag"] is not None:
+                request.add_header("If-None-Match", cached["etag"])
+            if cached["last_modified"] is not None:
+                request.add_header(
+                    "If-Modified-Since", cached["last_modified"])
+
+        try:
+            try:
+                response = urlopen(request, timeout=self.timeout)
+            except HTTPError as e:
+                if e.code != 304 or cached is NOTSET:
+                    raise
+                logger.debug("%s is unchanged", self.url)
+                return self._use(cached)
+
+            try:
+                body = response.read()
+                headers = response.info()
+            finally:
+                response.close()
+
+            loader = self.loader(headers.get("Content-Type"))
+            data = loader.function(BytesIO(body))
+            if not isinstance(data, dict):
+                raise FileLoadError(
+                    "expected a mapping, got %s" % type(data).__name__)
+
+        except (URLError, HTTPException, socket.error, socket.timeout,
+                FileLoadError, ValueError) as e:
+            if cached is NOTSET:
+                logger.error(
+                    "Failed to fetch %s and no previous response is "
+                    "cached: %s", self.url, e)
+                return None
+
+            logger.warning(
+                "Failed to fetch %s, using the last response: %s",
+                self.url, e)
+            return self._use(cached)
+
+        cached = {
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "version": headers.get("ETag") or sha1(body).hexdigest(),
+            "data": data}
+        write_pickle_cache(self.cache_path(tempdir), cached)
+        self._cached = cached
+        logger.info(
+            "Fetched %s using the %s loader", self.url, loader.name)
+        return self._use(cached)
+
+    def _use(self, cached):
+        # The cached response is reused by the next fetch() so callers
+        # get a copy they're free to modify.
+        self.version = cached["version"]
+        self.data = deepcopy(cached["data"])
+        return self.data
+
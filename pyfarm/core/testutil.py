@@ -59,6 +59,18 @@ def rm(path):
         pass
 
 
+def restore_times(path, stat):
+    """
+    Sets the access and modification times of ``path`` to those in
+    ``stat``, with nanosecond precision where the platform supports it,
+    so the file appears unchanged to anything which compares them.
+    """
+    if hasattr(stat, "st_mtime_ns"):
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    else:  # pragma: no cover
+        os.utime(path, (stat.st_atime, stat.st_mtime))
+
+
 class TestCase(unittest.TestCase):
     TEMPDIR_PREFIX = ""
     ORIGINAL_ENVIRONMENT = {}
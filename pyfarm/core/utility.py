@@ -24,16 +24,16 @@ of PyFarm.
 
 from __future__ import division
 
+import os
 import json
-from functools import partial
-from ast import literal_eval
 
 try:
     from UserDict import UserDict
 except ImportError:  # pragma: no cover
     from collections import UserDict
 
-from pyfarm.core.config import read_env_bool
+from pyfarm.core.config import parse_number, parse_numbers
+from pyfarm.core.environment import declare, snapshot
 from pyfarm.core.enums import (
     NUMERIC_TYPES, STRING_TYPES, PY2, PY3,
     BOOLEAN_TRUE, BOOLEAN_FALSE, NONE, Values)
@@ -102,10 +102,35 @@ class PyFarmJSONEncoder(json.JSONEncoder):
 
         return super(PyFarmJSONEncoder, self).encode(o)
 
-dumps = partial(
-    json.dumps,
-    indent=4 if read_env_bool("PYFARM_PRETTY_JSON", False) else None,
-    cls=PyFarmJSONEncoder)
+PRETTY_JSON = declare(
+    "PYFARM_PRETTY_JSON", bool, False,
+    "If true, indent the json produced by pyfarm.core.utility.dumps")
+
+
+def pretty_json():
+    """
+    Returns the value of :envvar:`PYFARM_PRETTY_JSON`.  The current
+    snapshot is used when it can be built.  Otherwise only this variable
+    is parsed, and an invalid value is treated as the default, so a
+    problem with an unrelated variable never breaks :func:`dumps`.
+    """
+    try:
+        return snapshot().PYFARM_PRETTY_JSON
+    except (ValueError, EnvironmentError):
+        try:
+            return PRETTY_JSON.parse(os.environ)
+        except ValueError:
+            return PRETTY_JSON.default
+
+
+def dumps(obj, **kwargs):
+    """
+    Wrapper around :func:`json.dumps` which uses :class:`PyFarmJSONEncoder`
+    and indents the output if :envvar:`PYFARM_PRETTY_JSON` is true.
+    """
+    kwargs.setdefault("cls", PyFarmJSONEncoder)
+    kwargs.setdefault("indent", 4 if pretty_json() else None)
+    return json.dumps(obj, **kwargs)
 
 
 class convert(object):
@@ -149,7 +174,7 @@ class convert(object):
 
         :raises ValueError:
             Raised if ``value`` could not be converted using
-            :func:`.literval_eval`
+            :func:`.parse_number`
 
         :raises TypeError:
             Raised if ``value`` was not converted to a float, integer, or long
@@ -162,14 +187,40 @@ class convert(object):
         if not isinstance(value, STRING_TYPES):
             raise TypeError("`value` must be a string")
 
-        value = literal_eval(value)
+        value = parse_number(value)
 
-        # ensure we got a number out of literal_eval
+        # ensure we got a number out of parse_number
         if not isinstance(value, types):
             raise ValueError("`value` did not convert to a number")
 
         return value
 
+    @staticmethod
+    def ston_many(values, types=NUMERIC_TYPES):
+        """
+        Converts each string in ``values`` to a number and returns a list
+        of the results.  This produces the same result as calling
+        :meth:`ston` on each value but columns of strings are parsed in
+        bulk using :func:`.parse_numbers`.
+
+        :raises ValueError:
+            Raised if any value could not be converted to a number
+
+        :raises TypeError:
+            Raised if any value was not a string or number
+        """
+        values = list(values)
+        for value in values:
+            if not isinstance(value, STRING_TYPES):
+                return [convert.ston(value, types=types) for value in values]
+
+        results = parse_numbers(values)
+        for value in results:
+            if not isinstance(value, types):
+                raise ValueError("`value` did not convert to a number")
+
+        return results
+
     @staticmethod
     def bool(value):
         """
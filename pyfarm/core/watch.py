@@ -0,0 +1,560 @@
+# No shebang line, this module is meant to be imported
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Configuration Watcher
+=====================
+
+Watches the files used by a :class:`pyfarm.core.config.Configuration`
+instance and incrementally reloads the configuration when they change.
+On Linux changes are detected using inotify, on other platforms or when
+inotify is unavailable the files are polled for changes instead.  Only
+files which have changed are parsed again.
+"""
+
+import os
+import select
+import struct
+import threading
+from collections import namedtuple
+from copy import deepcopy
+from errno import EINTR
+from os.path import dirname, isdir
+
+from pyfarm.core.enums import LINUX, NOTSET
+from pyfarm.core.config import FileLoadError, apply_environment
+from pyfarm.core.logger import getLogger
+
+logger = getLogger("core.watch")
+
+ConfigurationDiff = namedtuple(
+    "ConfigurationDiff", ("added", "removed", "changed", "environment"))
+
+
+def diff_mappings(old, new):
+    """
+    Compares two dictionaries and returns a tuple of three dictionaries
+    containing the keys which were added (mapped to their new value), the
+    keys which were removed (mapped to their old value) and the keys which
+    were changed (mapped to a tuple of the old and new values).
+    """
+    added = {}
+    removed = {}
+    changed = {}
+
+    for key, value in new.items():
+        if key not in old:
+            added[key] = value
+        elif old[key] != value:
+            changed[key] = (old[key], value)
+
+    for key, value in old.items():
+        if key not in new:
+            removed[key] = value
+
+    return added, removed, changed
+
+
+class PollingBackend(object):
+    """
+    Change detection backend which reports a possible change every
+    time :meth:`wait` is called.  :class:`ConfigurationWatcher` will then
+    compare the size and modification time of each file to determine what,
+    if anything, has changed.
+    """
+    name = "polling"
+
+    def __init__(self):
+        self._interrupted = threading.Event()
+
+    def update(self, directories):
+        """Polling does not need to track directories, always returns False"""
+        return False
+
+    def wait(self, timeout):
+        """
+        Blocks for ``timeout`` seconds, or until :meth:`interrupt` is
+        called, then returns True.
+        """
+        self._interrupted.wait(timeout)
+        return not self._interrupted.is_set()
+
+    def interrupt(self):
+        """Wakes up, and stops, anything blocked in :meth:`wait`"""
+        self._interrupted.set()
+
+    def close(self):
+        self.interrupt()
+
+
+class InotifyBackend(object):
+    """
+    Change detection backend which uses Linux's inotify, through
+    :mod:`ctypes`, to block until something changes in one of the
+    watched directories.  Directories are watched instead of files so
+    files which are created, or replaced by renaming a new file over them,
+    are noticed too.
+    """
+    name = "inotify"
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_IGNORED = 0x00008000
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0o2000000)
+    MASK = (
+        IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+        IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+    EVENT = struct.Struct("iIII")
+    _libc = None
+
+    def __init__(self):
+        libc = self.libc()
+        if libc is None:
+            raise OSError("inotify is not available")
+
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:  # pragma: no cover
+            raise OSError("inotify_init1() failed")
+
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        self._watches = {}
+        self._interrupted = False
+        self._closed = False
+
+    @classmethod
+    def libc(cls):
+        """
+        Returns the C library if it provides inotify or None if it does not.
+        """
+        if cls._libc is None:
+            cls._libc = False
+            if LINUX:
+                try:
+                    import ctypes
+                    from ctypes.util import find_library
+                    libc = ctypes.CDLL(
+                        find_library("c") or "libc.so.6", use_errno=True)
+                    libc.inotify_init1
+                except (ImportError, OSError, AttributeError):  # pragma: no cover
+                    pass
+                else:
+                    libc.inotify_add_watch.argtypes = [
+                        ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+                    libc.inotify_rm_watch.argtypes = [
+                        ctypes.c_int, ctypes.c_int]
+                    cls._libc = libc
+
+        return cls._libc or None
+
+    @classmethod
+    def available(cls):
+        """Returns True if inotify can be used on this system"""
+        return cls.libc() is not None
+
+    def update(self, directories):
+        """
+        Starts watching any directory in ``directories`` which is not
+        already being watched and stops watching any which are not in
+        ``directories``.  Returns True if a new watch was added.
+        """
+        libc = self.libc()
+        directories = set(directories)
+        added = False
+
+        for directory, descriptor in list(self._watches.items()):
+            if directory not in directories:
+                libc.inotify_rm_watch(self.fd, descriptor)
+                del self._watches[directory]
+
+        for directory in directories:
+            if directory in self._watches:
+                continue
+
+            path = directory
+            if not isinstance(path, bytes):
+                path = path.encode("utf-8")
+
+            descriptor = libc.inotify_add_watch(self.fd, path, self.MASK)
+            if descriptor >= 0:
+                self._watches[directory] = descriptor
+                added = True
+
+        return added
+
+    def wait(self, timeout):
+        """
+        Blocks for up to ``timeout`` seconds waiting for an event in any
+        of the watched directories.  Returns True if an event was received.
+        """
+        if self._interrupted:
+            return False
+
+        try:
+            readable, _, _ = select.select(
+                [self.fd, self._wakeup_read], [], [], timeout)
+        except (OSError, select.error) as e:  # pragma: no cover
+            if e.args[0] == EINTR:
+                return False
+            raise
+
+        if self._interrupted or self.fd not in readable:
+            return False
+
+        self._drain()
+        return True
+
+    def _drain(self):
+        removed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError:
+                break
+
+            if not data:  # pragma: no cover
+                break
+
+            offset = 0
+            while offset < len(data):
+                descriptor, mask, _, length = self.EVENT.unpack_from(
+                    data, offset)
+                offset += self.EVENT.size + length
+                if mask & self.IN_IGNORED:
+                    removed.add(descriptor)
+
+        # The kernel has already removed these watches, generally
+        # because the directory itself was deleted.
+        if removed:
+            for directory, descriptor in list(self._watches.items()):
+                if descriptor in removed:
+                    del self._watches[directory]
+
+    def interrupt(self):
+        """Wakes up, and stops, anything blocked in :meth:`wait`"""
+        if not self._interrupted:
+            self._interrupted = True
+            os.write(self._wakeup_write, b"x")
+
+    def close(self):
+        """
+        Releases the inotify instance.  This should only be called once
+        nothing is blocked in :meth:`wait`.
+        """
+        if self._closed:
+            return
+
+        self.interrupt()
+        self._closed = True
+        os.close(self.fd)
+        os.close(self._wakeup_read)
+        os.close(self._wakeup_write)
+
+
+class ConfigurationWatcher(object):
+    """
+    Watches the files which :meth:`Configuration.files` could return and
+    updates ``config`` when they change.  When a change is detected the
+    files which changed are parsed again and the data from all files
+    is merged again in the same order :meth:`Configuration.load` uses.
+    The configuration is then updated with only the keys which changed and
+    subscribers are called with a :class:`ConfigurationDiff`.
+
+    Each time the merged data changes a new dictionary is published to
+    :attr:`data` with a single assignment so threads which need a
+    consistent view of the merged data can read :attr:`data` without
+    any locking.
+
+    :param config:
+        The :class:`pyfarm.core.config.Configuration` instance to watch
+        and update.
+
+    :param dict environment:
+        If provided, changes to the ``env`` key in the configuration
+        files will be applied to this dictionary.  This should match the
+        ``environment`` argument which was provided to
+        :meth:`Configuration.load`.
+
+    :param float interval:
+        How often, in seconds, to poll for changes.  When inotify is used
+        this is instead how often the watcher checks for new directories
+        which should be watched.
+
+    :param backend:
+        The change detection backend to use.  By default
+        :class:`InotifyBackend` is used if it's available otherwise
+        :class:`PollingBackend` is used.
+    """
+    def __init__(self, config, environment=None, interval=1.0, backend=None):
+        self.config = config
+        self.environment = environment
+        self.interval = interval
+        self.subscribers = []
+        self.thread = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        if backend is None:
+            backend = InotifyBackend if InotifyBackend.available() \
+                else PollingBackend
+
+        self.backend = backend() if isinstance(backend, type) else backend
+
+        # Build the initial state from what the configuration
+        # has already loaded.  Anything which has not been loaded
+        # yet will be reported as a change by the first check().
+        self._signatures = {}
+        parsed = []
+        for filepath in config.loaded:
+            cached = config._parsed_files.get(filepath)
+            if cached is not None:
+                self._signatures[filepath] = cached[0]
+                parsed.append((filepath, cached[1]))
+
+        for source in config.sources:
+            if source.name in config.loaded and source.data is not None:
+                self._signatures[source.name] = source.version
+                parsed.append((source.name, source.data))
+
+        layers, _ = config._merge(parsed, environment is not None)
+        self.data = layers.flatten()
+
+    def subscribe(self, callback):
+        """
+        Adds ``callback`` to the list of functions which will be called
+        with the configuration and a :class:`ConfigurationDiff` when
+        the configuration changes.
+        """
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """Removes a callback previously added with :meth:`subscribe`"""
+        self.subscribers.remove(callback)
+
+    def directories(self):
+        """Returns the existing directories which should be watched"""
+        directories = set()
+        for directory in self.config.directories(validate=False):
+            fragment_directory = self.config.fragment_directory(directory)
+            if isdir(fragment_directory):
+                directories.add(fragment_directory)
+
+        for filepath in self.config.files(validate=False):
+            directory = dirname(filepath)
+            if directory not in directories and isdir(directory):
+                directories.add(directory)
+        return directories
+
+    def check(self):
+        """
+        Checks the configuration files for changes and reloads any that
+        have changed.  Returns a :class:`ConfigurationDiff` if the
+        configuration changed or None if it did not.
+        """
+        with self._lock:
+            return self._check()
+
+    def _check(self):
+        config = self.config
+
+        # Fragments may have been added or removed since the fragment
+        # directories were last listed.
+        for directory in config.directories(validate=False):
+            config.discovery_index.invalidate(
+                config.fragment_directory(directory))
+
+        candidates = config.files(validate=False)
+        signatures = {}
+
+        for filepath in candidates:
+            try:
+                signatures[filepath] = config._file_signature(filepath)
+            except (OSError, IOError):
+                continue
+
+        # Sources are fetched on every check, their version stands in for
+        # the signature of a file.
+        fetched = []
+        for source in config.sources:
+            data = source.fetch(config.tempdir)
+            if data is not None:
+                signatures[source.name] = source.version
+                fetched.append((source.name, data))
+
+        # A file parsed within the resolution of its modification time
+        # could change again without changing its signature, so it's
+        # parsed on every check until its signature is settled.
+        parsed_files = config._parsed_files
+        settled = all(
+            parsed_files[filepath][2] for filepath in signatures
+            if filepath in parsed_files)
+
+        if settled and signatures == self._signatures:
+            return None
+
+        parsed = []
+        for filepath in candidates:
+            if filepath not in signatures:
+                continue
+
+            # Files which have not changed are not parsed again
+            data = NOTSET
+            if self._signatures.get(filepath) == signatures[filepath]:
+                data = config._cached_file(filepath, signatures[filepath])
+            if data is not NOTSET:
+                parsed.append((filepath, data))
+                continue
+
+            try:
+                data, _ = config._read_file(filepath, signatures[filepath])
+
+            except (FileLoadError, OSError, IOError) as e:
+                # The file may be in the middle of being written so keep
+                # using the last data we successfully loaded, if any.
+                logger.error("Failed to reload %r: %s", filepath, e)
+                cached = config._parsed_files.get(filepath)
+                if cached is None:
+                    continue
+                data = deepcopy(cached[1])
+                signatures[filepath] = cached[0]
+
+            parsed.append((filepath, data))
+
+        parsed.extend(fetched)
+        self._signatures = signatures
+        layers, environment = config._merge(
+            parsed, self.environment is not None)
+        data = layers.flatten()
+        added, removed, changed = diff_mappings(self.data, data)
+        environment_changes = {}
+
+        # The same as Configuration.load(), only keys which differ from
+        # the environment are set.
+        if self.environment is not None:
+            changes = apply_environment(self.environment, environment)
+            environment_changes.update(changes.added)
+            for key, (_, value) in changes.changed.items():
+                environment_changes[key] = value
+
+            if environment_changes:
+                logger.debug(
+                    "Environment: %s added, %s changed, %s unchanged",
+                    len(changes.added), len(changes.changed),
+                    len(changes.unchanged))
+            config.applied_environment = environment
+
+        config.loaded = tuple(filepath for filepath, _ in parsed)
+        config.layers = layers
+        self.data = data
+
+        if not (added or removed or changed or environment_changes):
+            return None
+
+        # Applied as a single change so readers of a copy-on-write
+        # configuration never see a partially reloaded generation.
+        config.apply_changes(
+            dict((key, data[key]) for key in list(added) + list(changed)),
+            removed)
+
+        if environment_changes:
+            config.clear_expansion_cache()
+
+        if config.schema is not None:
+            try:
+                config.validate()
+            except ValueError as e:
+                logger.error(
+                    "Reloaded configuration does not match the schema, "
+                    "`typed` was not updated: %s", e)
+
+        diff = ConfigurationDiff(added, removed, changed, environment_changes)
+        logger.info(
+            "Reloaded configuration: %s added, %s removed, %s changed",
+            len(added), len(removed), len(changed))
+
+        for callback in list(self.subscribers):
+            try:
+                callback(config, diff)
+            except Exception as e:  # pragma: no cover
+                logger.exception("Subscriber %r failed: %s", callback, e)
+
+        return diff
+
+    def run(self):
+        """
+        Watches for changes until :meth:`stop` is called.  This is the
+        target of the thread created by :meth:`start`.
+        """
+        # Catch anything which changed before we started watching
+        self.check()
+
+        while not self._stopped.is_set():
+            try:
+                changed = self.backend.wait(self.interval)
+
+                if self._stopped.is_set():
+                    break
+
+                # Watch any directories which have been created, we
+                # should also check for changes if we find any.
+                if self.backend.update(self.directories()):
+                    changed = True
+
+                # Remote sources can't notify us so they're polled
+                if changed or self.config.sources:
+                    self.check()
+
+            except Exception as e:  # pragma: no cover
+                logger.exception("Failed to check for changes: %s", e)
+                self._stopped.wait(self.interval)
+
+    def start(self):
+        """Starts watching for changes in a daemon thread"""
+        if self.thread is not None:
+            raise RuntimeError("watcher has already been started")
+
+        # Watch the directories before returning so changes
+        # made right after start() returns are not missed.
+        self.backend.update(self.directories())
+
+        self.thread = threading.Thread(
+            target=self.run, name="ConfigurationWatcher(%s)" % self.config.name)
+        self.thread.daemon = True
+        self.thread.start()
+        logger.debug("Watching configuration using %s", self.backend.name)
+
+    def stop(self, timeout=None):
+        """
+        Stops the thread created by :meth:`start` and releases any
+        resources held by the backend.
+        """
+        self._stopped.set()
+        self.backend.interrupt()
+
+        if self.thread is not None:
+            self.thread.join(timeout)
+            if self.thread.is_alive():  # pragma: no cover
+                return
+            self.thread = None
+
+        self.backend.close()
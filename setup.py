@@ -41,6 +41,9 @@ setup(
               "pyfarm.core"],
     namespace_packages=["pyfarm"],
     install_requires=install_requires,
+    entry_points={
+        "console_scripts": [
+            "pyfarm-config-bundle = pyfarm.core.bundle:main"]},
     url="https://github.com/pyfarm/pyfarm-core",
     license="Apache v2.0",
     author="Oliver Palmer",
@@ -0,0 +1,333 @@
+# No shebang line, this module is meant to be imported
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import with_statement
+
+import os
+import sys
+import subprocess
+from os.path import join, dirname
+
+from pyfarm.core.enums import PY26, POSIX
+from pyfarm.core.testutil import TestCase
+from pyfarm.core.config import Configuration
+from pyfarm.core.bundle import (
+    Bundle, BundleError, SharedBundle, HEADER, write_bundle, main)
+
+if PY26:
+    from unittest2 import skipUnless
+else:
+    from unittest import skipUnless
+
+# Giving a file to another user requires root
+requires_root = skipUnless(
+    POSIX and os.getuid() == 0, "changing a file's owner requires root")
+
+
+class TestBundle(TestCase):
+    def test_roundtrip(self):
+        source = join(self.tempdir, "source.yml")
+        with open(source, "w") as stream:
+            stream.write("a: 1")
+
+        path = join(self.tempdir, "test.bundle")
+        write_bundle(
+            path, {"a": 1, "b": [1, 2], "c": {"d": None}},
+            sources=[source], environment={"e": "f"}, name="test")
+        bundle = Bundle(path)
+        self.addCleanup(bundle.close)
+        self.assertEqual(dict(bundle), {"a": 1, "b": [1, 2], "c": {"d": None}})
+        self.assertEqual(bundle.environment, {"e": "f"})
+        self.assertEqual(bundle.sources, (source, ))
+        self.assertEqual(bundle.metadata["name"], "test")
+        self.assertIn("a", bundle)
+        self.assertNotIn("z", bundle)
+        self.assertEqual(len(bundle), 3)
+
+    @skipUnless(POSIX, "symlinks and posix permissions are required")
+    def test_temp_file(self):
+        path = join(self.tempdir, "test.bundle")
+        target = join(self.tempdir, "target")
+        with open(target, "w") as stream:
+            stream.write("unchanged")
+
+        # A symlink at the temporary path used previously must not be
+        # written through
+        planted = "%s.%s.tmp" % (path, os.getpid())
+        os.symlink(target, planted)
+
+        write_bundle(path, {"a": 1})
+        bundle = Bundle(path)
+        self.addCleanup(bundle.close)
+        self.assertEqual(dict(bundle), {"a": 1})
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        with open(target) as stream:
+            self.assertEqual(stream.read(), "unchanged")
+        self.assertEqual(
+            sorted(os.listdir(self.tempdir)),
+            sorted(["test.bundle", "target", os.path.basename(planted)]))
+
+    def test_not_a_bundle(self):
+        path = join(self.tempdir, "test.bundle")
+        with open(path, "wb") as stream:
+            stream.write(b"foobar" * 10)
+
+        with self.assertRaises(BundleError):
+            Bundle(path)
+
+        with open(path, "wb") as stream:
+            stream.write(b"PF")
+
+        with self.assertRaises(BundleError):
+            Bundle(path)
+
+    def test_truncated(self):
+        path = join(self.tempdir, "test.bundle")
+        write_bundle(path, {"a": 1})
+        with open(path, "rb") as stream:
+            data = stream.read()
+
+        with open(path, "wb") as stream:
+            stream.write(data[:HEADER.size + 5])
+        with self.assertRaises(BundleError):
+            Bundle(path)
+
+        # Damage the value but not the metadata
+        with open(path, "wb") as stream:
+            stream.write(data[:-3])
+        bundle = Bundle(path)
+        self.addCleanup(bundle.close)
+        with self.assertRaises(BundleError):
+            bundle["a"]
+        with self.assertRaises(KeyError):
+            bundle["b"]
+
+    @requires_root
+    def test_not_owned(self):
+        path = join(self.tempdir, "test.bundle")
+        write_bundle(path, {"a": 1})
+        os.chown(path, 65534, -1)
+        with self.assertRaises(BundleError):
+            Bundle(path)
+
+    def test_stale(self):
+        source = join(self.tempdir, "source.yml")
+        missing = join(self.tempdir, "missing.yml")
+        with open(source, "w") as stream:
+            stream.write("a: 1")
+
+        path = join(self.tempdir, "test.bundle")
+        write_bundle(path, {"a": 1}, sources=[source], missing=[missing])
+        bundle = Bundle(path)
+        self.addCleanup(bundle.close)
+        self.assertFalse(bundle.stale())
+
+        # Touching the file without changing it is fine
+        os.utime(source, (0, 0))
+        self.assertFalse(bundle.stale())
+
+        with open(source, "w") as stream:
+            stream.write("a: 2")
+        self.assertTrue(bundle.stale())
+
+        write_bundle(path, {"a": 2}, sources=[source], missing=[missing])
+        bundle = Bundle(path)
+        self.addCleanup(bundle.close)
+        self.assertFalse(bundle.stale())
+        with open(missing, "w") as stream:
+            stream.write("a: 3")
+        self.assertTrue(bundle.stale())
+
+
+class TestConfigurationBundle(TestCase):
+    def setUp(self):
+        super(TestConfigurationBundle, self).setUp()
+        self.config = Configuration("agent", "1.2.3")
+        self.config.system_root = self.tempdir
+        self.source = join(self.tempdir, self.config.child_dir, "agent.yml")
+        os.makedirs(dirname(self.source))
+        with open(self.source, "w") as stream:
+            stream.write("a: 1\nb: $c/x\nenv:\n  c: foo\n")
+        self.path = join(self.tempdir, "agent.bundle")
+
+    def test_build_and_load(self):
+        self.assertEqual(self.config.build_bundle(self.path), self.path)
+
+        config = Configuration("agent", "1.2.3")
+        config.system_root = self.tempdir
+        environment = {}
+        self.assertTrue(config.load_bundle(self.path, environment))
+        self.assertEqual(dict(config), {"a": 1, "b": "foo/x"})
+        self.assertEqual(environment, {"c": "foo"})
+        self.assertEqual(config.loaded, (self.path, ))
+        self.assertEqual(config.provenance("a"), self.path)
+
+    def test_build_without_expansion(self):
+        self.config.build_bundle(self.path, expand=False)
+        config = Configuration("agent", "1.2.3")
+        self.assertTrue(config.load_bundle(self.path, verify=False))
+        self.assertEqual(dict(config), {"a": 1, "b": "$c/x"})
+
+    def test_load_stale(self):
+        self.config.build_bundle(self.path)
+        with open(self.source, "w") as stream:
+            stream.write("a: 2")
+
+        config = Configuration("agent", "1.2.3")
+        self.assertFalse(config.load_bundle(self.path))
+        self.assertEqual(dict(config), {})
+        self.assertTrue(config.load_bundle(self.path, verify=False))
+
+    def test_load_fragment_added(self):
+        self.config.build_bundle(self.path)
+        fragments = join(self.tempdir, self.config.child_dir, "agent.d")
+        os.makedirs(fragments)
+        with open(join(fragments, "10.yml"), "w") as stream:
+            stream.write("a: 2")
+
+        config = Configuration("agent", "1.2.3")
+        config.system_root = self.tempdir
+        self.assertFalse(config.load_bundle(self.path))
+        config.discovery_index.invalidate()
+        config.load()
+        self.assertEqual(config["a"], 2)
+
+    def test_load_fragment_changes(self):
+        fragments = join(self.tempdir, self.config.child_dir, "agent.d")
+        os.makedirs(fragments)
+        with open(join(fragments, "10.yml"), "w") as stream:
+            stream.write("a: 2")
+        self.config.build_bundle(self.path)
+
+        # Files which would not be loaded as fragments are ignored
+        with open(join(fragments, ".20.yml"), "w") as stream:
+            stream.write("a: 3")
+        with open(join(fragments, "20.yml.orig"), "w") as stream:
+            stream.write("a: 3")
+        config = Configuration("agent", "1.2.3")
+        self.assertTrue(config.load_bundle(self.path))
+        self.assertEqual(config["a"], 2)
+
+        with open(join(fragments, "20.yml"), "w") as stream:
+            stream.write("a: 3")
+        self.assertFalse(config.load_bundle(self.path))
+
+    def test_load_missing(self):
+        config = Configuration("agent", "1.2.3")
+        self.assertFalse(config.load_bundle(join(self.tempdir, "missing")))
+
+    def test_load_damaged(self):
+        self.config.build_bundle(self.path)
+        with open(self.path, "rb") as stream:
+            data = stream.read()
+        with open(self.path, "wb") as stream:
+            stream.write(data[:HEADER.size + 5])
+
+        config = Configuration("agent", "1.2.3")
+        self.assertFalse(config.load_bundle(self.path))
+
+        with open(self.path, "wb") as stream:
+            stream.write(data[:-3])
+        self.assertFalse(config.load_bundle(self.path, verify=False))
+        self.assertEqual(dict(config), {})
+
+    def test_default_path(self):
+        self.assertEqual(
+            self.config.bundle_path(),
+            join(self.config.tempdir, "agent-1.2.3.bundle"))
+
+    def test_main(self):
+        envvar = Configuration.DEFAULT_ENVIRONMENT_PATH_VARIABLE
+        os.environ[envvar] = self.tempdir
+        try:
+            self.assertEqual(
+                main(["agent", "--version", "1.2.3", "--output", self.path]), 0)
+        finally:
+            os.environ.pop(envvar)
+
+        config = Configuration("agent", "1.2.3")
+        self.assertTrue(config.load_bundle(self.path))
+        self.assertEqual(config["a"], 1)
+
+
+class TestSharedBundle(TestCase):
+    def setUp(self):
+        super(TestSharedBundle, self).setUp()
+        self.config = Configuration("agent", "1.2.3")
+        self.config.update(a=1, b="$a/x")
+        self.path = join(self.tempdir, "agent.shared")
+
+    def test_share(self):
+        self.assertEqual(self.config.share(self.path), self.path)
+        shared = SharedBundle(self.path)
+        self.addCleanup(shared.close)
+        self.assertEqual(dict(shared), {"a": 1, "b": "1/x"})
+        self.assertEqual(
+            shared.stamp, (os.getpid(), self.config.generation))
+        self.assertFalse(shared.refresh())
+
+    def test_refresh(self):
+        self.config.share(self.path)
+        shared = SharedBundle(self.path)
+        self.addCleanup(shared.close)
+        stamp = shared.stamp
+
+        self.config["a"] = 2
+        self.config.share(self.path)
+        self.assertEqual(shared["a"], 1)
+        self.assertTrue(shared.refresh())
+        self.assertNotEqual(shared.stamp, stamp)
+        self.assertEqual(shared["b"], "2/x")
+
+    @requires_root
+    def test_not_owned(self):
+        self.config.share(self.path)
+        shared = SharedBundle(self.path)
+        self.addCleanup(shared.close)
+
+        # Replace the file with one written by another user
+        planted = join(self.tempdir, "planted.shared")
+        write_bundle(planted, {"a": 2})
+        os.chown(planted, 65534, -1)
+        os.rename(planted, self.path)
+        with self.assertRaises(BundleError):
+            shared.refresh()
+        self.assertEqual(shared["a"], 1)
+        with self.assertRaises(BundleError):
+            SharedBundle(self.path)
+
+    def test_private_directory(self):
+        path = join(self.tempdir, "shared", "agent.shared")
+        self.config.share(path)
+        if POSIX:
+            self.assertEqual(os.stat(dirname(path)).st_mode & 0o777, 0o700)
+
+    def test_default_path(self):
+        self.assertEqual(
+            self.config.shared_path(),
+            join(self.config.tempdir, "agent-1.2.3-%s.shared" % os.getpid()))
+
+    def test_child_process(self):
+        self.config.share(self.path)
+        output = subprocess.check_output([
+            sys.executable, "-c",
+            "import sys; from pyfarm.core.bundle import SharedBundle; "
+            "print(SharedBundle(sys.argv[1])['b'])", self.path])
+        self.assertEqual(output.decode().splitlines()[-1], "1/x")
+
+    def test_not_shared(self):
+        with self.assertRaises(OSError):
+            SharedBundle(join(self.tempdir, "missing"))
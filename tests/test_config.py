@@ -17,15 +17,25 @@
 from __future__ import with_statement
 
 import os
+import sys
+import copy
+import time
+import pickle
+import logging
+import threading
+import subprocess
 import tempfile
 import uuid
+from errno import EACCES
+from ast import literal_eval
 from textwrap import dedent
 from os.path import join, dirname, expandvars, expanduser
 
 from pkg_resources import get_distribution
 
 from pyfarm.core.enums import PY26, LINUX, MAC, WINDOWS
-from pyfarm.core.testutil import TestCase as BaseTestCase, requires_ci
+from pyfarm.core.testutil import (
+    TestCase as BaseTestCase, requires_ci, restore_times)
 
 if PY26:
     from unittest2 import TestCase, skipIf
@@ -34,7 +44,12 @@ else:
 
 from pyfarm.core.config import (
     read_env, read_env_number, read_env_bool, read_env_strict_number,
-    BOOLEAN_FALSE, BOOLEAN_TRUE, Configuration)
+    BOOLEAN_FALSE, BOOLEAN_TRUE, Configuration, VariableResolver,
+    DiscoveryIndex, Layers, ReadEnvAudit, parse_number, parse_numbers,
+    read_env_audit, package_directory, package_version, read_pickle_cache,
+    ConfigurationSnapshot, FileLoadError, LOADERS, register_loader,
+    get_loader, apply_environment, EnvironmentChanges)
+from pyfarm.core import config as config_module
 
 
 class TestConfigEnvironment(TestCase):
@@ -127,6 +142,97 @@ class TestConfigEnvironment(TestCase):
             read_env_strict_number(key, number_type=float)
 
 
+class TestReadEnvAudit(TestCase):
+    def setUp(self):
+        read_env_audit.clear()
+        read_env_audit.enable(summary_at_exit=False)
+        self.addCleanup(read_env_audit.clear)
+        self.addCleanup(read_env_audit.disable)
+
+    def test_counts(self):
+        key = uuid.uuid4().hex
+        os.environ[key] = "a"
+        self.addCleanup(os.environ.pop, key)
+        for _ in range(3):
+            read_env(key)
+        read_env(key, log_result=False)
+        read_env(key + "missing", 1)
+
+        summary = read_env_audit.summary()
+        self.assertEqual(len(summary), 3)
+        self.assertEqual(
+            summary[0], (key, "environment", False, 3, "a"))
+        self.assertEqual(
+            summary[1], (key, "environment", True, 1, None))
+        self.assertEqual(
+            summary[2], (key + "missing", "default", False, 1, 1))
+
+    def test_bounded(self):
+        audit = ReadEnvAudit(maxsize=2)
+        for envvar in ("A", "B", "C", "A"):
+            audit.record(envvar, "environment", "1", False)
+        self.assertEqual(
+            [(read.envvar, read.count) for read in audit.summary()],
+            [("A", 2), ("B", 1)])
+        self.assertEqual(audit.dropped, 1)
+
+    def test_log_summary(self):
+        audit = ReadEnvAudit()
+        audit.record("A", "environment", "visible", False)
+        audit.record("B", "environment", "hunter2", True)
+        messages = []
+        logger = logging.getLogger("pf.core.config")
+        handler = logging.Handler()
+        handler.emit = lambda record: messages.append(record.getMessage())
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        audit.log_summary()
+        self.assertEqual(len(messages), 1)
+        self.assertIn("'visible'", messages[0])
+        self.assertIn("$B from environment x1 (value suppressed)",
+                      messages[0])
+        self.assertNotIn("hunter2", messages[0])
+
+
+class TestParseNumber(TestCase):
+    NUMBERS = (
+        "0", "-0", "+5", "42", "-42", "123456789012345678901234567890",
+        "1.5", "-1.5", "1.", ".5", "-.5", "1e5", "1E-5", "-1.5e+3", "012.5",
+        "0e0", "1e999", "0x10", "-0XfF", "0.0", "-0.0")
+    OTHER = ("None", "[1, 2]", "'1'", "1j", "True", " 1", "(1)")
+    INVALID = ("foo", "1 2", "0x", "1e", "e5", "", "--1", "(")
+
+    def test_same_as_literal_eval(self):
+        for value in self.NUMBERS + self.OTHER:
+            expected = literal_eval(value)
+            result = parse_number(value)
+            self.assertEqual(result, expected, value)
+            self.assertIs(type(result), type(expected), value)
+
+    def test_errors_same_as_literal_eval(self):
+        for value in self.INVALID:
+            try:
+                literal_eval(value)
+            except Exception as e:
+                expected = type(e)
+            else:  # pragma: no cover
+                self.fail("%r should not be valid" % value)
+
+            with self.assertRaises(expected):
+                parse_number(value)
+
+    def test_parse_numbers(self):
+        self.assertEqual(parse_numbers([]), [])
+        self.assertEqual(parse_numbers(["1", "-2", "30"]), [1, -2, 30])
+        self.assertEqual(
+            parse_numbers(self.NUMBERS),
+            [literal_eval(value) for value in self.NUMBERS])
+
+    def test_parse_numbers_newline(self):
+        with self.assertRaises(SyntaxError):
+            parse_numbers(["1\n2"])
+
+
 class TestConfiguration(BaseTestCase):
     def test_parent_class(self):
         self.assertIn(dict, Configuration.__bases__)
@@ -338,6 +444,127 @@ class TestConfiguration(BaseTestCase):
         config.load(environment=environment)
         self.assertEqual(environment, {"key0": 0, "key1": 1, "key": 1})
 
+    def test_provenance(self):
+        local_root = tempfile.mkdtemp()
+        self.add_cleanup_path(local_root)
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        versioned = join(local_root, config.child_dir, "1", "agent.yml")
+        unversioned = join(local_root, config.child_dir, "agent.yml")
+        os.makedirs(dirname(versioned))
+
+        with open(versioned, "w") as stream:
+            stream.write("a: 1\nb: 1\nenv: {c: 1}")
+
+        with open(unversioned, "w") as stream:
+            stream.write("b: 2")
+
+        config.load(environment={})
+        self.assertEqual(config.layers.sources, (versioned, unversioned))
+        self.assertEqual(config.provenance("a"), versioned)
+        self.assertEqual(config.provenance("b"), unversioned)
+        self.assertIsNone(config.provenance("env"))
+        self.assertNotIn("env", config)
+        config["b"] = 3
+        self.assertIsNone(config.provenance("b"))
+        self.assertIsNone(config.provenance("missing"))
+
+    def test_load_parsed_file_cache(self):
+        local_root = tempfile.mkdtemp()
+        self.add_cleanup_path(local_root)
+        path = join(local_root, "pyfarm", "agent", "agent.yml")
+        os.makedirs(dirname(path))
+        with open(path, "w") as stream:
+            stream.write("value: 1")
+        mtime = time.time() - 60
+        os.utime(path, (mtime, mtime))
+
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        config.parsed_file_cache = True
+        self.add_cleanup_path(config._parsed_file_cache_path(path))
+        config.load()
+        self.assertEqual(config["value"], 1)
+        self.assertEqual(config.parsed_file_cache_info, (0, 1))
+
+        # A new instance should be able to use the data
+        # that the first instance stored.
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        config.parsed_file_cache = True
+        config.load()
+        self.assertEqual(config["value"], 1)
+        self.assertEqual(config.parsed_file_cache_info, (1, 0))
+
+        with open(path, "w") as stream:
+            stream.write("value: 22")
+
+        config.load()
+        self.assertEqual(config["value"], 22)
+        self.assertEqual(config.parsed_file_cache_info, (0, 1))
+
+    def test_load_parsed_file_cache_disabled(self):
+        local_root = tempfile.mkdtemp()
+        self.add_cleanup_path(local_root)
+        path = join(local_root, "pyfarm", "agent", "agent.yml")
+        os.makedirs(dirname(path))
+        with open(path, "w") as stream:
+            stream.write("value: 1")
+
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        config.load()
+        self.assertFalse(os.path.isfile(config._parsed_file_cache_path(path)))
+        self.assertEqual(config.parsed_file_cache_info, (0, 1))
+
+        # Nothing is kept in memory either
+        config.load()
+        self.assertEqual(config.parsed_file_cache_info, (0, 1))
+
+    def test_load_parsed_file_cache_copies(self):
+        config = Configuration("agent", "1.2.3")
+        config.system_root = self.tempdir
+        config.tempdir = self.tempdir
+        path = join(self.tempdir, config.child_dir, "agent.yml")
+        os.makedirs(dirname(path))
+        with open(path, "w") as stream:
+            stream.write("values: [1, 2]\nenv:\n  a: [3]\n")
+        mtime = time.time() - 60
+        os.utime(path, (mtime, mtime))
+
+        for parsed_file_cache in (False, True):
+            config.parsed_file_cache = parsed_file_cache
+            environment = {}
+            config.load(environment=environment)
+            config["values"].append(3)
+            environment["a"].append(4)
+
+            environment = {}
+            config.load(environment=environment)
+            self.assertEqual(config["values"], [1, 2])
+            self.assertEqual(environment["a"], [3])
+
+    def test_load_parsed_file_cache_recent(self):
+        config = Configuration("agent", "1.2.3")
+        config.system_root = self.tempdir
+        config.tempdir = self.tempdir
+        config.parsed_file_cache = True
+        path = join(self.tempdir, config.child_dir, "agent.yml")
+        os.makedirs(dirname(path))
+        with open(path, "w") as stream:
+            stream.write("value: 1")
+        config.load()
+
+        # Rewritten without changing the signature, as can happen
+        # within a single tick of the modification time
+        stat = os.stat(path)
+        with open(path, "w") as stream:
+            stream.write("value: 2")
+        restore_times(path, stat)
+        config.load()
+        self.assertEqual(config["value"], 2)
+        self.assertEqual(config.parsed_file_cache_info, (0, 1))
+
     def test_auto_version(self):
         distro = get_distribution("pyfarm.core")
         config = Configuration("pyfarm.core")
@@ -349,6 +576,86 @@ class TestConfiguration(BaseTestCase):
         with self.assertRaises(ValueError):
             Configuration("foobar")
 
+    def test_package_configuration(self):
+        import pyfarm.core
+        config = Configuration("pyfarm.core")
+        self.assertEqual(
+            config.package_configuration,
+            join(dirname(pyfarm.core.__file__), "etc", "core.yml"))
+        self.assertIsNone(Configuration("foobar", "1.0").package_configuration)
+
+    def test_package_directory(self):
+        import pyfarm.core
+        self.assertEqual(
+            package_directory("pyfarm.core"), dirname(pyfarm.core.__file__))
+        self.assertIsNone(package_directory("foobar"))
+        self.assertIsNone(package_directory("foobar.baz"))
+
+    def test_package_version(self):
+        self.assertEqual(
+            package_version("pyfarm.core"),
+            get_distribution("pyfarm.core").version)
+        self.assertIsNone(package_version("foobar"))
+
+    def test_package_version_disk_cache(self):
+        cache_path = join(self.tempdir, "versions.pickle")
+        config_module._package_versions.pop("pyfarm.core", None)
+        self.addCleanup(config_module._package_versions.pop, "pyfarm.core")
+        version = package_version("pyfarm.core", cache_path=cache_path)
+        signature, cached_version = read_pickle_cache(cache_path)["pyfarm.core"]
+        self.assertEqual(cached_version, version)
+
+        # A new process, simulated by clearing the in memory cache,
+        # should use the version from disk.
+        config_module._package_versions.pop("pyfarm.core")
+        config_module.write_pickle_cache(
+            cache_path, {"pyfarm.core": (signature, "0.0.0-cached")})
+        self.assertEqual(
+            package_version("pyfarm.core", cache_path=cache_path),
+            "0.0.0-cached")
+
+        # ... unless the package has changed since
+        config_module._package_versions.pop("pyfarm.core")
+        config_module.write_pickle_cache(
+            cache_path, {"pyfarm.core": (signature[:-1] + (-1, ), "0.0.0")})
+        self.assertEqual(
+            package_version("pyfarm.core", cache_path=cache_path), version)
+
+    @skipIf(WINDOWS, "symlinks and posix permissions are required")
+    def test_write_pickle_cache_temp_file(self):
+        cache_path = join(self.tempdir, "cache.pickle")
+        target = join(self.tempdir, "target")
+        with open(target, "w") as stream:
+            stream.write("unchanged")
+
+        # Paths another user could have predicted and planted a
+        # symlink at must not be written through.
+        for name in ("cache.pickle.%s" % os.getpid(),
+                     "cache.pickle.%s.tmp" % os.getpid()):
+            os.symlink(target, join(self.tempdir, name))
+
+        config_module.write_pickle_cache(cache_path, {"a": 1})
+        self.assertEqual(read_pickle_cache(cache_path), {"a": 1})
+        self.assertEqual(os.stat(cache_path).st_mode & 0o777, 0o600)
+        with open(target) as stream:
+            self.assertEqual(stream.read(), "unchanged")
+        self.assertEqual(
+            sorted(os.listdir(self.tempdir)),
+            ["cache.pickle", "cache.pickle.%s" % os.getpid(),
+             "cache.pickle.%s.tmp" % os.getpid(), "target"])
+
+    def test_import_does_not_use_pkg_resources(self):
+        # The `pyfarm` namespace package itself may import pkg_resources
+        # depending on how it was installed so that's excluded here.
+        output = subprocess.check_output([
+            sys.executable, "-c",
+            "import sys, pyfarm; "
+            "sys.modules.pop('pkg_resources', None); "
+            "import pyfarm.core.config; "
+            "pyfarm.core.config.Configuration('pyfarm.core'); "
+            "print('pkg_resources' in sys.modules)"])
+        self.assertEqual(output.strip(), b"False")
+
     def test_tempdir(self):
         config = Configuration("pyfarm.core")
         self.assertEqual(
@@ -366,6 +673,148 @@ class TestConfiguration(BaseTestCase):
         with self.assertRaises(KeyError):
             config[key]
 
+    def test_discovery_index_shared(self):
+        first = Configuration("agent", "1.2.3")
+        second = Configuration("agent", "1.2.3")
+        self.assertIs(first.discovery_index, second.discovery_index)
+        self.assertIs(first.discovery_index, Configuration.DISCOVERY_INDEX)
+
+
+class TestDiscoveryIndex(BaseTestCase):
+    def setUp(self):
+        super(TestDiscoveryIndex, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.add_cleanup_path(self.root)
+        os.makedirs(join(self.root, "a", "b"))
+        with open(join(self.root, "a", "file.yml"), "w"):
+            pass
+
+    def test_isdir(self):
+        index = DiscoveryIndex()
+        self.assertTrue(index.isdir(self.root))
+        self.assertTrue(index.isdir(join(self.root, "a")))
+        self.assertTrue(index.isdir(join(self.root, "a", "b") + os.sep))
+        self.assertFalse(index.isdir(join(self.root, "a", "file.yml")))
+        self.assertFalse(index.isdir(join(self.root, "missing", "b")))
+
+    def test_isfile(self):
+        index = DiscoveryIndex()
+        self.assertTrue(index.isfile(join(self.root, "a", "file.yml")))
+        self.assertFalse(index.isfile(join(self.root, "a", "b")))
+        self.assertFalse(index.isfile(join(self.root, "a", "missing.yml")))
+        self.assertFalse(index.isfile(join(self.root, "missing", "file.yml")))
+
+    def test_info(self):
+        index = DiscoveryIndex()
+        for name in ("b", "c", "d", "file.yml"):
+            index.isdir(join(self.root, "a", name))
+            index.isfile(join(self.root, "a", name))
+        self.assertEqual(index.info(), (8, 1, 7))
+
+    def test_ttl(self):
+        index = DiscoveryIndex(ttl=60)
+        path = join(self.root, "a", "new.yml")
+        self.assertFalse(index.isfile(path))
+        with open(path, "w"):
+            pass
+        self.assertFalse(index.isfile(path))
+        index.invalidate(join(self.root, "a"))
+        self.assertTrue(index.isfile(path))
+
+        index = DiscoveryIndex(ttl=0)
+        self.assertTrue(index.isfile(path))
+        os.remove(path)
+        self.assertFalse(index.isfile(path))
+
+    def test_unreadable_directory(self):
+        index = DiscoveryIndex(ttl=60)
+        directory = join(self.root, "a")
+
+        def scan(path):
+            if path == directory:
+                raise OSError(EACCES, "Permission denied", path)
+            return DiscoveryIndex._scan(index, path)
+
+        index._scan = scan
+        self.assertTrue(index.isfile(join(directory, "file.yml")))
+        self.assertTrue(index.isdir(join(directory, "b")))
+        self.assertFalse(index.isfile(join(directory, "missing.yml")))
+        self.assertIsNone(index.listing(directory))
+        self.assertNotIn(directory, index._listings)
+        self.assertFalse(index.isfile(join(self.root, "missing", "file.yml")))
+
+    @skipIf(WINDOWS or os.getuid() == 0,
+            "requires posix permissions which apply to the current user")
+    def test_execute_only_directory(self):
+        directory = join(self.root, "a")
+        os.chmod(directory, 0o100)
+        try:
+            index = DiscoveryIndex()
+            self.assertTrue(index.isfile(join(directory, "file.yml")))
+            self.assertTrue(index.isdir(join(directory, "b")))
+        finally:
+            os.chmod(directory, 0o755)
+
+    def test_configuration_files(self):
+        config = Configuration("agent", "1.2.3")
+        config.discovery_index = DiscoveryIndex()
+        config.system_root = self.root
+        path = join(self.root, config.child_dir, "1.2", "agent.yml")
+        os.makedirs(dirname(path))
+        with open(path, "w"):
+            pass
+        self.assertEqual(config.files(), [path])
+        self.assertGreater(config.discovery_index.info().saved, 0)
+
+
+class TestLayers(TestCase):
+    def setUp(self):
+        self.first = {"a": 1, "b": 1}
+        self.second = {"b": 2, "c": 2, "env": {}}
+        self.layers = Layers(
+            [("first", self.first), ("empty", None),
+             ("second", self.second)], exclude=("env", ))
+
+    def test_lookup(self):
+        self.assertEqual(self.layers["a"], 1)
+        self.assertEqual(self.layers["b"], 2)
+        self.assertEqual(self.layers.get("missing", 42), 42)
+        self.assertNotIn("env", self.layers)
+        with self.assertRaises(KeyError):
+            self.layers["env"]
+
+    def test_sources(self):
+        self.assertEqual(self.layers.sources, ("first", "second"))
+
+    def test_provenance(self):
+        self.assertEqual(self.layers.provenance("a"), "first")
+        self.assertEqual(self.layers.provenance("b"), "second")
+        self.assertIsNone(self.layers.provenance("env"))
+
+    def test_no_copy(self):
+        self.assertIs(self.layers.layer("first"), self.first)
+
+    def test_flatten(self):
+        self.assertEqual(
+            self.layers.flatten(), {"a": 1, "b": 2, "c": 2})
+        self.assertIs(self.layers.flatten(), self.layers.flatten())
+        self.assertEqual(len(self.layers), 3)
+        self.assertEqual(set(self.layers), set(["a", "b", "c"]))
+        self.assertEqual(self.first, {"a": 1, "b": 1})
+
+    def test_replace(self):
+        flattened = self.layers.flatten()
+        affected = self.layers.replace("second", {"b": 3, "d": 3})
+        self.assertEqual(affected, set(["b", "c", "d"]))
+        self.assertEqual(self.layers["b"], 3)
+        self.assertNotIn("c", self.layers)
+        self.assertEqual(self.layers.provenance("a"), "first")
+        self.assertEqual(self.layers.flatten(), {"a": 1, "b": 3, "d": 3})
+        self.assertEqual(flattened, {"a": 1, "b": 2, "c": 2})
+
+        with self.assertRaises(KeyError):
+            self.layers.replace("missing", {})
+
 
 class TestConfigurationExpansion(BaseTestCase):
     def test_temp_getitem(self):
@@ -397,3 +846,512 @@ class TestConfigurationExpansion(BaseTestCase):
         self.assertEqual(config["path"], "foo/bar/%s" % envvalue1)
         self.assertEqual(config["home"], expanduser("~/foo"))
         self.assertEqual(config["envvar2_expand"], "envvar2")
+
+    def test_braced_and_escaped(self):
+        config = Configuration("agent", "1.2.3")
+        config.update(foo="foo", value="${foo}bar/$$foo")
+        self.assertEqual(config["value"], "foobar/$foo")
+
+    def test_non_string_reference(self):
+        config = Configuration("agent", "1.2.3")
+        config.update(number=42, value="$number/$number")
+        self.assertEqual(config["value"], "42/42")
+
+    def test_deep_chain(self):
+        config = Configuration("agent", "1.2.3")
+        depth = 5000
+        for i in range(depth):
+            config["key%s" % i] = "$key%s" % (i + 1)
+        config["key%s" % depth] = "end"
+        self.assertEqual(config["key0"], "end")
+
+    def test_cycle(self):
+        config = Configuration("agent", "1.2.3")
+        config.update(a="$b", b="$c", c="$a/x")
+        self.assertEqual(config["a"], "$b/x")
+        report = config.check_references()
+        self.assertEqual(len(report.cycles), 1)
+        cycle = list(report.cycles)[0]
+        self.assertEqual(cycle[0], cycle[-1])
+        self.assertEqual(set(cycle), set(["a", "b", "c"]))
+
+    def test_unresolved(self):
+        name = "a" + uuid.uuid4().hex
+        config = Configuration("agent", "1.2.3")
+        config.update(value="$%s/${%s}" % (name, name))
+        self.assertEqual(config["value"], "$%s/${%s}" % (name, name))
+        report = config.check_references()
+        self.assertEqual(report.unresolved, frozenset([name]))
+        self.assertEqual(report.cycles, frozenset())
+
+
+class TestVariableResolver(TestCase):
+    def test_source_priority(self):
+        resolver = VariableResolver([{"a": "first"}, {"a": "second", "b": "b"}])
+        self.assertEqual(resolver.expand("$a/$b"), "first/b")
+        self.assertEqual(resolver.requested, set(["a", "b"]))
+
+    def test_resolves_each_name_once(self):
+        lookups = []
+
+        class Source(object):
+            data = {"a": "$b$b$b", "b": "$c-$c", "c": "c"}
+
+            def get(self, key, default=None):
+                lookups.append(key)
+                return self.data.get(key, default)
+
+        resolver = VariableResolver([Source()])
+        self.assertEqual(resolver.expand("$a$a"), "c-cc-cc-cc-cc-cc-c")
+        self.assertEqual(sorted(lookups), ["a", "b", "c"])
+
+    def test_parse(self):
+        resolver = VariableResolver([])
+        self.assertEqual(
+            resolver.parse("a$b${c}$$d"),
+            ["a", ("b", "$b"), ("c", "${c}"), "$", "d"])
+
+
+class TestConfigurationExpansionCache(BaseTestCase):
+    def test_cache_hit(self):
+        config = Configuration("agent", "1.2.3")
+        config.update(foo="foo", foobar="$foo/bar")
+        self.assertEqual(config["foobar"], "foo/bar")
+        self.assertEqual(config["foobar"], "foo/bar")
+        info = config.expansion_cache_info()
+        self.assertEqual(info.hits, 1)
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.size, 1)
+
+    def test_setitem_invalidates(self):
+        config = Configuration("agent", "1.2.3")
+        config.update(foo="foo", foobar="$foo/bar")
+        self.assertEqual(config["foobar"], "foo/bar")
+        config["foo"] = "oof"
+        self.assertEqual(config.expansion_cache_info().size, 0)
+        self.assertEqual(config["foobar"], "oof/bar")
+
+    def test_pickle_discards_cache(self):
+        snapshot = ConfigurationSnapshot(
+            {"foo": "foo", "foobar": "$foo/bar"}, 1, tempdir=self.tempdir)
+        self.assertEqual(snapshot["foobar"], "foo/bar")
+
+        for copied in (pickle.loads(pickle.dumps(snapshot)),
+                       copy.deepcopy(snapshot)):
+            self.assertIsInstance(copied, ConfigurationSnapshot)
+            self.assertEqual(dict(copied), dict(snapshot))
+            self.assertEqual(copied.generation, 1)
+            self.assertEqual(copied.tempdir, self.tempdir)
+            self.assertEqual(copied.expansion_cache_info(), (0, 0, 0))
+            self.assertEqual(copied["foobar"], "foo/bar")
+
+    def test_update_invalidates(self):
+        config = Configuration("agent", "1.2.3")
+        config.update(foo="foo", foobar="$foo/bar")
+        self.assertEqual(config.get("foobar"), "foo/bar")
+        config.update(foo="oof")
+        self.assertEqual(config.get("foobar"), "oof/bar")
+
+    def test_delitem_invalidates(self):
+        config = Configuration("agent", "1.2.3")
+        config.update(foo="foo", foobar="$foo/bar")
+        self.assertEqual(config["foobar"], "foo/bar")
+        del config["foo"]
+        self.assertEqual(config["foobar"], "$foo/bar")
+
+    def test_environment_invalidates(self):
+        envvar = "a" + uuid.uuid4().hex
+        config = Configuration("agent", "1.2.3")
+        config["value"] = "$%s/bar" % envvar
+        self.assertEqual(config["value"], "$%s/bar" % envvar)
+        os.environ[envvar] = "foo"
+        self.assertEqual(config["value"], "foo/bar")
+        self.assertEqual(config["value"], "foo/bar")
+        os.environ[envvar] = "oof"
+        self.assertEqual(config["value"], "oof/bar")
+        info = config.expansion_cache_info()
+        self.assertEqual(info.hits, 1)
+        self.assertEqual(info.misses, 3)
+
+    def test_clear_expansion_cache(self):
+        config = Configuration("agent", "1.2.3")
+        config["env"] = {"foo": "foo"}
+        config["value"] = "$foo"
+        self.assertEqual(config["value"], "foo")
+        config["env"]["foo"] = "oof"
+        config.clear_expansion_cache()
+        self.assertEqual(config["value"], "oof")
+
+    def test_max_size(self):
+        config = Configuration("agent", "1.2.3")
+        config.MAX_EXPANSION_CACHE_SIZE = 2
+        for i in range(3):
+            config.get("missing", "value%s" % i)
+        self.assertEqual(config.expansion_cache_info().size, 1)
+
+
+class TestConfigurationSnapshot(BaseTestCase):
+    def test_generation(self):
+        config = Configuration("agent", "1.2.3")
+        self.assertEqual(config.generation, 0)
+        config["a"] = 1
+        config.update(b=2, c=3)
+        self.assertEqual(config.generation, 2)
+        config.apply_changes({"d": 4}, removed=["a", "missing"])
+        self.assertEqual(config.generation, 3)
+        self.assertEqual(dict(config), {"b": 2, "c": 3, "d": 4})
+
+    def test_snapshot_read_only(self):
+        config = Configuration("agent", "1.2.3")
+        config.update(foo="foo", foobar="$foo/bar")
+        snapshot = config.snapshot()
+        self.assertIsInstance(snapshot, ConfigurationSnapshot)
+        self.assertEqual(snapshot.generation, config.generation)
+        self.assertEqual(snapshot["foobar"], "foo/bar")
+        with self.assertRaises(TypeError):
+            snapshot["foo"] = "oof"
+        with self.assertRaises(TypeError):
+            snapshot.update(foo="oof")
+        with self.assertRaises(TypeError):
+            snapshot.pop("foo")
+
+        # Later changes to the configuration are not visible
+        config["foo"] = "oof"
+        self.assertEqual(snapshot["foobar"], "foo/bar")
+        self.assertEqual(config.snapshot()["foobar"], "oof/bar")
+
+    def test_copy_on_write(self):
+        config = Configuration("agent", "1.2.3")
+        config.copy_on_write = True
+        config.update(foo="foo", foobar="$foo/bar")
+        published = config.snapshot()
+        self.assertIs(config.snapshot(), published)
+        self.assertEqual(config["foobar"], "foo/bar")
+        self.assertEqual(config.get("foobar"), "foo/bar")
+        self.assertEqual(published.expansion_cache_info().misses, 1)
+
+        config["foo"] = "oof"
+        self.assertIsNot(config.snapshot(), published)
+        self.assertEqual(config.snapshot().generation, config.generation)
+        self.assertEqual(config["foobar"], "oof/bar")
+        self.assertEqual(published["foobar"], "foo/bar")
+
+        config.copy_on_write = False
+        self.assertIsNot(config.snapshot(), config.snapshot())
+
+    def test_copy_on_write_reads(self):
+        config = Configuration("agent", "1.2.3")
+        config.copy_on_write = True
+        config.update(a=1, b="$a/x")
+        keys = config.keys()
+        items = config.items()
+        config.apply_changes({"c": 3}, removed=["a"])
+
+        # Views of an older generation are never modified
+        self.assertEqual(sorted(keys), ["a", "b"])
+        self.assertEqual(sorted(items), [("a", 1), ("b", "$a/x")])
+        self.assertEqual(sorted(config.keys()), ["b", "c"])
+        self.assertEqual(sorted(config.values(), key=str), ["$a/x", 3])
+        self.assertIn("c", config)
+        self.assertNotIn("a", config)
+        self.assertEqual(len(config), 2)
+        self.assertEqual(dict(config), {"b": "$a/x", "c": 3})
+
+    def test_pickle(self):
+        for copy_on_write in (False, True):
+            config = Configuration("agent", "1.2.3")
+            config.copy_on_write = copy_on_write
+            config.update(foo="foo", foobar="$foo/bar")
+            config.share(join(self.tempdir, "agent.shared"))
+            self.assertEqual(config["foobar"], "foo/bar")
+
+            for copied in (pickle.loads(pickle.dumps(config)),
+                           copy.deepcopy(config)):
+                self.assertEqual(dict(copied), dict(config))
+                self.assertEqual(copied.generation, config.generation)
+                self.assertEqual(copied.copy_on_write, copy_on_write)
+                self.assertEqual(copied._shared_paths, set())
+                self.assertEqual(copied["foobar"], "foo/bar")
+                copied["foo"] = "oof"
+                self.assertEqual(copied["foobar"], "oof/bar")
+                self.assertEqual(config["foobar"], "foo/bar")
+
+    def test_default_copy_on_write(self):
+        self.assertFalse(Configuration.DEFAULT_COPY_ON_WRITE)
+        self.assertFalse(Configuration("agent", "1.2.3").copy_on_write)
+
+    def test_load_publishes_once(self):
+        config = Configuration("agent", "1.2.3")
+        config.copy_on_write = True
+        config.system_root = self.tempdir
+        path = join(self.tempdir, config.child_dir, "agent.yml")
+        os.makedirs(dirname(path))
+        with open(path, "w") as stream:
+            stream.write("a: 1\nb: $a/x\n")
+
+        generation = config.generation
+        config.load()
+        self.assertEqual(config.generation, generation + 1)
+        self.assertEqual(config.snapshot()["b"], "1/x")
+
+    def test_concurrent_readers(self):
+        config = Configuration("agent", "1.2.3")
+        config.copy_on_write = True
+        config.update(a=0, b=0)
+        errors = []
+        stop = threading.Event()
+
+        def read():
+            while not stop.is_set():
+                snapshot = config.snapshot()
+                if snapshot["a"] != snapshot["b"]:
+                    errors.append((snapshot["a"], snapshot["b"]))
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        try:
+            for value in range(1, 500):
+                config.apply_changes({"a": value, "b": value})
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(config.snapshot()["a"], 499)
+
+
+class TestConfigurationFragments(BaseTestCase):
+    def setUp(self):
+        super(TestConfigurationFragments, self).setUp()
+        self.config = Configuration("agent", "1.2.3")
+        self.config.system_root = self.tempdir
+        self.config.discovery_index = DiscoveryIndex(ttl=0)
+        self.root = join(self.tempdir, self.config.child_dir)
+        self.fragments = join(self.root, "agent.d")
+        os.makedirs(self.fragments)
+        self.write(join(self.root, "agent.yml"), "a: 0\nb: 0\n")
+
+    def write(self, path, data):
+        with open(path, "w") as stream:
+            stream.write(data)
+
+        # Backdated so the parsed file cache will keep the data
+        mtime = time.time() - 60
+        os.utime(path, (mtime, mtime))
+
+    def test_fragments_sorted(self):
+        self.write(join(self.fragments, "20-b.yml"), "b: 2\n")
+        self.write(join(self.fragments, "10-a.yml"), "a: 1\nb: 1\n")
+        self.write(join(self.fragments, ".hidden.yml"), "a: 3\n")
+        self.write(join(self.fragments, "notes.txt"), "a: 4\n")
+        self.assertEqual(
+            self.config.fragments(self.root),
+            [join(self.fragments, "10-a.yml"),
+             join(self.fragments, "20-b.yml")])
+        self.assertEqual(
+            self.config.files()[-3:],
+            [join(self.root, "agent.yml"), join(self.fragments, "10-a.yml"),
+             join(self.fragments, "20-b.yml")])
+
+        self.config.load()
+        self.assertEqual(self.config["a"], 1)
+        self.assertEqual(self.config["b"], 2)
+        self.assertEqual(
+            self.config.provenance("b"), join(self.fragments, "20-b.yml"))
+
+    def test_fragments_without_base_file(self):
+        os.remove(join(self.root, "agent.yml"))
+        self.write(join(self.fragments, "10-a.yml"), "a: 1\n")
+        self.config.load()
+        self.assertEqual(self.config["a"], 1)
+
+    def test_missing_fragment_directory(self):
+        self.assertEqual(self.config.fragments(self.tempdir), [])
+
+    def test_parsed_concurrently(self):
+        names = ["%02d.yml" % index for index in range(10)]
+        for index, name in enumerate(names):
+            self.write(join(self.fragments, name), "a: %s\n" % index)
+
+        threads = set()
+        parse_file = self.config._parse_file
+
+        def record(filepath):
+            threads.add(threading.current_thread().ident)
+            return parse_file(filepath)
+
+        self.config._parse_file = record
+        self.config.parse_threads = 4
+        self.config.load()
+        self.assertEqual(self.config["a"], 9)
+        self.assertNotIn(threading.current_thread().ident, threads)
+        self.assertEqual(self.config.parsed_file_cache_info.misses, 11)
+
+    def test_only_changed_fragments_parsed(self):
+        for name in ("10-a.yml", "20-b.yml"):
+            self.write(join(self.fragments, name), "a: 1\n")
+        self.config.tempdir = self.tempdir
+        self.config.parsed_file_cache = True
+        self.config.load()
+
+        parsed = []
+        parse_file = self.config._parse_file
+
+        def record(filepath):
+            parsed.append(filepath)
+            return parse_file(filepath)
+
+        self.config._parse_file = record
+        changed = join(self.fragments, "20-b.yml")
+        os.remove(changed)
+        self.write(changed, "a: 2\n")
+        self.config.load()
+        self.assertEqual(parsed, [changed])
+        self.assertEqual(self.config["a"], 2)
+
+    def test_serial(self):
+        self.assertEqual(Configuration.DEFAULT_PARSE_THREADS, 1)
+        self.assertEqual(self.config.parse_threads, 1)
+        self.write(join(self.fragments, "10-a.yml"), "a: 1\n")
+        self.write(join(self.fragments, "20-b.yml"), "a: 2\n")
+
+        threads = set()
+        parse_file = self.config._parse_file
+
+        def record(filepath):
+            threads.add(threading.current_thread().ident)
+            return parse_file(filepath)
+
+        self.config._parse_file = record
+        self.config.load()
+        self.assertEqual(self.config["a"], 2)
+        self.assertEqual(threads, set([threading.current_thread().ident]))
+
+
+class TestFileLoaders(BaseTestCase):
+    def setUp(self):
+        super(TestFileLoaders, self).setUp()
+        self.config = Configuration("agent", "1.2.3")
+        self.config.system_root = self.tempdir
+        self.config.discovery_index = DiscoveryIndex(ttl=0)
+        self.root = join(self.tempdir, self.config.child_dir)
+        os.makedirs(self.root)
+
+    def write(self, filename, data):
+        path = join(self.root, filename)
+        with open(path, "w") as stream:
+            stream.write(data)
+        return path
+
+    def test_default_extensions(self):
+        self.assertEqual(Configuration.DEFAULT_FILE_EXTENSIONS, (".yml", ))
+        self.assertEqual(self.config.file_extensions, (".yml", ))
+        self.config.file_extension = ".yaml"
+        self.assertEqual(self.config.file_extensions, (".yaml", ))
+
+    def test_get_loader(self):
+        self.assertEqual(get_loader("a.yml").name, "yaml")
+        self.assertEqual(get_loader("a.YAML").name, "yaml")
+        self.assertEqual(get_loader("a.json").name, "json")
+        self.assertEqual(get_loader("a.toml").name, "toml")
+        with self.assertRaises(FileLoadError):
+            get_loader("a.ini")
+
+    def test_json(self):
+        path = self.write("agent.json", '{"a": 1, "b": [1, 2]}')
+        self.assertEqual(self.config._parse_file(path), {"a": 1, "b": [1, 2]})
+
+    def test_toml(self):
+        path = self.write("agent.toml", 'a = 1\n[b]\nc = "d"\n')
+        try:
+            data = self.config._parse_file(path)
+        except ImportError:  # pragma: no cover
+            self.skipTest("no toml parser is installed")
+        self.assertEqual(data, {"a": 1, "b": {"c": "d"}})
+
+    def test_invalid(self):
+        path = self.write("agent.json", "{")
+        with self.assertRaises(FileLoadError):
+            self.config._parse_file(path)
+        path = self.write("agent.yml", "a: [")
+        with self.assertRaises(FileLoadError):
+            self.config._parse_file(path)
+
+    def test_mixed_extensions(self):
+        self.config.file_extensions = (".yml", ".json")
+        yml = self.write("agent.yml", "a: 1\nb: 1\n")
+        json_path = self.write("agent.json", '{"b": 2}')
+        self.assertEqual(self.config.files()[-2:], [yml, json_path])
+        self.config.load()
+        self.assertEqual(dict(self.config), {"a": 1, "b": 2})
+        self.assertEqual(self.config.provenance("b"), json_path)
+
+    def test_invalid_file_skipped(self):
+        self.config.file_extensions = (".yml", ".json")
+        self.write("agent.yml", "a: 1\n")
+        self.write("agent.json", "{")
+        self.config.load()
+        self.assertEqual(dict(self.config), {"a": 1})
+
+    def test_register_loader(self):
+        self.addCleanup(LOADERS.pop, ".lines", None)
+        register_loader(
+            ".lines", "lines", lambda stream: dict(
+                line.split(b"=") for line in stream.read().splitlines()))
+        self.config.file_extensions = (".lines", )
+        self.write("agent.lines", "a=1\n")
+        self.config.load()
+        self.assertEqual(dict(self.config), {b"a": b"1"})
+
+
+class RecordingEnvironment(dict):
+    def __init__(self, *args, **kwargs):
+        super(RecordingEnvironment, self).__init__(*args, **kwargs)
+        self.assigned = []
+
+    def __setitem__(self, key, value):
+        self.assigned.append(key)
+        super(RecordingEnvironment, self).__setitem__(key, value)
+
+
+class TestApplyEnvironment(BaseTestCase):
+    def test_apply(self):
+        environment = RecordingEnvironment(a="1", b="2")
+        changes = apply_environment(
+            environment, {"a": "1", "b": "3", "c": "4"})
+        self.assertIsInstance(changes, EnvironmentChanges)
+        self.assertEqual(changes.added, {"c": "4"})
+        self.assertEqual(changes.changed, {"b": ("2", "3")})
+        self.assertEqual(changes.unchanged, ("a", ))
+        self.assertEqual(sorted(environment.assigned), ["b", "c"])
+        self.assertEqual(environment, {"a": "1", "b": "3", "c": "4"})
+
+    def test_load(self):
+        config = Configuration("agent", "1.2.3")
+        config.system_root = self.tempdir
+        root = join(self.tempdir, config.child_dir)
+        os.makedirs(join(root, "1"))
+        with open(join(root, "1", "agent.yml"), "w") as stream:
+            stream.write("env:\n  a: '1'\n  b: '1'\n")
+        with open(join(root, "agent.yml"), "w") as stream:
+            stream.write("env:\n  b: '2'\n")
+
+        environment = RecordingEnvironment()
+        changes = config.load(environment=environment)
+        self.assertEqual(changes.added, {"a": "1", "b": "2"})
+        self.assertEqual(sorted(environment.assigned), ["a", "b"])
+        self.assertEqual(config.applied_environment, {"a": "1", "b": "2"})
+
+        # Loading again does not assign anything
+        environment.assigned[:] = []
+        changes = config.load(environment=environment)
+        self.assertEqual(changes.added, {})
+        self.assertEqual(changes.changed, {})
+        self.assertEqual(environment.assigned, [])
+
+    def test_load_without_environment(self):
+        config = Configuration("agent", "1.2.3")
+        config.system_root = self.tempdir
+        self.assertEqual(config.load(), EnvironmentChanges({}, {}, ()))
@@ -15,14 +15,21 @@
 # limitations under the License.
 
 import sys
+import pickle
 import warnings
+from array import array
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
 
 from pyfarm.core.enums import PY26
 
 if PY26:
-    from unittest2 import TestCase, skipUnless
+    from unittest2 import TestCase, skipUnless, skipIf
 else:
-    from unittest import TestCase, skipUnless
+    from unittest import TestCase, skipUnless, skipIf
 
 from pyfarm.core.enums import (
     WorkState, AgentState, OperatingSystem, UseAgentAddress,
@@ -31,7 +38,8 @@ from pyfarm.core.enums import (
     _OperatingSystem, _UseAgentAddress, DBUseAgentAddress,
     DBAgentState, DBOperatingSystem, DBWorkState, Enum,
     Values, cast_enum, LINUX, MAC, WINDOWS, BSD, BOOLEAN_TRUE, BOOLEAN_FALSE,
-    INTEGER_TYPES)
+    INTEGER_TYPES, registered_enums, _MAPPED_ENUMS, StateDict, encode_states,
+    decode_states, count_states, state_mask)
 
 
 class TestEnums(TestCase):
@@ -225,6 +233,64 @@ class TestEnums(TestCase):
         with self.assertRaises(TypeError):
             cast_enum(e, None)
 
+    def test_cast_enum_interned(self):
+        self.assertIs(cast_enum(_WorkState, str), WorkState)
+        self.assertIs(cast_enum(_WorkState, int), DBWorkState)
+
+        # An equivalent enum maps to the same object
+        Values.check_uniqueness = False
+        first = cast_enum(Enum("interned", A=Values(-4243, "A")), str)
+        second = cast_enum(Enum("interned", A=Values(-4243, "A")), str)
+        self.assertIs(first, second)
+        self.assertIsNot(
+            first, cast_enum(Enum("interned", A=Values(-4243, "B")), str))
+
+    def test_cast_enum_pickle(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertIs(
+                pickle.loads(pickle.dumps(WorkState, protocol)), WorkState)
+            self.assertIs(
+                pickle.loads(pickle.dumps(DBAgentState, protocol)),
+                DBAgentState)
+
+    def test_cast_enum_pickle_rebuild(self):
+        Values.check_uniqueness = False
+        mapped = cast_enum(Enum("rebuilt", A=Values(-4244, "A")), int)
+        pickled = pickle.dumps(mapped)
+        _MAPPED_ENUMS.pop(mapped._key)
+        rebuilt = pickle.loads(pickled)
+        self.assertIsNot(rebuilt, mapped)
+        self.assertEqual(rebuilt, mapped)
+        self.assertEqual(rebuilt._map, mapped._map)
+        self.assertIn("A", rebuilt)
+
+    def test_mapped_enum_contains(self):
+        for enum in (WorkState, DBWorkState):
+            self.assertIn("running", enum)
+            self.assertIn(105, enum)
+            self.assertIn(_WorkState.RUNNING, enum)
+            self.assertNotIn("missing", enum)
+            self.assertNotIn(999, enum)
+            self.assertNotIn(_AgentState.ONLINE, enum)
+
+    def test_mapped_enum_normalize(self):
+        self.assertEqual(WorkState._normalize(105), "running")
+        self.assertEqual(WorkState._normalize(_WorkState.DONE), "done")
+        self.assertEqual(DBWorkState._normalize("running"), 105)
+        self.assertEqual(DBWorkState._normalize(105), 105)
+        self.assertIsNone(DBWorkState._normalize("missing", None))
+        with self.assertRaises(ValueError):
+            DBWorkState._normalize("missing")
+
+    def test_registered_enums(self):
+        registered = dict(
+            ((item.name, item.enum_type), item.enum)
+            for item in registered_enums())
+        self.assertIs(registered[("WorkState", str)], WorkState)
+        self.assertIs(registered[("WorkState", int)], DBWorkState)
+        self.assertEqual(
+            registered[("AgentState", int)]._asdict()["ONLINE"], 202)
+
 
 class TestPythonVersion(TestCase):
     @skipUnless(sys.version_info[0:2] == (2, 6), "Not Python 2.6")
@@ -301,6 +367,23 @@ class TestEnumValueClass(TestCase):
         v = Values(int=1, str="foo")
         self.assertEqual(hash(v), hash(v.str))
 
+    def test_slots(self):
+        v = Values(int=1, str="foo")
+        self.assertFalse(hasattr(v, "__dict__"))
+        with self.assertRaises(AttributeError):
+            v.foo = True
+
+    def test_dict_key(self):
+        v = Values(int=1, str="foo")
+        self.assertEqual({v: True}["foo"], True)
+        self.assertEqual({"foo": True}[v], True)
+
+    def test_not_equal_same_value(self):
+        v = Values(int=1, str="foo")
+        self.assertFalse(v != "foo")
+        self.assertFalse(v != 1)
+        self.assertFalse(v != Values(int=1, str="foo"))
+
     def test_input_types(self):
         with self.assertRaises(TypeError):
             Values(int="foo", str="foo")
@@ -364,3 +447,127 @@ class TestEnumValueClass(TestCase):
 
     def test_convert_str(self):
         self.assertEqual(str(Values(1, "A")), "A")
+
+
+class TestStateDict(TestCase):
+    def test_any_form(self):
+        states = StateDict(DBWorkState)
+        states[_WorkState.RUNNING] = "a"
+        self.assertEqual(states[105], "a")
+        self.assertEqual(states["running"], "a")
+        self.assertEqual(states[_WorkState.RUNNING], "a")
+        self.assertEqual(list(states), [105])
+
+        states["running"] = "b"
+        self.assertEqual(len(states), 1)
+        self.assertEqual(states.get(105), "b")
+
+        del states[105]
+        self.assertNotIn("running", states)
+
+    def test_string_keys(self):
+        states = StateDict(WorkState, {105: 1}, done=2)
+        self.assertEqual(dict(states), {"running": 1, "done": 2})
+
+        # Enums which were not cast use strings
+        self.assertEqual(
+            dict(StateDict(_WorkState, {105: 1})), {"running": 1})
+
+    def test_not_a_member(self):
+        states = StateDict(WorkState)
+        with self.assertRaises(KeyError):
+            states["missing"] = 1
+        with self.assertRaises(KeyError):
+            states[_AgentState.ONLINE]
+        self.assertNotIn("missing", states)
+        self.assertNotIn([], states)
+        self.assertIsNone(states.get("missing"))
+        self.assertIsNone(states.get([]))
+        self.assertEqual(states.get("running", 1), 1)
+
+    def test_filled(self):
+        counts = StateDict.filled(AgentState, int)
+        self.assertEqual(len(counts), len(AgentState))
+        counts[202] += 1
+        counts["online"] += 1
+        self.assertEqual(counts[_AgentState.ONLINE], 2)
+        queues = StateDict.filled(WorkState, list)
+        self.assertIsNot(queues["done"], queues["failed"])
+
+
+class TestBulkStates(TestCase):
+    states = ["running", _WorkState.DONE, 107, "running", "paused"]
+
+    def setUp(self):
+        self.check_uniqueness = Values.check_uniqueness
+        Values.check_uniqueness = False
+
+    def tearDown(self):
+        Values.check_uniqueness = self.check_uniqueness
+
+    def test_encode_array(self):
+        codes = encode_states(WorkState, self.states, use_numpy=False)
+        self.assertIsInstance(codes, array)
+        self.assertEqual(codes.typecode, "B")
+        self.assertEqual(list(codes), [105, 106, 107, 105, 100])
+
+    def test_encode_wide(self):
+        codes = encode_states(
+            OperatingSystem, ["linux", "mac", "linux"], use_numpy=False)
+        self.assertEqual(codes.typecode, "H")
+        self.assertEqual(
+            decode_states(OperatingSystem, codes), ["linux", "mac", "linux"])
+        self.assertEqual(count_states(OperatingSystem, codes)["linux"], 2)
+        self.assertEqual(
+            list(state_mask(OperatingSystem, codes, ["mac"])), [0, 1, 0])
+
+    def test_encode_invalid(self):
+        with self.assertRaises(ValueError):
+            encode_states(WorkState, ["running", "missing"], use_numpy=False)
+
+    def test_encode_negative(self):
+        enum = Enum("negative", A=Values(-4245, "A"), B=Values(1, "B"))
+        codes = encode_states(enum, ["A", "B"], use_numpy=False)
+        self.assertEqual(codes.typecode, "q")
+        self.assertEqual(decode_states(enum, codes), ["A", "B"])
+
+    def test_decode(self):
+        codes = encode_states(WorkState, self.states, use_numpy=False)
+        self.assertEqual(
+            decode_states(WorkState, codes),
+            ["running", "done", "failed", "running", "paused"])
+        self.assertEqual(
+            decode_states(DBWorkState, codes), [105, 106, 107, 105, 100])
+        with self.assertRaises(ValueError):
+            decode_states(WorkState, array("H", [1]))
+
+    def test_count(self):
+        codes = encode_states(WorkState, self.states, use_numpy=False)
+        counts = count_states(WorkState, codes)
+        self.assertIsInstance(counts, StateDict)
+        self.assertEqual(
+            dict(counts),
+            {"running": 2, "done": 1, "failed": 1, "paused": 1})
+        self.assertEqual(count_states(DBWorkState, codes)[105], 2)
+        self.assertEqual(count_states(WorkState, array("H"))["done"], 0)
+
+    def test_mask(self):
+        codes = encode_states(WorkState, self.states, use_numpy=False)
+        mask = state_mask(
+            WorkState, codes, [WorkState.RUNNING, DBWorkState.FAILED])
+        self.assertEqual(list(mask), [1, 0, 1, 1, 0])
+        with self.assertRaises(ValueError):
+            state_mask(WorkState, codes, ["missing"])
+
+    @skipIf(numpy is None, "numpy is not installed")
+    def test_numpy(self):  # pragma: no cover
+        codes = encode_states(WorkState, self.states)
+        self.assertIsInstance(codes, numpy.ndarray)
+        self.assertEqual(codes.dtype, numpy.uint8)
+        self.assertEqual(
+            list(decode_states(WorkState, codes)),
+            ["running", "done", "failed", "running", "paused"])
+        self.assertEqual(count_states(WorkState, codes)["running"], 2)
+        self.assertEqual(
+            state_mask(WorkState, codes, ["running"]).tolist(),
+            [True, False, False, True, False])
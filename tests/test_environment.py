@@ -0,0 +1,139 @@
+# No shebang line, this module is meant to be imported
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ast import literal_eval
+
+from pyfarm.core.enums import PY26, NOTSET
+
+if PY26:
+    from unittest2 import TestCase
+else:
+    from unittest import TestCase
+
+from pyfarm.core.environment import (
+    EnvironmentRegistry, EnvironmentSnapshot, Variable)
+
+
+class TestVariable(TestCase):
+    def test_default(self):
+        variable = Variable("A", int, 1)
+        self.assertEqual(variable.parse({}), 1)
+        self.assertFalse(variable.required)
+
+    def test_required(self):
+        variable = Variable("A", int, NOTSET)
+        self.assertTrue(variable.required)
+        with self.assertRaises(EnvironmentError):
+            variable.parse({})
+
+    def test_types(self):
+        self.assertIs(Variable("A", bool).parse({"A": "Yes"}), True)
+        self.assertIs(Variable("A", bool).parse({"A": "0"}), False)
+        self.assertEqual(Variable("A", int).parse({"A": "0x10"}), 16)
+        self.assertEqual(Variable("A", float).parse({"A": "2"}), 2.0)
+        self.assertEqual(Variable("A", str).parse({"A": "2"}), "2")
+        self.assertEqual(
+            Variable("A", literal_eval).parse({"A": "[1, 2]"}), [1, 2])
+        self.assertEqual(
+            Variable("A", lambda value: value.split(",")).parse(
+                {"A": "a,b"}), ["a", "b"])
+
+    def test_invalid(self):
+        for type_, value in ((bool, "foo"), (int, "1.5"), (int, "True"),
+                             (float, "'a'"), (literal_eval, "(")):
+            with self.assertRaises(ValueError):
+                Variable("A", type_).parse({"A": value})
+
+    def test_invalid_secret(self):
+        with self.assertRaises(ValueError) as context:
+            Variable("A", int, secret=True).parse({"A": "hunter2"})
+        self.assertNotIn("hunter2", str(context.exception))
+
+    def test_name(self):
+        with self.assertRaises(TypeError):
+            Variable("")
+        with self.assertRaises(TypeError):
+            Variable("A", type=None)
+
+
+class TestEnvironmentSnapshot(TestCase):
+    def test_access(self):
+        snapshot = EnvironmentSnapshot({"A": 1, "B": "b"})
+        self.assertEqual(snapshot.A, 1)
+        self.assertEqual(snapshot["B"], "b")
+        self.assertEqual(snapshot.get("C", 3), 3)
+        self.assertIn("A", snapshot)
+        self.assertEqual(sorted(snapshot), ["A", "B"])
+        self.assertEqual(len(snapshot), 2)
+        with self.assertRaises(AttributeError):
+            snapshot.C
+
+    def test_immutable(self):
+        snapshot = EnvironmentSnapshot({"A": 1})
+        with self.assertRaises(AttributeError):
+            snapshot.A = 2
+        with self.assertRaises(AttributeError):
+            del snapshot.A
+        with self.assertRaises(TypeError):
+            snapshot["A"] = 2
+
+    def test_repr_hides_secrets(self):
+        snapshot = EnvironmentSnapshot({"A": 1, "B": "hunter2"}, ["B"])
+        self.assertEqual(
+            repr(snapshot), "EnvironmentSnapshot(A=1, B=<secret>)")
+
+
+class TestEnvironmentRegistry(TestCase):
+    def setUp(self):
+        self.registry = EnvironmentRegistry()
+
+    def test_declare(self):
+        variable = self.registry.declare("A", int, 1, "desc")
+        self.assertIs(self.registry.variables["A"], variable)
+        self.assertEqual(variable.description, "desc")
+        self.assertIs(self.registry.declare("A", int, 1), variable)
+        with self.assertRaises(ValueError):
+            self.registry.declare("A", float, 1)
+
+    def test_parse(self):
+        self.registry.declare("A", int, 1)
+        self.registry.declare("B", bool, False)
+        snapshot = self.registry.parse({"B": "true"})
+        self.assertEqual(snapshot.A, 1)
+        self.assertTrue(snapshot.B)
+
+    def test_parse_reports_all_errors(self):
+        self.registry.declare("A", int, 1)
+        self.registry.declare("B", bool, False)
+        with self.assertRaises(ValueError) as context:
+            self.registry.parse({"A": "a", "B": "b"})
+        self.assertIn("$A", str(context.exception))
+        self.assertIn("$B", str(context.exception))
+
+    def test_snapshot_cached_until_refresh(self):
+        self.registry.declare("A", int, 1)
+        snapshot = self.registry.refresh({"A": "2"})
+        self.assertIs(self.registry.snapshot(), snapshot)
+        self.assertEqual(self.registry.snapshot().A, 2)
+        self.assertEqual(self.registry.refresh({}).A, 1)
+        self.assertEqual(self.registry.snapshot().A, 1)
+
+    def test_declare_invalidates_snapshot(self):
+        self.registry.declare("A", int, 1)
+        snapshot = self.registry.snapshot()
+        self.registry.declare("B", int, 2)
+        self.assertIsNot(self.registry.snapshot(), snapshot)
+        self.assertEqual(self.registry.snapshot().B, 2)
@@ -0,0 +1,109 @@
+# No shebang line, this module is meant to be imported
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Checks the cost of importing each module in :mod:`pyfarm.core` in a new
+interpreter.  Set :envvar:`PYFARM_IMPORT_BUDGET_SCALE` to scale every
+budget on slow machines.
+"""
+
+import os
+import sys
+import subprocess
+
+from pyfarm.core.enums import PY26, PY_VERSION
+
+if PY26:
+    from unittest2 import TestCase, skipIf
+else:
+    from unittest import TestCase, skipIf
+
+# Cumulative import time budget, in milliseconds, for each module.
+# This includes the modules they import, except for the
+# `pyfarm` and `pyfarm.core` packages themselves.
+BUDGETS = {
+    "pyfarm.core.enums": 25,
+    "pyfarm.core.lazy": 25,
+    "pyfarm.core.logger": 60,
+    "pyfarm.core.config": 150,
+    "pyfarm.core.environment": 150,
+    "pyfarm.core.utility": 150,
+    "pyfarm.core.bundle": 150,
+    "pyfarm.core.schema": 150,
+    "pyfarm.core.sources": 150,
+    "pyfarm.core.watch": 150}
+
+# Modules which should only be imported once they are used
+DEFERRED = (
+    "yaml", "pkg_resources", "colorama", "logging.config", "pprint",
+    "importlib.metadata")
+
+
+def run(code, *options):
+    process = subprocess.Popen(
+        [sys.executable] + list(options) + ["-c", code],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    if process.returncode != 0:  # pragma: no cover
+        raise AssertionError(stderr.decode("utf-8", "replace"))
+    return stdout.decode("utf-8"), stderr.decode("utf-8")
+
+
+def import_time(module):
+    """
+    Returns the cumulative time, in milliseconds, it took to import
+    ``module`` in a new interpreter
+    """
+    _, stderr = run("import %s" % module, "-X", "importtime")
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+
+        _, cumulative, name = line.split("|")
+        if name.strip() == module:
+            return int(cumulative) / 1000.0
+
+    raise AssertionError(  # pragma: no cover
+        "%s not found in -X importtime output" % module)
+
+
+class TestImports(TestCase):
+    def test_deferred_imports(self):
+        stdout, _ = run(
+            "import sys, pyfarm; "
+            "sys.modules.pop('pkg_resources', None); "
+            "before = set(sys.modules); "
+            "import %s; "
+            "print(','.join(sorted(set(sys.modules) - before)))" %
+            ", ".join(sorted(BUDGETS)))
+        imported = set(stdout.strip().split(","))
+        for module in DEFERRED:
+            self.assertNotIn(module, imported)
+
+    @skipIf(PY_VERSION < (3, 7), "-X importtime requires Python 3.7+")
+    def test_import_budget(self):
+        scale = float(os.environ.get("PYFARM_IMPORT_BUDGET_SCALE", 1))
+        over_budget = []
+        for module, budget in sorted(BUDGETS.items()):
+            # Use the best of a few runs so a busy machine
+            # does not cause a failure.
+            elapsed = min(import_time(module) for _ in range(3))
+            if elapsed > budget * scale:
+                over_budget.append(
+                    "%s took %.1fms (budget %sms)" % (
+                        module, elapsed, budget * scale))
+
+        self.assertFalse(over_budget, "\n".join(over_budget))
@@ -0,0 +1,61 @@
+# No shebang line, this module is meant to be imported
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+
+from pyfarm.core.enums import PY26
+
+if PY26:
+    from unittest2 import TestCase
+else:
+    from unittest import TestCase
+
+from pyfarm.core.lazy import LazyModule, is_loaded
+
+
+class TestLazyModule(TestCase):
+    def setUp(self):
+        self.original = sys.modules.pop("colorsys", None)
+
+    def tearDown(self):
+        sys.modules.pop("colorsys", None)
+        if self.original is not None:
+            sys.modules["colorsys"] = self.original
+
+    def test_deferred(self):
+        colorsys = LazyModule("colorsys")
+        self.assertFalse(is_loaded(colorsys))
+        self.assertIn("not loaded", repr(colorsys))
+        self.assertEqual(colorsys.rgb_to_hsv(0, 0, 0), (0, 0, 0))
+        self.assertTrue(is_loaded(colorsys))
+        self.assertTrue(is_loaded("colorsys"))
+        self.assertIs(colorsys.rgb_to_hsv, sys.modules["colorsys"].rgb_to_hsv)
+
+    def test_no_shadowed_attributes(self):
+        # Names such as `load` must come from the module, yaml.load for
+        # example, not the proxy.
+        json = LazyModule("json")
+        self.assertIs(json.load, sys.modules["json"].load)
+
+    def test_setattr(self):
+        colorsys = LazyModule("colorsys")
+        colorsys.ONE_THIRD = 0.5
+        self.assertEqual(sys.modules["colorsys"].ONE_THIRD, 0.5)
+
+    def test_import_error(self):
+        module = LazyModule("pyfarm_does_not_exist")
+        with self.assertRaises(ImportError):
+            module.foo
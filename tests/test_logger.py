@@ -15,8 +15,10 @@
 # limitations under the License.
 
 import os
+import sys
 import json
 import tempfile
+import subprocess
 
 from pyfarm.core.enums import PY26, PY3
 
@@ -46,6 +48,30 @@ class TestLogger(unittest.TestCase):
         self.assertEqual(logger.name, "pf.foo")
         self.assertFalse(logger.handlers)
 
+    def test_setup_deferred(self):
+        code = (
+            "import sys\n"
+            "from pyfarm.core.logger import getLogger, config\n"
+            "logger = getLogger('deferred')\n"
+            "assert not config.CONFIGURED\n"
+            "assert 'logging.config' not in sys.modules\n"
+            "assert 'colorama' not in sys.modules\n"
+            "logger.debug('hidden')\n"
+            "logger.info('shown')\n"
+            "assert config.CONFIGURED\n"
+            "logger.info('shown again')\n")
+        environment = os.environ.copy()
+        environment["PYFARM_ROOT_LOGLEVEL"] = "INFO"
+        environment.pop("PYFARM_LOGGING_CONFIG", None)
+        process = subprocess.Popen(
+            [sys.executable, "-c", code], env=environment,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        self.assertEqual(process.returncode, 0, stderr)
+        stdout = stdout.decode("utf-8")
+        self.assertNotIn("hidden", stdout)
+        self.assertEqual(stdout.count("shown"), 2)
+
     def test_config_empty(self):
         os.environ["PYFARM_LOGGING_CONFIG"] = ""
         with self.assertRaises(ValueError):
@@ -0,0 +1,162 @@
+# No shebang line, this module is meant to be imported
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import with_statement
+
+import os
+from os.path import join, dirname
+
+from pyfarm.core.enums import (
+    PY26, NOTSET, WorkState, DBWorkState, AgentState)
+
+if PY26:
+    from unittest2 import TestCase
+else:
+    from unittest import TestCase
+
+from pyfarm.core.testutil import TestCase as TempDirTestCase
+from pyfarm.core.config import Configuration
+from pyfarm.core.environment import (
+    Declaration, ReadOnlyValues, Variable, parse_int, parse_float)
+from pyfarm.core.schema import (
+    Schema, Field, SchemaError, ValidatedData, CONVERTERS)
+
+
+class TestField(TestCase):
+    def test_types(self):
+        self.assertEqual(Field("a", int).compile()("0x10"), 16)
+        self.assertEqual(Field("a", int).compile()(3), 3)
+        self.assertEqual(Field("a", float).compile()("1"), 1.0)
+        self.assertIs(Field("a", bool).compile()("yes"), True)
+        self.assertEqual(Field("a", str).compile()("foo"), "foo")
+        self.assertEqual(Field("a", list).compile()([1]), [1])
+        self.assertEqual(Field("a").compile()(object), object)
+        self.assertEqual(Field("a", lambda value: value * 2).compile()(2), 4)
+
+    def test_invalid_types(self):
+        for type_, value in ((int, "1.5"), (int, True), (int, "foo"),
+                             (float, "foo"), (bool, "maybe"), (str, 1),
+                             (dict, [])):
+            with self.assertRaises(ValueError):
+                Field("a", type_).compile()(value)
+
+    def test_shared_with_environment(self):
+        # Numbers are converted the same way environment variables are
+        self.assertIs(CONVERTERS[int], parse_int)
+        self.assertIs(CONVERTERS[float], parse_float)
+        self.assertTrue(issubclass(Field, Declaration))
+        self.assertTrue(issubclass(Variable, Declaration))
+        self.assertTrue(issubclass(ValidatedData, ReadOnlyValues))
+        self.assertTrue(Field("a", default=NOTSET).required)
+        with self.assertRaises(TypeError):
+            Field("")
+        with self.assertRaises(TypeError):
+            Field("a", type=1)
+        with self.assertRaises(TypeError):
+            Variable("A", type=None)
+
+    def test_choices(self):
+        converter = Field("a", int, choices=[1, 2]).compile()
+        self.assertEqual(converter("2"), 2)
+        with self.assertRaises(ValueError):
+            converter(3)
+
+    def test_enum_choices(self):
+        converter = Field("a", choices=WorkState).compile()
+        self.assertEqual(converter("running"), "running")
+        self.assertEqual(converter(105), "running")
+        with self.assertRaises(ValueError):
+            converter("foo")
+
+        converter = Field("a", choices=DBWorkState).compile()
+        self.assertEqual(converter("running"), 105)
+        self.assertEqual(converter(105), 105)
+
+        # values from a different enum are not accepted
+        with self.assertRaises(ValueError):
+            converter(AgentState.ONLINE)
+
+    def test_required(self):
+        self.assertTrue(Field("a", default=NOTSET).required)
+        self.assertFalse(Field("a").required)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(TypeError):
+            Field("")
+        with self.assertRaises(TypeError):
+            Field("a", type=1)
+
+
+class TestSchema(TestCase):
+    def test_validate(self):
+        schema = Schema(
+            Field("a", int), Field("b", bool, default=False),
+            Field("c", str, default="c"))
+        data = schema.validate({"a": "1", "b": "yes", "d": "ignored"})
+        self.assertIsInstance(data, ValidatedData)
+        self.assertEqual(data.a, 1)
+        self.assertIs(data["b"], True)
+        self.assertEqual(data.c, "c")
+        self.assertNotIn("d", data)
+        with self.assertRaises(AttributeError):
+            data.d
+        with self.assertRaises(AttributeError):
+            data.a = 2
+
+    def test_errors(self):
+        schema = Schema(
+            Field("a", int), Field("b", default=NOTSET),
+            Field("c", choices=WorkState))
+        with self.assertRaises(SchemaError) as context:
+            schema.validate({"a": "foo", "c": "bar"})
+        self.assertEqual(len(context.exception.errors), 3)
+        self.assertIn("'b' is required", str(context.exception))
+
+    def test_duplicate(self):
+        with self.assertRaises(ValueError):
+            Schema(Field("a"), Field("a"))
+
+
+class TestConfigurationSchema(TempDirTestCase):
+    def setUp(self):
+        super(TestConfigurationSchema, self).setUp()
+        self.config = Configuration("agent", "1.2.3")
+        self.config.system_root = self.tempdir
+        self.path = join(self.tempdir, self.config.child_dir, "agent.yml")
+        os.makedirs(dirname(self.path))
+        with open(self.path, "w") as stream:
+            stream.write("port: '50000'\nstate: 105\nroot: $port/x\n")
+
+    def test_load(self):
+        self.config.schema = Schema(
+            Field("port", int), Field("state", choices=WorkState),
+            Field("root", str), Field("retries", int, default=3))
+        self.config.load()
+        self.assertEqual(self.config.typed.port, 50000)
+        self.assertEqual(self.config.typed.state, WorkState.RUNNING)
+        self.assertEqual(self.config.typed.root, "50000/x")
+        self.assertEqual(self.config.typed.retries, 3)
+
+    def test_load_invalid(self):
+        self.config.schema = Schema(Field("state", choices=AgentState))
+        with self.assertRaises(SchemaError):
+            self.config.load()
+        self.assertIsNone(self.config.typed)
+
+    def test_without_schema(self):
+        self.config.load()
+        self.assertIsNone(self.config.typed)
+        with self.assertRaises(ValueError):
+            self.config.validate()
@@ -0,0 +1,172 @@
+# No shebang line, this module is meant to be imported
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import with_statement
+
+import json
+import threading
+from os.path import isfile
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from pyfarm.core.testutil import TestCase
+from pyfarm.core.config import Configuration
+from pyfarm.core.sources import HTTPSource
+from pyfarm.core.watch import ConfigurationWatcher, PollingBackend
+
+
+class ConfigHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers.items()))
+        if server.status != 200:
+            self.send_response(server.status)
+            self.end_headers()
+            return
+
+        if self.headers.get("If-None-Match") == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = server.body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", server.content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", server.etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHTTPSource(TestCase):
+    def setUp(self):
+        super(TestHTTPSource, self).setUp()
+        self.server = HTTPServer(("127.0.0.1", 0), ConfigHandler)
+        self.server.requests = []
+        self.server.status = 200
+        self.server.content_type = "application/json"
+        self.set_body({"a": 1, "b": "$a/x"})
+        thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.05})
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = "http://127.0.0.1:%s/agent" % self.server.server_port
+
+        self.config = Configuration("agent", "1.2.3")
+        self.config.system_root = self.tempdir
+        self.config.tempdir = self.tempdir
+
+    def set_body(self, data, etag=None):
+        self.server.body = json.dumps(data)
+        self.server.etag = etag or '"%s"' % len(self.server.requests)
+
+    def test_fetch(self):
+        source = HTTPSource(self.url)
+        self.assertEqual(source.fetch(self.tempdir), {"a": 1, "b": "$a/x"})
+        self.assertTrue(isfile(source.cache_path(self.tempdir)))
+        self.assertEqual(source.version, self.server.etag)
+        self.assertNotIn("If-None-Match", self.server.requests[0])
+
+    def test_revalidate(self):
+        source = HTTPSource(self.url)
+        data = source.fetch(self.tempdir)
+        self.assertEqual(source.fetch(self.tempdir), data)
+        self.assertEqual(
+            self.server.requests[1]["If-None-Match"], self.server.etag)
+
+        # A new instance uses the response cached on disk
+        source = HTTPSource(self.url)
+        self.assertEqual(source.fetch(self.tempdir), data)
+        self.assertEqual(
+            self.server.requests[2]["If-None-Match"], self.server.etag)
+
+    def test_returns_copy(self):
+        source = HTTPSource(self.url)
+        data = source.fetch(self.tempdir)
+        data["a"] = 2
+        data.pop("b")
+
+        # The 304 response reuses the cached data which must not have
+        # been modified above
+        self.assertEqual(source.fetch(self.tempdir), {"a": 1, "b": "$a/x"})
+        self.assertEqual(
+            self.server.requests[1]["If-None-Match"], self.server.etag)
+
+    def test_changed(self):
+        source = HTTPSource(self.url)
+        source.fetch(self.tempdir)
+        self.set_body({"a": 2}, etag='"new"')
+        self.assertEqual(source.fetch(self.tempdir), {"a": 2})
+        self.assertEqual(source.version, '"new"')
+
+    def test_unreachable(self):
+        source = HTTPSource(self.url)
+        source.fetch(self.tempdir)
+        self.server.status = 500
+        self.assertEqual(source.fetch(self.tempdir), {"a": 1, "b": "$a/x"})
+
+        source = HTTPSource(self.url + "/missing", timeout=1)
+        self.assertIsNone(source.fetch(self.tempdir))
+
+    def test_content_type(self):
+        self.server.content_type = "application/x-yaml"
+        self.server.body = "a: [1, 2]\n"
+        self.assertEqual(
+            HTTPSource(self.url).fetch(self.tempdir), {"a": [1, 2]})
+
+    def test_invalid_response(self):
+        self.server.body = "{"
+        source = HTTPSource(self.url)
+        self.assertIsNone(source.fetch(self.tempdir))
+
+    def test_unsafe_yaml(self):
+        self.server.content_type = "application/x-yaml"
+        self.server.body = "a: !!python/object/apply:os.getpid []\n"
+        self.assertIsNone(HTTPSource(self.url).fetch(self.tempdir))
+
+    def test_not_a_mapping(self):
+        self.server.body = "[1, 2]"
+        self.assertIsNone(HTTPSource(self.url).fetch(self.tempdir))
+
+        self.server.body = json.dumps({"a": 1})
+        source = HTTPSource(self.url)
+        source.fetch(self.tempdir)
+        self.set_body(1, etag='"new"')
+        self.assertEqual(source.fetch(self.tempdir), {"a": 1})
+
+    def test_configuration(self):
+        self.config.sources.append(HTTPSource(self.url))
+        self.config.load()
+        self.assertEqual(self.config["b"], "1/x")
+        self.assertEqual(self.config.provenance("a"), self.url)
+        self.assertIn(self.url, self.config.loaded)
+
+    def test_watcher(self):
+        self.config.sources.append(HTTPSource(self.url))
+        self.config.load()
+        watcher = ConfigurationWatcher(self.config, backend=PollingBackend)
+        self.assertIsNone(watcher.check())
+        self.set_body({"a": 2, "b": "$a/x"}, etag='"new"')
+        diff = watcher.check()
+        self.assertEqual(diff.changed, {"a": (1, 2)})
+        self.assertEqual(self.config["b"], "2/x")
@@ -16,11 +16,13 @@
 
 from __future__ import with_statement
 
+import os
 from json import loads
 
 from pyfarm.core.testutil import TestCase
 from pyfarm.core.enums import Values, BOOLEAN_TRUE, BOOLEAN_FALSE, NONE
-from pyfarm.core.utility import convert, dumps, ImmutableDict
+from pyfarm.core.environment import declare, refresh, registry
+from pyfarm.core.utility import convert, dumps, pretty_json, ImmutableDict
 
 
 class ConvertSize(TestCase):
@@ -48,6 +50,20 @@ class ConvertString(TestCase):
         with self.assertRaises(ValueError):
             convert.ston("[]")
 
+    def test_convert_ston_many(self):
+        self.assertEqual(convert.ston_many(["1", "2.5", "0x10"]), [1, 2.5, 16])
+        self.assertEqual(convert.ston_many(["1", 2]), [1, 2])
+
+    def test_convert_ston_many_error(self):
+        with self.assertRaises(ValueError):
+            convert.ston_many(["1", "[]"])
+
+        with self.assertRaises(TypeError):
+            convert.ston_many(["1", None])
+
+        with self.assertRaises(ValueError):
+            convert.ston_many(["1", "2.5"], types=int)
+
 
 class ConvertBool(TestCase):
     def test_convert_true(self):
@@ -107,6 +123,45 @@ class JSONDumper(TestCase):
             loads(dumps({"data": Values(1, "A")})),
             loads(dumps({"data": "A"})))
 
+    def test_pretty(self):
+        self.assertNotIn("\n", dumps({"data": 1}))
+        os.environ["PYFARM_PRETTY_JSON"] = "true"
+        try:
+            refresh()
+            self.assertIn("\n", dumps({"data": 1}))
+            self.assertNotIn("\n", dumps({"data": 1}, indent=None))
+        finally:
+            del os.environ["PYFARM_PRETTY_JSON"]
+            refresh()
+
+    def test_pretty_invalid(self):
+        os.environ["PYFARM_PRETTY_JSON"] = "maybe"
+        try:
+            self.assertRaises(ValueError, refresh)
+
+            # A failed refresh() keeps the previous snapshot, discard it
+            # so the fallback is used
+            registry._snapshot = None
+            self.assertFalse(pretty_json())
+            self.assertNotIn("\n", dumps({"data": 1}))
+        finally:
+            del os.environ["PYFARM_PRETTY_JSON"]
+            refresh()
+
+    def test_pretty_unrelated_invalid(self):
+        declare("PYFARM_TEST_DUMPS_INT", int, 0)
+        os.environ["PYFARM_TEST_DUMPS_INT"] = "foo"
+        os.environ["PYFARM_PRETTY_JSON"] = "true"
+        try:
+            self.assertRaises(ValueError, refresh)
+            self.assertTrue(pretty_json())
+            self.assertIn("\n", dumps({"data": 1}))
+        finally:
+            registry.variables.pop("PYFARM_TEST_DUMPS_INT", None)
+            del os.environ["PYFARM_TEST_DUMPS_INT"]
+            del os.environ["PYFARM_PRETTY_JSON"]
+            refresh()
+
 
 class TestImmutableDict(TestCase):
     def test_no_decorator(self):
@@ -0,0 +1,228 @@
+# No shebang line, this module is meant to be imported
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import with_statement
+
+import os
+import time
+import threading
+from os.path import join, dirname
+
+from pyfarm.core.enums import PY26
+from pyfarm.core.testutil import TestCase, restore_times
+
+if PY26:
+    from unittest2 import skipUnless
+else:
+    from unittest import skipUnless
+
+from pyfarm.core.config import Configuration
+from pyfarm.core.watch import (
+    ConfigurationWatcher, PollingBackend, InotifyBackend, diff_mappings)
+
+
+class WatcherTestCase(TestCase):
+    def setUp(self):
+        super(WatcherTestCase, self).setUp()
+        self.config = Configuration("agent", "1.2.3")
+        self.config.system_root = self.tempdir
+        self.root = join(self.tempdir, self.config.child_dir)
+        self.unversioned = join(self.root, "agent.yml")
+        self.versioned = join(self.root, "1.2", "agent.yml")
+        os.makedirs(dirname(self.versioned))
+        self.write(self.unversioned, "a: 1\nenv:\n  x: 1\n")
+        self.write(self.versioned, "b: 2\n")
+        self.environment = {}
+        self.config.load(environment=self.environment)
+
+    def write(self, path, data, age=60):
+        # Replace the file, rather than writing to it, so the
+        # watcher never sees a partially written file and
+        # the inode, and therefore the signature, always changes.
+        # The file is backdated by ``age`` seconds so its signature
+        # is settled, see Configuration.PARSED_FILE_MTIME_RESOLUTION.
+        with open(path + ".tmp", "w") as stream:
+            stream.write(data)
+        mtime = time.time() - age
+        os.utime(path + ".tmp", (mtime, mtime))
+        os.rename(path + ".tmp", path)
+
+
+class TestDiffMappings(TestCase):
+    def test_diff(self):
+        added, removed, changed = diff_mappings(
+            {"a": 1, "b": 2, "c": 3}, {"a": 1, "b": 3, "d": 4})
+        self.assertEqual(added, {"d": 4})
+        self.assertEqual(removed, {"c": 3})
+        self.assertEqual(changed, {"b": (2, 3)})
+
+
+class TestConfigurationWatcher(WatcherTestCase):
+    def test_no_changes(self):
+        watcher = ConfigurationWatcher(
+            self.config, self.environment, backend=PollingBackend)
+        self.assertIsNone(watcher.check())
+        self.assertEqual(watcher.data, {"a": 1, "b": 2})
+
+    def test_changed_file(self):
+        watcher = ConfigurationWatcher(
+            self.config, self.environment, backend=PollingBackend)
+        diffs = []
+        watcher.subscribe(lambda config, diff: diffs.append(diff))
+
+        self.write(self.versioned, "b: 3\nc: 1\n")
+        diff = watcher.check()
+        self.assertEqual(diff.added, {"c": 1})
+        self.assertEqual(diff.changed, {"b": (2, 3)})
+        self.assertEqual(diff.removed, {})
+        self.assertEqual(diffs, [diff])
+        self.assertEqual(self.config["b"], 3)
+        self.assertEqual(self.config["c"], 1)
+        self.assertEqual(watcher.data, {"a": 1, "b": 3, "c": 1})
+
+    def test_single_generation(self):
+        self.config.copy_on_write = True
+        watcher = ConfigurationWatcher(
+            self.config, self.environment, backend=PollingBackend)
+        generation = self.config.generation
+        published = self.config.snapshot()
+        self.write(self.versioned, "c: 1\n")
+        watcher.check()
+        self.assertEqual(self.config.generation, generation + 1)
+        self.assertEqual(dict(self.config.snapshot()), {"a": 1, "c": 1})
+        self.assertEqual(dict(published), {"a": 1, "b": 2})
+
+    def test_fragment_added(self):
+        fragments = join(self.root, "agent.d")
+        os.makedirs(fragments)
+        watcher = ConfigurationWatcher(
+            self.config, self.environment, backend=PollingBackend)
+        self.assertIn(fragments, watcher.directories())
+        self.write(join(fragments, "10-c.yml"), "c: 1\n")
+        diff = watcher.check()
+        self.assertEqual(diff.added, {"c": 1})
+        os.remove(join(fragments, "10-c.yml"))
+        diff = watcher.check()
+        self.assertEqual(diff.removed, {"c": 1})
+
+    def test_only_changed_files_parsed(self):
+        watcher = ConfigurationWatcher(
+            self.config, self.environment, backend=PollingBackend)
+        parsed = []
+        parse_file = self.config._parse_file
+
+        def record(filepath):
+            parsed.append(filepath)
+            return parse_file(filepath)
+
+        self.config._parse_file = record
+        self.write(self.versioned, "b: 3\n")
+        watcher.check()
+        self.assertEqual(parsed, [self.versioned])
+
+    def test_recent_change(self):
+        self.write(self.versioned, "b: 2\n", age=0)
+        self.config.load(environment=self.environment)
+        watcher = ConfigurationWatcher(
+            self.config, self.environment, backend=PollingBackend)
+
+        # Rewritten without changing the signature, as can happen
+        # within a single tick of the modification time
+        stat = os.stat(self.versioned)
+        with open(self.versioned, "w") as stream:
+            stream.write("b: 5\n")
+        restore_times(self.versioned, stat)
+        diff = watcher.check()
+        self.assertEqual(diff.changed, {"b": (2, 5)})
+
+    def test_removed_file(self):
+        watcher = ConfigurationWatcher(
+            self.config, self.environment, backend=PollingBackend)
+        os.remove(self.unversioned)
+        diff = watcher.check()
+        self.assertEqual(diff.removed, {"a": 1})
+        self.assertNotIn("a", self.config)
+        self.assertEqual(self.config.loaded, (self.versioned, ))
+
+    def test_new_file(self):
+        watcher = ConfigurationWatcher(
+            self.config, self.environment, backend=PollingBackend)
+        path = join(self.root, "1.2.3", "agent.yml")
+        os.makedirs(dirname(path))
+        self.write(path, "b: 4\nc: 4\n")
+        diff = watcher.check()
+        self.assertEqual(diff.added, {"c": 4})
+        self.assertEqual(diff.changed, {})
+        self.assertEqual(self.config["b"], 2)
+        self.assertEqual(
+            self.config.loaded, (path, self.versioned, self.unversioned))
+
+    def test_environment(self):
+        watcher = ConfigurationWatcher(
+            self.config, self.environment, backend=PollingBackend)
+        self.assertEqual(self.environment, {"x": 1})
+        self.write(self.versioned, "b: 2\nenv:\n  x: 1\n  y: 2\n")
+        diff = watcher.check()
+        self.assertEqual(diff.environment, {"y": 2})
+        self.assertEqual(self.environment, {"x": 1, "y": 2})
+        self.assertEqual(self.config.applied_environment, {"x": 1, "y": 2})
+
+        # Keys changed outside of the configuration are set again
+        self.environment["x"] = 0
+        self.write(self.versioned, "b: 3\nenv:\n  x: 1\n")
+        diff = watcher.check()
+        self.assertEqual(diff.environment, {"x": 1})
+        self.assertEqual(self.environment, {"x": 1, "y": 2})
+        self.assertEqual(self.config.applied_environment, {"x": 1})
+
+    def test_invalid_file_keeps_last_data(self):
+        watcher = ConfigurationWatcher(
+            self.config, self.environment, backend=PollingBackend)
+        self.write(self.versioned, "b: [")
+        self.assertIsNone(watcher.check())
+        self.assertEqual(self.config["b"], 2)
+        self.write(self.versioned, "b: 5")
+        self.assertEqual(watcher.check().changed, {"b": (2, 5)})
+
+
+class TestWatcherThread(WatcherTestCase):
+    def wait_for_change(self, backend):
+        watcher = ConfigurationWatcher(
+            self.config, self.environment, interval=0.05, backend=backend)
+        changed = threading.Event()
+        watcher.subscribe(lambda config, diff: changed.set())
+        watcher.start()
+        try:
+            self.write(self.versioned, "b: 10\n")
+            self.assertTrue(changed.wait(10))
+        finally:
+            watcher.stop(10)
+
+        self.assertIsNone(watcher.thread)
+        self.assertEqual(self.config["b"], 10)
+
+    def test_polling(self):
+        self.wait_for_change(PollingBackend)
+
+    @skipUnless(InotifyBackend.available(), "inotify is not available")
+    def test_inotify(self):
+        self.wait_for_change(InotifyBackend)
+
+    def test_configuration_watch(self):
+        watcher = self.config.watch(self.environment, start=False)
+        self.assertIsInstance(watcher, ConfigurationWatcher)
+        self.assertIsNone(watcher.thread)
+        watcher.stop()